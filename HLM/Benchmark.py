@@ -0,0 +1,203 @@
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+import numpy as np
+
+import BlakeleyBatch
+import MultiplierEngines
+import ProcessBackend
+from BlakeleyParalell import blakeley_module, splitE, rsa_stage_exponentiate
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utilities', 'tb_utilities', 'rsa_tests_gen'))
+from rsa_tests_gen import testcase_files, read_testcase, words_to_ints, COMMAND_ENCRYPT, KEY_N, KEY_D
+
+'''
+Benchmark suite for the hot paths of the model. Every benchmark reports a throughput (higher is better)
+and the results are stored as JSON, such that a run can be compared against a stored baseline.
+
+    "micro"  - blakeley_module at 16, 64 and 256 bits and splitE of a 256 bit key over 16 stages
+    "stage"  - messages/s of one rsa_stage_module slice at 256 bits, for blakeley_module, the batch
+               engine at BlakeleyBatch.BATCH_LANES lanes and every engine in MultiplierEngines
+    "corpus" - end to end rsa_core over the short_tests and long_tests corpora of the testbench, on the
+               shard process backend (the threaded rsa_core() never returns). The outputs are checked
+               against the golden files, a benchmark with mismatches fails
+
+Results file:
+    {"meta": {...}, "results": {name: {"value": best, "median": .., "unit": .., "samples": [..], ..}}}
+"value" is the best sample, as timeit recommends, since slower samples are mostly noise of the host.
+
+    Benchmark.py run [results.json] [suites] [limit]          - suites comma separated, default all
+    Benchmark.py compare baseline.json results.json [threshold] - exit code 1 on a regression
+'''
+
+SUITES = ["micro", "stage", "corpus"]
+KEY_LENGTH = 256
+NUM_STAGES = 16
+REPEAT = 5
+THRESHOLD = 0.10  ## Relative throughput drop counted as a regression
+CORPUS_LIMIT = 16  ## Blocks per testcase in the corpus runs, None runs the whole corpus
+CORPUS_REPEAT = 2
+CORPORA = {"short_tests": "short_test", "long_tests": "long_test"}
+CORPUS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Code', 'RSA_accelerator', 'testbench', 'rsa_tests')
+CORPUS_SIZES = 3  ## Encrypt testcases per corpus, the same number of decrypt testcases follow
+
+N = KEY_N
+D = KEY_D
+
+
+def measure(function, items=1, unit="ops/s", repeat=REPEAT):
+    '''Throughput of function in items/s. The number of calls per sample is calibrated like timeit'''
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    samples = [items*number/elapsed for elapsed in timer.repeat(repeat, number)]
+    return {"value": max(samples), "median": statistics.median(samples), "unit": unit, "samples": samples, "number": number}
+
+def microBenchmarks(rng):
+    results = {}
+    for w in (16, 64, 256):
+        n = rng.randint(2**(w-1), 2**w-1) | 1
+        a, b = rng.randint(0, n-1), rng.randint(0, n-1)
+        results[f"micro/blakeley_module/w{w}"] = measure(lambda: blakeley_module(a, b, n), unit="mult/s")
+    results[f"micro/splitE/{KEY_LENGTH}x{NUM_STAGES}"] = measure(lambda: splitE(D, KEY_LENGTH, NUM_STAGES), unit="calls/s")
+    return results
+
+def stageBenchmarks(rng, lanes=BlakeleyBatch.BATCH_LANES):
+    '''One slice of d, the densest slice a stage runs with the notebook key, at KEY_LENGTH bits'''
+    sliceWidth = KEY_LENGTH // NUM_STAGES
+    eSlice = max(splitE(D, KEY_LENGTH, NUM_STAGES), key=lambda s: bin(s).count('1'))
+    M = [rng.randint(0, N-1) for _ in range(lanes)]
+    results = {}
+    results[f"stage/scalar/w{KEY_LENGTH}"] = measure(lambda: rsa_stage_exponentiate(eSlice, 1, M[0], N, sliceWidth), unit="msg/s")
+    C = [1 for _ in M]
+    results[f"stage/batch{lanes}/w{KEY_LENGTH}"] = measure(lambda: BlakeleyBatch.rsa_stage_module_batch(eSlice, C, M, N, sliceWidth),
+                                                           items=lanes, unit="msg/s")
+    for name, engine in MultiplierEngines.ENGINES.items():
+        one = engine.to_domain(1, N, KEY_LENGTH)
+        P = engine.to_domain(M[0], N, KEY_LENGTH)
+        results[f"stage/{name}/w{KEY_LENGTH}"] = measure(lambda: rsa_stage_exponentiate(eSlice, one, P, N, sliceWidth, engine), unit="msg/s")
+    return results
+
+def corpusCases(corpus, limit=CORPUS_LIMIT):
+    '''Returns [(exponent, n, cases, golden)] for every testcase of the corpus, cases are [M, ID] pairs'''
+    testcases = []
+    for testcase in range(2*CORPUS_SIZES):
+        inp_file, otp_file = testcase_files(os.path.join(CORPUS_FOLDER, corpus), CORPORA[corpus], testcase, CORPUS_SIZES)
+        key, inp, otp = read_testcase(inp_file, otp_file)
+        exponent = key["e"] if key["command"] == COMMAND_ENCRYPT else key["d"]
+        messages = words_to_ints(inp)[:limit]
+        testcases.append((exponent, key["n"], [[M, i] for i, M in enumerate(messages)], words_to_ints(otp)[:limit]))
+    return testcases
+
+def corpusBenchmarks(limit=CORPUS_LIMIT, repeat=CORPUS_REPEAT, engine="scalar"):
+    ## The shards of a small corpus hold a few messages, too few lanes for the batch engine to pay off
+    results = {}
+    for corpus in CORPORA:
+        testcases = corpusCases(corpus, limit)
+        numMessages = sum(len(cases) for _, _, cases, _ in testcases)
+        samples = []
+        mismatches = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs = [ProcessBackend.rsa_core_processes(cases, e=exponent, n=n, keyLength=KEY_LENGTH, numStages=NUM_STAGES,
+                                                         mode="shard", engine=engine)
+                       for exponent, n, cases, _ in testcases]
+            samples.append(numMessages/(time.perf_counter()-start))
+            mismatches = sum(output.get(i) != C for output, (_, _, _, golden) in zip(outputs, testcases) for i, C in enumerate(golden))
+        results[f"corpus/{corpus}/{engine}"] = {"value": max(samples), "median": statistics.median(samples), "unit": "msg/s",
+                                                "samples": samples, "messages": numMessages, "mismatches": mismatches}
+    return results
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def runSuites(suites=SUITES, limit=CORPUS_LIMIT, seed=0):
+    rng = random.Random(seed)
+    results = {}
+    for suite in suites:
+        print(f"Running {suite} benchmarks...")
+        if suite == "micro":
+            results.update(microBenchmarks(rng))
+        elif suite == "stage":
+            results.update(stageBenchmarks(rng))
+        elif suite == "corpus":
+            results.update(corpusBenchmarks(limit))
+        else:
+            print(f"Error: unknown benchmark suite {suite}, known suites are {SUITES}")
+            raise ValueError
+    meta = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": gitCommit(),
+            "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "cpus": os.cpu_count(), "key_length": KEY_LENGTH, "stages": NUM_STAGES, "corpus_limit": limit}
+    return {"meta": meta, "results": results}
+
+def reportResults(results):
+    print(f"\n--- Benchmarks, commit {results['meta']['commit']}, Python {results['meta']['python']}, {results['meta']['cpus']} cores ---\n")
+    print(f"{'Benchmark':<34} {'best':<14} {'median':<14} {'unit':<8} {'check'}")
+    for name, result in results["results"].items():
+        check = "" if "mismatches" not in result else ("PASSED" if result["mismatches"] == 0 else f"FAILED ({result['mismatches']})")
+        print(f"{name:<34} {result['value']:<14.2f} {result['median']:<14.2f} {result['unit']:<8} {check}")
+
+def compareResults(baseline, current, threshold=THRESHOLD):
+    '''Prints current against baseline and returns the names of the benchmarks that regressed by more
+    than threshold, or that produce wrong results'''
+    print(f"\n--- Compare {baseline['meta']['commit']} -> {current['meta']['commit']}, threshold {threshold:.0%} ---\n")
+    print(f"{'Benchmark':<34} {'baseline':<14} {'current':<14} {'change':<9} {'status'}")
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<34} {'-':<14} {result['value']:<14.2f} {'-':<9} new")
+            continue
+        ratio = result["value"]/baseline["results"][name]["value"]
+        status = "ok"
+        if result.get("mismatches"):
+            status = f"FAILED ({result['mismatches']} mismatches)"
+        elif ratio < 1-threshold:
+            status = "REGRESSION"
+        if status != "ok":
+            regressions.append(name)
+        print(f"{name:<34} {baseline['results'][name]['value']:<14.2f} {result['value']:<14.2f} {ratio-1:<+9.1%} {status}")
+    for name in baseline["results"]:
+        if name not in current["results"]:
+            print(f"{name:<34} {baseline['results'][name]['value']:<14.2f} {'-':<14} {'-':<9} not run")
+    print(f"\n{len(regressions)} regressions" if regressions else "\nNo regressions")
+    return regressions
+
+def loadResults(filename):
+    with open(filename, mode='r') as file:
+        return json.load(file)
+
+def saveResults(results, filename):
+    with open(filename, mode='w') as file:
+        json.dump(results, file, indent=2)
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if command == "run":
+        filename = sys.argv[2] if len(sys.argv) > 2 else "benchmark.json"
+        suites = sys.argv[3].split(",") if len(sys.argv) > 3 else SUITES
+        limit = None if len(sys.argv) > 4 and sys.argv[4] == "all" else int(sys.argv[4]) if len(sys.argv) > 4 else CORPUS_LIMIT
+        results = runSuites(suites, limit)
+        reportResults(results)
+        saveResults(results, filename)
+        print(f"\nWrote {filename}")
+    elif command == "compare":
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else THRESHOLD
+        if compareResults(loadResults(sys.argv[2]), loadResults(sys.argv[3]), threshold):
+            sys.exit(1)
+    else:
+        print(f"Error: unknown command {command}, use run or compare")
+        raise ValueError
+
+if __name__ == "__main__":
+    main()
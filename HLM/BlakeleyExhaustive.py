@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import BlakeleyBatch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utilities', 'tb_utilities'))
+from tb_stream import format_row, end_row
+
+'''
+Exhaustive equivalence check of the batched Blakeley engine at small widths. bm_testcase_gen.py samples
+random 256 bit (A, B, N), which almost never hits the corners of the double conditional subtraction.
+Here every valid triple of a width is enumerated as NumPy arrays, n in 1..2^w-1 and a, b < n, that is
+about 2^(3w)/3 triples (5.6 million at w = 8, 45 million at w = 9):
+
+    multiplication - BlakeleyBatch.blakeley_limbs(a, b, n) against (a*b) % n
+    stage          - BlakeleyBatch.stage_limbs over every eSlice of the slice width, for every (C, P, n),
+                     against C*P^eSlice mod n and P^(2^sliceWidth) mod n
+    coverage       - how often the corners of the recurrence were hit: the second subtraction (R >= 2N),
+                     R = 2N-1 and R = N-1 before the subtractions, and B = N-1. R >= 3N would overflow the
+                     c_block_size+2 bits of sum_out in blakeley_module_datapath.vhd
+
+Failing multiplications are written as A,B,N,expected R rows of c_block_size = 256 bits, the format of
+bm_cases.csv, such that bm_tester.vhd can run them on the RTL.
+'''
+
+WIDTH = 8
+STAGE_OPERAND_WIDTH = 6
+STAGE_SLICE_WIDTH = 4
+LANES = 1 << 22  ## Triples per batch
+MAX_WIDTH = 16  ## One uint64 limb holds R < 3N, 2^(3w)/3 triples are out of reach above this anyway
+MAX_FAILURES = 10000  ## Failing cases kept for the vector file
+BM_BLOCK_SIZE = 256  ## c_block_size of bm_tester.vhd
+FAILURE_FILE = "bm_exhaustive_cases.csv"
+
+
+def triples(width, lanes=LANES):
+    '''Yields (a, b, n) uint64 arrays of every n < 2^width and a, b < n, in batches of about lanes triples'''
+    if not 1 <= width <= MAX_WIDTH:
+        print(f"Error: width {width} is not in 1..{MAX_WIDTH}")
+        raise ValueError
+    batch = []
+    size = 0
+    for n in range(1, 1 << width):
+        a, b = np.divmod(np.arange(n*n, dtype=np.uint64), np.uint64(n))
+        batch.append((a, b, np.full(n*n, n, dtype=np.uint64)))
+        size += n*n
+        if size >= lanes:
+            yield tuple(np.concatenate(values) for values in zip(*batch))
+            batch = []
+            size = 0
+    if batch:
+        yield tuple(np.concatenate(values) for values in zip(*batch))
+
+def modulus(n):
+    ## -N and -2N of modulusLimbs, shape (1, 2, lanes), without going through Python ints
+    return np.stack((np.uint64(0) - n, np.uint64(0) - 2*n))[np.newaxis]
+
+def coverage(a, b, n, width):
+    '''Counts the corners hit by the recurrence of blakeley_module, run on plain uint64 arrays'''
+    counts = {"second subtraction": 0, "R = 2N-1": 0, "R = N-1": 0, "B = N-1": int(np.count_nonzero(b == n-1)), "R >= 3N": 0}
+    R = np.zeros_like(n)
+    for i in range(width-1, -1, -1):
+        R = 2*R + ((a >> np.uint64(i)) & np.uint64(1))*b
+        counts["second subtraction"] += int(np.count_nonzero(R >= 2*n))
+        counts["R = 2N-1"] += int(np.count_nonzero(R == 2*n-1))
+        counts["R = N-1"] += int(np.count_nonzero(R == n-1))
+        counts["R >= 3N"] += int(np.count_nonzero(R >= 3*n))
+        R = np.where(R >= 2*n, R-2*n, np.where(R >= n, R-n, R))
+    return counts
+
+def checkMultiplication(width=WIDTH, lanes=LANES, maxFailures=MAX_FAILURES):
+    '''Returns (triples, failures, coverage), failures are (a, b, n, expected) up to maxFailures'''
+    total = 0
+    failures = []
+    numFailures = 0
+    counts = {}
+    for a, b, n in triples(width, lanes):
+        R = BlakeleyBatch.blakeley_limbs(a[np.newaxis], b[np.newaxis], modulus(n), width)[0]
+        expected = (a*b) % n
+        wrong = np.flatnonzero(R != expected)
+        numFailures += len(wrong)
+        for i in wrong[:maxFailures-len(failures)]:
+            failures.append((int(a[i]), int(b[i]), int(n[i]), int(expected[i])))
+        for name, count in coverage(a, b, n, width).items():
+            counts[name] = counts.get(name, 0) + count
+        total += len(n)
+    return total, numFailures, failures, counts
+
+def checkStage(width=STAGE_OPERAND_WIDTH, sliceWidth=STAGE_SLICE_WIDTH, lanes=LANES, maxFailures=MAX_FAILURES):
+    '''Returns (cases, failures, first failures), a case is one (C, P, n) with one eSlice'''
+    total = 0
+    numFailures = 0
+    failures = []
+    for C, P, n in triples(width, lanes):
+        negN = modulus(n)
+        for eSlice in range(1 << sliceWidth):
+            newC, newP = BlakeleyBatch.stage_limbs(eSlice, C[np.newaxis], P[np.newaxis], negN, sliceWidth, width)
+            expectedC, expectedP = C % n, P % n
+            for i in range(sliceWidth):
+                if (eSlice >> i) & 1:
+                    expectedC = (expectedC*expectedP) % n
+                expectedP = (expectedP*expectedP) % n
+            wrong = np.flatnonzero((newC[0] != expectedC) | (newP[0] != expectedP))
+            numFailures += len(wrong)
+            for i in wrong[:maxFailures-len(failures)]:
+                failures.append((eSlice, int(C[i]), int(P[i]), int(n[i]), int(newC[0][i]), int(expectedC[i])))
+            total += len(n)
+    return total, numFailures, failures
+
+def writeFailures(failures, filename=FAILURE_FILE, blockSize=BM_BLOCK_SIZE):
+    with open(filename, mode='w', newline='') as file:
+        for case in failures:
+            file.write(format_row(case, "csv", blockSize))
+        file.write(end_row(4, "csv", blockSize))
+
+def main():
+    ## BlakeleyExhaustive.py [width] [stage operand width] [stage slice width] [failures.csv]
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else WIDTH
+    stageWidth = int(sys.argv[2]) if len(sys.argv) > 2 else STAGE_OPERAND_WIDTH
+    sliceWidth = int(sys.argv[3]) if len(sys.argv) > 3 else STAGE_SLICE_WIDTH
+    failureFile = sys.argv[4] if len(sys.argv) > 4 else FAILURE_FILE
+
+    start = time.time()
+    total, numFailures, failures, counts = checkMultiplication(width)
+    print(f"\n--- blakeley_limbs, every a, b < n < 2^{width} ---\n")
+    print(f"{total} triples in {time.time()-start:.2f} s, {numFailures} failures")
+    print("Corners hit: " + ", ".join(f"{name} {count}" for name, count in counts.items()))
+    if failures:
+        writeFailures(failures, failureFile)
+        print(f"Wrote {len(failures)} failing cases to {failureFile} for bm_tester.vhd")
+
+    start = time.time()
+    stageTotal, stageFailures, stageFirst = checkStage(stageWidth, sliceWidth)
+    print(f"\n--- stage_limbs, every C, P < n < 2^{stageWidth} and every {sliceWidth} bit eSlice ---\n")
+    print(f"{stageTotal} cases in {time.time()-start:.2f} s, {stageFailures} failures")
+    for eSlice, C, P, n, got, expected in stageFirst[:10]:
+        print(f"    eSlice {eSlice:#x}, C {C}, P {P}, n {n}: C {got}, expected {expected}")
+
+    print("\nAll cases are correct!" if numFailures + stageFailures == 0 else "\nThere were failures.")
+
+if __name__ == "__main__":
+    main()
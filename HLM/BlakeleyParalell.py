@@ -1,21 +1,44 @@
 import threading
-import time
 import csv
+import os
 import queue
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
+import sys
+import BlakeleyBatch
+import KeySchedule
+import MultiplierEngines
+import PipelineTrace
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utilities', 'tb_utilities'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utilities', 'files_for_the_pynq_sd_card'))
+try:
+    from tb_verify import verify_results, print_summary
+    from rsa_reference import reference, result_cache
+except ImportError:
+    ## Without the Utilities folder (or numpy) reportResults checks the results with pow
+    verify_results = None
 
 NUM_PIPELINE_STAGES = 16 #Set dependent of PPA in final implementation
 KEY_LENGTH = 256 #Should be 256 in final implemntation
 
+STAGE_ENGINE = "scalar"  ## "scalar": blakeley_module per message, "batch": BlakeleyBatch over all messages of a beat
+BATCH_SIZE = None  ## Number of messages carried through the pipeline per beat, None: 1 for "scalar", BlakeleyBatch.BATCH_LANES for "batch"
+MULTIPLIER_ENGINE = None  ## None: blakeley_module, otherwise the name of an engine in MultiplierEngines.ENGINES
+SLICE_WIDTHS = None  ## None: KEY_LENGTH/NUM_PIPELINE_STAGES bits per stage, otherwise the width of every stage, see ExponentPartition.py
+
+GANTT_CHART = False  ## Plot the Gantt chart at the end of the run (imports matplotlib)
+TRACE_FILE = None  ## Export the pipeline trace, ".vcd" for VCD, otherwise Chrome trace JSON
+TRACE_CAPACITY = 1 << 16  ## Events kept per stage
+
 E = 8954    ## Encryption key
 N = 25553    ## Modulus
+KEYS = {0: (E, N)}  ## Key ID: (E, N), messages select a key with the optional KEY column of testCases.csv
 
 
 messages = {}
+messageKeys = {}
 
-pipelineLog = []
-pipelineLogMtx = threading.Lock()
+## Every stage thread only writes its own row of the trace, so no lock is needed
+pipelineTrace = PipelineTrace.TraceBuffer(NUM_PIPELINE_STAGES, TRACE_CAPACITY)
 
 caseMtx = threading.Lock()
 
@@ -24,8 +47,10 @@ pipelinentermediates holds:
     [0] - Intermediate C after stage ID-1
     [1] - Intermediate P after stage ID-1
     [2] - Keeps the message ID
+    [3] - Keeps the key ID, all messages of a beat have the same key
+Each element is a list with one entry per message in the beat (up to getBeatSize() messages)
 '''
-pipelineIntermediates = [[queue.Queue() for _ in range(3)] for _ in range(NUM_PIPELINE_STAGES+2)]
+pipelineIntermediates = [[queue.Queue() for _ in range(4)] for _ in range(NUM_PIPELINE_STAGES+2)]
 intermediatesLoaded = [threading.Semaphore(0) for _ in range(NUM_PIPELINE_STAGES+2)]
 intermediatesPopped = [threading.Semaphore(1) for _ in range(NUM_PIPELINE_STAGES+2)]
 intermediateMtx = [threading.Lock() for _ in range(NUM_PIPELINE_STAGES+2)]
@@ -46,9 +71,15 @@ def getCases(filename):
         for case in reader:
             M = int(case['M'])
             messageID = int(case['ID'])
-            casesQueue.put([M, messageID])
+            if case.get('KEY'):
+                keyID = int(case['KEY'])
+                casesQueue.put([M, messageID, keyID])
+            else:
+                keyID = 0
+                casesQueue.put([M, messageID])
 
             messages[messageID] = [M]   ## For final reults        
+            messageKeys[messageID] = keyID
     return casesQueue
 
 def splitE(number, keyLength, pipelineStages):
@@ -61,41 +92,45 @@ def splitE(number, keyLength, pipelineStages):
     return decimal_numbers[::-1]
 
 def reportResults():
-    print("\n--- Report results in hex ---\n")
-    mismatch_found = False
-    
-    # Print the header
-    print(f"{'Message ID':<15} {'Pipeline Result':<20} {'Expected Result':<20} {'Mismatch':<10}")
-    print("-" * 65)  # Divider line
+    ## The pipeline results are checked against the golden outputs of the result cache, see tb_verify.py
+    print("\n--- Report results ---\n")
+    results = {messageID: (data[0], data[1] if len(data) > 1 else None) for messageID, data in messages.items()}
+    if verify_results is None:
+        errors = 0
+        for messageID, (M, C) in results.items():
+            e, n = KEYS[messageKeys.get(messageID, 0)]
+            if C != pow(M, e, n):
+                print(f"Message {messageID}: M {M}, expected {pow(M, e, n)}, got {C}")
+                errors += 1
+        print(f"Pipeline results: {len(results)} checked with pow, {errors} errors")
+    else:
+        summary = verify_results(results, KEYS, messageKeys)
+        errors = print_summary(summary, "Pipeline results")
+        reference.report()
+        result_cache.report()
 
-    for messageID, data in messages.items():
-        M = data[0]  # Original message
-        pipelineResult = data[1]  # Result from the pipeline
-        
-        expectedResult = pow(M, E, N)
-        mismatch = "Yes" if pipelineResult != expectedResult else "No"
-        print(f"{messageID:<15} {hex(pipelineResult):<20} {hex(expectedResult):<20} {mismatch:<10}")
-        
-        if pipelineResult != expectedResult:
-            print(f"Mismatch found for message ID {messageID}!")
-            mismatch_found = True
-    
-    if not mismatch_found:
+    if errors == 0:
         print("\nAll results are correct!")
     else:
         print("\nThere were mismatches in the results.")
 
 
 def generateGanttChart():
-    # Organize data from pipelineLog
+    import matplotlib.pyplot as plt
+
+    # Organize data from pipelineTrace
     stages_by_message = {}
-    for stageID, messageID, currentC, currentP, timestamp in pipelineLog:
+    pipelineLog = []
+    for stage in range(NUM_PIPELINE_STAGES):
+        for messageID, enter, done, exit_ in zip(*pipelineTrace.intervals(stage)):
+            pipelineLog.append((stage+1, int(messageID), enter))
+    for stageID, messageID, timestamp in pipelineLog:
         if messageID not in stages_by_message:
             stages_by_message[messageID] = []
         stages_by_message[messageID].append((stageID, timestamp))
     
     # Normalize timestamps
-    start_time = min(entry[4] for entry in pipelineLog)
+    start_time = min(entry[2] for entry in pipelineLog)
     for messageID in stages_by_message:
         stages_by_message[messageID] = [(stage, t - start_time) for stage, t in stages_by_message[messageID]]
     
@@ -158,31 +193,74 @@ def blakeley_module(a, b, n):
     return R
 
 
+def rsa_stage_exponentiate(eSlice, currentC, currentP, n, sliceWidth, engine=None, width=KEY_LENGTH):
+    ## width is the operand width of the engine, the keyLength C and P were converted into its domain with
+    mask = 0b1
+    for i in range(0, sliceWidth):
+        if engine is None:
+            if eSlice & mask:
+                currentC = blakeley_module(currentC, currentP, n)
+            currentP = blakeley_module(currentP, currentP, n)
+        else:
+            if eSlice & mask:
+                currentC = engine.multiply(currentC, currentP, n, width)
+            currentP = engine.multiply(currentP, currentP, n, width)
+        mask = mask << 1
+    return currentC, currentP
+
+def getBeatSize(batchSize=None, engine=None):
+    ## The batch engine is slower than blakeley_module below about 100 lanes, see BlakeleyBatch.py
+    batchSize = BATCH_SIZE if batchSize is None else batchSize
+    engine = STAGE_ENGINE if engine is None else engine
+    if batchSize is not None:
+        return batchSize
+    return BlakeleyBatch.BATCH_LANES if engine == "batch" else 1
+
+def caseKey(case):
+    return case[2] if len(case) > 2 else 0
+
+def getMultiplier():
+    if MULTIPLIER_ENGINE is None:
+        return None
+    return MultiplierEngines.getEngine(MULTIPLIER_ENGINE)
+
+
 def axi_in(stageID):
     while(True):
         ## Request the pipeline controller a new case
         requestNewCase.release()
         grantNewCase.acquire()
 
-        ## Get the next case
+        ## Get the next case, a beat only holds messages with the same key
         caseMtx.acquire()
-        nextCase = cases.get()
+        nextCases = [cases.get()]
+        while len(nextCases) < getBeatSize() and not cases.empty() and caseKey(getQueueElement(cases)) == caseKey(nextCases[0]):
+            nextCases.append(cases.get())
         caseMtx.release()
+        keyID = caseKey(nextCases[0])
+        n = keySchedules.get(keyID).n
         
         ## Wait for asynch signal from next stage that it has popped off the previous values in time
         intermediatesPopped[stageID].acquire()
 
         ## Push values to pipelineIntermediates
         intermediateMtx[stageID].acquire()
-        pipelineIntermediates[stageID][0].put(1)
-        pipelineIntermediates[stageID][1].put(nextCase[0])
-        pipelineIntermediates[stageID][2].put(nextCase[1])
+        ## C and P are kept in the number domain of the multiplier engine through the pipeline
+        engine = getMultiplier()
+        if engine is None:
+            pipelineIntermediates[stageID][0].put([1 for _ in nextCases])
+            pipelineIntermediates[stageID][1].put([case[0] for case in nextCases])
+        else:
+            pipelineIntermediates[stageID][0].put([engine.to_domain(1, n, KEY_LENGTH) for _ in nextCases])
+            pipelineIntermediates[stageID][1].put([engine.to_domain(case[0], n, KEY_LENGTH) for case in nextCases])
+        pipelineIntermediates[stageID][2].put([case[1] for case in nextCases])
+        pipelineIntermediates[stageID][3].put(keyID)
         intermediateMtx[stageID].release()
 
         ## Signal to next stage that data is ready
         intermediatesLoaded[stageID].release()
 
-def rsa_stage_module(eSlice,n,stageID):
+def rsa_stage_module(stageID):
     while(True):
         ## Wait for asynch signal from previous stage that data is ready
         intermediatesLoaded[stageID-1].acquire()
@@ -192,30 +270,36 @@ def rsa_stage_module(eSlice,n,stageID):
         currentC = pipelineIntermediates[stageID-1][0].get(0)
         currentP = pipelineIntermediates[stageID-1][1].get(0)
         currentID = pipelineIntermediates[stageID-1][2].get()
+        currentKey = pipelineIntermediates[stageID-1][3].get()
         intermediateMtx[stageID-1].release()
 
         ## Signal to previous stage it has popped, such that the previous stage can replace its values
         intermediatesPopped[stageID-1].release()
 
-        pipelineLogMtx.acquire()
-        pipelineLog.append([stageID, currentID, currentC, currentP, time.time()])
-        pipelineLogMtx.release()
+        ## A beat is traced by the ID of its first message
+        pipelineTrace.record(stageID-1, PipelineTrace.ENTER, currentID[0])
+
+        ## Look up the slice of e and the modulus of the key of the beat
+        schedule = keySchedules.get(currentKey)
+        eSlice = schedule.eSlices[stageID-1]
+        sliceWidth = schedule.sliceWidths[stageID-1]
+        n = schedule.n
 
         ## Accumulate new values
-        if KEY_LENGTH % NUM_PIPELINE_STAGES != 0:
+        if SLICE_WIDTHS is None and KEY_LENGTH % NUM_PIPELINE_STAGES != 0:
             print(f"Error: KEY_LENGTH / NUM_PIPELINE_STAGES is not an integer")
             raise ValueError
 
-        if len(bin(eSlice)[2:]) > (KEY_LENGTH/NUM_PIPELINE_STAGES):
-            print(f"Error: eSlice is {eSlice} and not KEY_LENGTH/NUM_PIPELINE_STAGES")
+        if len(bin(eSlice)[2:]) > sliceWidth:
+            print(f"Error: eSlice is {eSlice} and wider than the {sliceWidth} bits of stage {stageID}")
             raise ValueError
         
-        mask = 0b1
-        for i in range(0, int(KEY_LENGTH/NUM_PIPELINE_STAGES)):
-            if eSlice & mask:
-                currentC = blakeley_module(currentC, currentP, n)
-            currentP = blakeley_module(currentP, currentP, n)
-            mask = mask << 1
+        if STAGE_ENGINE == "batch":
+            currentC, currentP = BlakeleyBatch.rsa_stage_module_batch(eSlice, currentC, currentP, n, sliceWidth)
+        else:
+            for lane in range(len(currentID)):
+                currentC[lane], currentP[lane] = rsa_stage_exponentiate(eSlice, currentC[lane], currentP[lane], n, sliceWidth, getMultiplier())
+        pipelineTrace.record(stageID-1, PipelineTrace.DONE, currentID[0])
 
         ## Wait for asynch signal from next stage that it has popped off the previous values in time
         intermediatesPopped[stageID].acquire()
@@ -225,7 +309,10 @@ def rsa_stage_module(eSlice,n,stageID):
         pipelineIntermediates[stageID][0].put(currentC)
         pipelineIntermediates[stageID][1].put(currentP)
         pipelineIntermediates[stageID][2].put(currentID)
+        pipelineIntermediates[stageID][3].put(currentKey)
         intermediateMtx[stageID].release()
+        ## The values are handed over, the stall since DONE was the wait for the next stage to pop the previous beat
+        pipelineTrace.record(stageID-1, PipelineTrace.EXIT, currentID[0])
 
         ## Signal to next stage that data is ready
         intermediatesLoaded[stageID].release()
@@ -240,14 +327,18 @@ def axi_out(stageID):
         endC = pipelineIntermediates[stageID-1][0].get(0)
         endP = pipelineIntermediates[stageID-1][1].get(0)
         messageID = pipelineIntermediates[stageID-1][2].get(0)
+        keyID = pipelineIntermediates[stageID-1][3].get(0)
         intermediateMtx[stageID-1].release()
 
-        messages[messageID].append(endC)    ## For final reults
+        for lane in range(len(messageID)):
+            if getMultiplier() is not None:
+                endC[lane] = getMultiplier().from_domain(endC[lane], keySchedules.get(keyID).n, KEY_LENGTH)
+            messages[messageID[lane]].append(endC[lane])    ## For final reults
 
         ## Signal to previous stage it has popped, such that the previous stage can put if it lies ahead in time
         intermediatesPopped[stageID-1].release()
 
-        if(messageID == (numCases-1)):
+        if((numCases-1) in messageID):
             print("Last case out of the pipeline, signaled controller.")
             pipelineFinished.release()
 
@@ -258,9 +349,16 @@ def rsa_core_control():
         if cases.qsize() == 0:
             print("Finished, no more cases left. Awaiting signal from last pipeline stage.\n")
             pipelineFinished.acquire()
-            print("Generating Gantt Chart...")
-            generateGanttChart()
-            print(f"Results of operation: C = M {hex(E)} mod {hex(N)} (E and N in hex)\n")
+            pipelineTrace.report()
+            if TRACE_FILE is not None:
+                print(f"Writing pipeline trace to {TRACE_FILE}")
+                pipelineTrace.export(TRACE_FILE)
+            if GANTT_CHART:
+                print("Generating Gantt Chart...")
+                generateGanttChart()
+            for keyID, (e, n) in KEYS.items():
+                print(f"Results of operation: C = M {hex(e)} mod {hex(n)} (E and N in hex) for key {keyID}")
+            print(f"Key schedule cache: {keySchedules.stats()}\n")
             reportResults()
             ## Timing test does not make sence in software, as the gains from the pipelining is only existent in HW
         caseMtx.release()
@@ -274,13 +372,23 @@ def rsa_core():
     global numCases
     numCases = cases.qsize()
 
-    eSlices = splitE(E, KEY_LENGTH, NUM_PIPELINE_STAGES)
+    if STAGE_ENGINE == "batch" and MULTIPLIER_ENGINE not in (None, "blakeley2"):
+        print(f"Error: the batch stage engine only implements the radix-2 Blakeley multiplier")
+        raise ValueError
+
+    ## Every stage looks up its slice of the key of a beat in the key schedules
+    global keySchedules
+    keySchedules = KeySchedule.KeyScheduleCache(KEYS, KEY_LENGTH, NUM_PIPELINE_STAGES, multiplier=getMultiplier(), sliceWidths=SLICE_WIDTHS)
+    if any(KEY_LENGTH < max(e.bit_length(), n.bit_length()) for e, n in KEYS.values()):
+        print(f"Error: a key in KEYS is longer than KEY_LENGTH")
+        raise ValueError
+
     ## Start all threads and asynchromus communication (semaphores)
     threads = []
     threads.append(threading.Thread(target=rsa_core_control))
     threads.append(threading.Thread(target=axi_in, args=(0,)))
     for i in range(1,NUM_PIPELINE_STAGES+1):
-        threads.append(threading.Thread(target=rsa_stage_module, args=(eSlices[i-1],N,i)))
+        threads.append(threading.Thread(target=rsa_stage_module, args=(i,)))
     threads.append(threading.Thread(target=axi_out, args=(NUM_PIPELINE_STAGES+1,)))
 
     for thread in threads:
@@ -0,0 +1,464 @@
+import heapq
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+import ExponentRecoding
+import KeySchedule
+import MultiplierEngines
+import PipelineTrace
+from BlakeleyParalell import getCases, blakeley_module, KEY_LENGTH, NUM_PIPELINE_STAGES, E, N
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utilities', 'files_for_the_pynq_sd_card'))
+from rsa_reference import cache_digest, C_KEY_N, C_KEY_E, C_KEY_D
+
+'''
+Single threaded, cycle accurate discrete-event model of rsa_core.
+
+Every block of the RTL (rsa_core_control, axi_in, rsa_stage_module 1..S and axi_out) is a clocked
+process written as a generator. A process yields either:
+    int                     - stay in the current state for that many cycles
+    [(signal, value), ...]  - stay in the current state until all signals have the given values
+
+Signals driven by a process are committed after every process has been evaluated for the current
+rising edge, and are seen by the other processes from the next edge, like registered FSM outputs.
+Processes that only wait for a handshake are not evaluated again before one of their signals changes,
+so the cost of a run is proportional to the number of state changes and not to the number of cycles.
+'''
+
+F_CLK = 200 * 1e6
+
+## Cycles spent per exponent bit in RUN_BM besides the w cycles in RUN (see blakeley_module_control.vhd):
+## RUN_CP abval -> bm RUN, bm FINISHED rval -> FINISHED_CP, abval low -> bm IDLE, rval low -> RUN_CP
+CYC_BM_HANDSHAKE = 4
+
+def CYC_BLAKELEY_MODULE(w):
+    MAXCYCLES_ONE_A_BIT = 1
+    return MAXCYCLES_ONE_A_BIT*w
+
+def CYC_RUN_BM(w, esSize, multiplier=None):
+    cycMult = CYC_BLAKELEY_MODULE(w) if multiplier is None else multiplier.cycles(w)
+    return esSize*(cycMult+CYC_BM_HANDSHAKE)
+
+
+class Signal:
+    def __init__(self, name, value=0):
+        self.name = name
+        self.value = value
+        self.waiters = set()
+
+
+class Process:
+    def __init__(self, name, gen):
+        self.name = name
+        self.gen = gen
+        self.conditions = None
+        self.scheduledAt = -1
+
+
+class Simulator:
+    def __init__(self):
+        self.cycle = 0
+        self.events = []
+        self.seq = 0
+        self.pending = []
+
+    def process(self, name, gen):
+        proc = Process(name, gen)
+        self.schedule(proc, 0)
+        return proc
+
+    def schedule(self, proc, cycle):
+        if proc.scheduledAt == cycle:
+            return
+        proc.scheduledAt = cycle
+        self.seq += 1
+        heapq.heappush(self.events, (cycle, self.seq, proc))
+
+    def drive(self, signal, value):
+        self.pending.append((signal, value))
+
+    def step(self, proc):
+        if proc.conditions is not None:
+            for signal, value in proc.conditions:
+                if signal.value != value:
+                    for sig, _ in proc.conditions:
+                        sig.waiters.add(proc)
+                    return
+            proc.conditions = None
+        try:
+            cmd = next(proc.gen)
+        except StopIteration:
+            return
+        if isinstance(cmd, int):
+            self.schedule(proc, self.cycle + cmd)
+        else:
+            ## Wait for a handshake, at the earliest on the next rising edge
+            proc.conditions = cmd
+            self.schedule(proc, self.cycle + 1)
+
+    def commit(self):
+        for signal, value in self.pending:
+            if signal.value != value:
+                signal.value = value
+                for proc in signal.waiters:
+                    self.schedule(proc, self.cycle + 1)
+                signal.waiters.clear()
+        self.pending = []
+
+    def run(self, maxCycles=None):
+        while self.events:
+            cycle = self.events[0][0]
+            if maxCycles is not None and cycle > maxCycles:
+                break
+            self.cycle = cycle
+            while self.events and self.events[0][0] == cycle:
+                _, _, proc = heapq.heappop(self.events)
+                proc.scheduledAt = -1
+                self.step(proc)
+            self.commit()
+        return self.cycle
+
+
+class RsaCoreCycleModel:
+    '''
+    il[i] - ilo of pipeline element i (0 is axi_in, 1..S are the stages), ili of element i+1
+    ip[i] - ipo of pipeline element i+1 (S+1 is axi_out), ipi of element i
+    link[i] - [C, P, ID, keyID] held out by pipeline element i while il[i] is asserted
+
+    keys is {keyID: (e, n)}, by default {0: (e, n)}. A case is [M, ID] or [M, ID, keyID]. keyMode is
+    "tagged" when the key ID travels with the message and stages look their slice up in the key
+    schedule, or "drain" for a global key register, see KeySchedule.py.
+    '''
+    def __init__(self, e, n, keyLength=KEY_LENGTH, numStages=NUM_PIPELINE_STAGES, esSize=None, useBlakeley=False, multiplier="blakeley2",
+                 exponentMode="rtl", operandBits=False, keys=None, keyMode="tagged",
+                 keySwitchCycles=KeySchedule.KEY_SWITCH_CYCLES, keyLoadCycles=KeySchedule.KEY_LOAD_CYCLES, sliceWidths=None, sim=None, name="rsa_core"):
+        if sliceWidths is not None:
+            ## Uneven slice widths per stage, see ExponentPartition.py
+            esSize = max(sliceWidths)
+        elif esSize is None:
+            if keyLength % numStages != 0:
+                print(f"Error: KEY_LENGTH / NUM_PIPELINE_STAGES is not an integer")
+                raise ValueError
+            esSize = keyLength // numStages
+        if sliceWidths is None and esSize*numStages < keyLength:
+            print(f"Error: es_size*num_pipeline_stages = {esSize*numStages} does not cover KEY_LENGTH = {keyLength}")
+            raise ValueError
+
+        self.keyLength = keyLength
+        self.numStages = numStages
+        self.esSize = esSize
+        self.sliceWidths = [esSize for _ in range(numStages)] if sliceWidths is None else list(sliceWidths)
+        self.offsets = [sum(self.sliceWidths[:i]) for i in range(numStages)]
+        self.useBlakeley = useBlakeley
+        self.multiplier = MultiplierEngines.getEngine(multiplier)
+        ## Data dependent RUN_BM cycles and exponent recoding, see ExponentRecoding.py
+        if exponentMode not in ExponentRecoding.MODES:
+            print(f"Error: unknown exponent mode {exponentMode}, known modes are {ExponentRecoding.MODES}")
+            raise ValueError
+        self.exponentMode = exponentMode
+        self.opCycles = ExponentRecoding.opCyclesFunction(self.multiplier, keyLength, operandBits)
+        self.windowSize = ExponentRecoding.windowSize(exponentMode)
+        ## e is zero extended to e_block_size = es_size*num_pipeline_stages as in rsa_core.vhd
+        if keyMode not in ("tagged", "drain"):
+            print(f"Error: unknown key mode {keyMode}")
+            raise ValueError
+        self.keySchedules = KeySchedule.KeyScheduleCache({0: (e, n)} if keys is None else keys, keyLength, numStages, esSize,
+                                                         self.multiplier, self.windowSize, sliceWidths)
+        self.keyMode = keyMode
+        self.keySwitchCycles = keySwitchCycles
+        self.keyLoadCycles = keyLoadCycles
+        self.keySwitches = 0
+
+        ## Several cores can share one simulator, see MultiCore.py
+        self.sim = Simulator() if sim is None else sim
+        self.name = name
+        self.il = [Signal(f"il{i}") for i in range(numStages+1)]
+        self.ip = [Signal(f"ip{i}") for i in range(numStages+1)]
+        self.link = [None for _ in range(numStages+1)]
+        self.msginValid = Signal("msgin_valid")
+        self.msginData = Signal("msgin_data", None)
+        ## Number of messages given to the DMA, axi_in waits for it to reach its own count to drain the pipeline
+        self.outCount = Signal("out_count")
+
+        self.enterCycle = {}
+        self.exitCycle = {}
+        self.results = {}
+        self.stageBusy = [0 for _ in range(numStages+1)]
+        ## One cycle is 1e9/F_CLK ticks of 1 ns in the VCD
+        self.trace = PipelineTrace.TraceBuffer(numStages, timeUnit="cycles", timescale=("1ns", 1e9/F_CLK))
+
+    def mod_mult(self, a, b, n):
+        ## useBlakeley runs the multiplier algorithm digit by digit, otherwise the same result is computed with big ints
+        if self.useBlakeley:
+            if self.multiplier.name == "blakeley2":
+                return blakeley_module(a, b, n)
+            return self.multiplier.multiply(a, b, n, self.keyLength)
+        return self.multiplier.multiply_fast(a, b, n, self.keyLength)
+
+    def multiplyFunction(self, n):
+        return lambda a, b: self.mod_mult(a, b, n)
+
+    def rsa_core_control(self, cases):
+        sim = self.sim
+        for case in cases:
+            sim.drive(self.msginValid, 1)
+            sim.drive(self.msginData, case)
+            ## msgin_ready is asserted by axi_in in HOLD_FOR_PIPELINE when the first stage has popped
+            yield [(self.il[0], 1), (self.ip[0], 1)]
+        sim.drive(self.msginValid, 0)
+        sim.drive(self.msginData, None)
+
+    def axi_in(self):
+        sim = self.sim
+        loadedKey = None
+        inCount = 0
+        while True:
+            ## GET_FROM_AXI
+            sim.drive(self.il[0], 0)
+            yield [(self.ip[0], 0), (self.msginValid, 1)]
+            M, messageID, *key = self.msginData.value
+            keyID = key[0] if key else 0
+            if self.keyMode == "drain" and keyID != loadedKey:
+                if loadedKey is not None:
+                    ## The global key registers can only be rewritten once every message in flight is out
+                    yield [(self.outCount, inCount)]
+                    self.keySwitches += 1
+                    yield self.keyLoadCycles
+                loadedKey = keyID
+            inCount += 1
+            schedule = self.keySchedules.get(keyID)
+            self.enterCycle[messageID] = sim.cycle
+            ## Conversion of M into the number domain of the multiplier, if it has one (C = 1 is converted once per key)
+            conversionCycles = self.multiplier.conversion_cycles(self.keyLength)
+            P = self.multiplier.to_domain(M, schedule.n, self.keyLength)
+            if self.windowSize:
+                ## The odd power table of M replaces P on the links
+                P, tableCycles = ExponentRecoding.oddPowerTable(P, self.windowSize, schedule.maxDigit, self.multiplyFunction(schedule.n), self.opCycles)
+                conversionCycles += tableCycles
+            if conversionCycles > 0:
+                yield conversionCycles
+            ## HOLD_FOR_PIPELINE
+            self.link[0] = [schedule.one, P, messageID, keyID]
+            sim.drive(self.il[0], 1)
+            yield [(self.ip[0], 1)]
+
+    def rsa_stage_module(self, stageID):
+        sim = self.sim
+        width = self.sliceWidths[stageID-1]
+        runCycles = CYC_RUN_BM(self.keyLength, width, self.multiplier)
+        loadedKey = None
+        while True:
+            ## IDLE
+            sim.drive(self.il[stageID], 0)
+            sim.drive(self.ip[stageID-1], 0)
+            yield [(self.il[stageID-1], 1)]
+            ## SAVE_IN
+            currentC, currentP, currentID, keyID = self.link[stageID-1]
+            self.trace.record(stageID-1, PipelineTrace.ENTER, currentID, sim.cycle)
+            yield 1
+            ## ACK_SAVE_IN
+            sim.drive(self.ip[stageID-1], 1)
+            yield [(self.il[stageID-1], 0)]
+            ## RUN_BM
+            sim.drive(self.ip[stageID-1], 0)
+            schedule = self.keySchedules.get(keyID)
+            eSlice = schedule.eSlices[stageID-1]
+            multiply = self.multiplyFunction(schedule.n)
+            if keyID != loadedKey:
+                if loadedKey is not None and self.keyMode == "tagged":
+                    ## Load the slice and n of the new key from the key table
+                    self.keySwitches += 1
+                    yield self.keySwitchCycles
+                loadedKey = keyID
+            if self.exponentMode == "rtl":
+                mask = 0b1
+                for i in range(width):
+                    if eSlice & mask:
+                        currentC = multiply(currentC, currentP)
+                    currentP = multiply(currentP, currentP)
+                    mask = mask << 1
+                cycles = runCycles
+            elif self.windowSize:
+                currentC, cycles = ExponentRecoding.window_stage(schedule.windowSlices[stageID-1], currentC, currentP, schedule.one, multiply, self.opCycles)
+            else:
+                currentC, currentP, cycles = ExponentRecoding.binary_stage(eSlice, currentC, currentP, self.offsets[stageID-1], width, schedule.eBits,
+                                                                           schedule.one, multiply, self.opCycles, self.exponentMode == "binary")
+            self.stageBusy[stageID] += cycles
+            if cycles > 0:
+                yield cycles
+            ## HOLD_OUT
+            self.trace.record(stageID-1, PipelineTrace.DONE, currentID, sim.cycle)
+            self.link[stageID] = [currentC, currentP, currentID, keyID]
+            sim.drive(self.il[stageID], 1)
+            yield [(self.ip[stageID], 1)]
+            self.trace.record(stageID-1, PipelineTrace.EXIT, currentID, sim.cycle)
+
+    def axi_out(self):
+        sim = self.sim
+        S = self.numStages
+        while True:
+            ## WAIT_FOR_PIPELINE
+            sim.drive(self.ip[S], 0)
+            yield [(self.il[S], 1)]
+            endC, endP, messageID, keyID = self.link[S]
+            conversionCycles = self.multiplier.conversion_cycles(self.keyLength)
+            if conversionCycles > 0:
+                ## C is latched and the last stage released before it is converted out of the multiplier domain
+                sim.drive(self.ip[S], 1)
+                yield [(self.il[S], 0)]
+                sim.drive(self.ip[S], 0)
+                yield conversionCycles
+            ## GIVE_TO_AXI, msgout_ready is always asserted by the DMA
+            yield 1
+            self.exitCycle[messageID] = sim.cycle
+            self.results[messageID] = self.multiplier.from_domain(endC, self.keySchedules.get(keyID).n, self.keyLength)
+            sim.drive(self.outCount, self.outCount.value+1)
+            if conversionCycles == 0:
+                ## SIGNAL_PIPELINE
+                sim.drive(self.ip[S], 1)
+                yield [(self.il[S], 0)]
+
+    def start(self, cases=None):
+        '''Adds the processes of the core to the simulator, without rsa_core_control when cases is None'''
+        sim = self.sim
+        if cases is not None:
+            sim.process(f"{self.name}.rsa_core_control", self.rsa_core_control(cases))
+        sim.process(f"{self.name}.axi_in", self.axi_in())
+        for i in range(1, self.numStages+1):
+            sim.process(f"{self.name}.rsa_stage_module{i}", self.rsa_stage_module(i))
+        sim.process(f"{self.name}.axi_out", self.axi_out())
+
+    def run(self, cases):
+        self.start(cases)
+        self.sim.run()
+        return self.stats()
+
+    def stats(self):
+        ids = sorted(self.exitCycle, key=lambda messageID: self.exitCycle[messageID])
+        if not ids:
+            return {}
+        latencies = [self.exitCycle[i] - self.enterCycle[i] for i in ids]
+        firstOut = self.exitCycle[ids[0]]
+        lastOut = self.exitCycle[ids[-1]]
+        lastIn = max(self.enterCycle.values())
+        steadyState = (len(ids)-1)/(lastOut-firstOut) if lastOut > firstOut else 0.0
+        return {
+            "messages": len(ids),
+            "total_cycles": lastOut,
+            "cycles_per_message": {i: self.exitCycle[i] - self.enterCycle[i] for i in ids},
+            "latency_min": min(latencies),
+            "latency_avg": sum(latencies)/len(latencies),
+            "latency_max": max(latencies),
+            "fill_latency": firstOut,
+            "drain_latency": lastOut - lastIn,
+            "messages_per_cycle": steadyState,
+            "stage_utilization": [busy/lastOut for busy in self.stageBusy[1:]],
+            "stage_run_cycles": [busy/len(ids) for busy in self.stageBusy[1:]],
+            "key_switches": self.keySwitches,
+        }
+
+
+## Sources of the cycle model, a change in any of them invalidates the cached runs
+MODEL_SOURCES = ["CycleSim.py", "ExponentRecoding.py", "MultiplierEngines.py", "KeySchedule.py", "BlakeleyParalell.py"]
+
+def modelVersion():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    sources = []
+    for source in MODEL_SOURCES:
+        with open(os.path.join(folder, source), mode='rb') as file:
+            sources.append(file.read())
+    return cache_digest(*sources)
+
+def rsa_core_cycle(cases, e=E, n=N, keyLength=KEY_LENGTH, numStages=NUM_PIPELINE_STAGES, esSize=None, useBlakeley=False, multiplier="blakeley2", traceFile=None,
+                   exponentMode="rtl", operandBits=False, keys=None, keyMode="tagged", sliceWidths=None, cache=None):
+    '''Runs the cases through the cycle model, returns (results, stats). With a ResultCache of rsa_reference.py a
+    run with the same cases, keys, configuration and model sources is taken from the cache (not with a traceFile)'''
+    def run():
+        model = RsaCoreCycleModel(e, n, keyLength, numStages, esSize, useBlakeley, multiplier, exponentMode, operandBits, keys, keyMode,
+                                  sliceWidths=sliceWidths)
+        stats = model.run(cases)
+        if traceFile is not None:
+            model.trace.export(traceFile)
+        return model.results, stats
+    if cache is None or traceFile is not None:
+        return run()
+
+    def compute():
+        results, stats = run()
+        ids = list(stats.get("cycles_per_message", {}))
+        resultBytes = -(-keyLength // 8)
+        summary = {name: value for name, value in stats.items() if name != "cycles_per_message"}
+        return {"ids": np.array(ids, dtype=np.int64),
+                "results": np.frombuffer(b''.join(results[i].to_bytes(resultBytes, 'little') for i in ids), dtype=np.uint8),
+                "cycles": np.array([stats["cycles_per_message"][i] for i in ids], dtype=np.int64),
+                "stats": np.frombuffer(json.dumps(summary).encode(), dtype=np.uint8)}
+    digest = cache_digest("cycle", modelVersion(), cases, e, n, keyLength, numStages, esSize, useBlakeley, multiplier, exponentMode,
+                          operandBits, keys, keyMode, sliceWidths)
+    arrays = cache.cached(digest, compute)
+    ids = [int(i) for i in arrays["ids"]]
+    raw = arrays["results"].tobytes()
+    resultBytes = -(-keyLength // 8)
+    results = {i: int.from_bytes(raw[k*resultBytes:(k+1)*resultBytes], 'little') for k, i in enumerate(ids)}
+    stats = json.loads(arrays["stats"].tobytes().decode())
+    if ids:
+        stats["cycles_per_message"] = {i: int(cycles) for i, cycles in zip(ids, arrays["cycles"])}
+    return results, stats
+
+def reportCycles(stats, fClk=F_CLK):
+    print("\n--- Cycle report ---\n")
+    print(f"{'Messages':<30} {stats['messages']}")
+    print(f"{'Total cycles':<30} {stats['total_cycles']}")
+    print(f"{'Latency min/avg/max [cyc]':<30} {stats['latency_min']} / {stats['latency_avg']:.1f} / {stats['latency_max']}")
+    print(f"{'Pipeline fill latency [cyc]':<30} {stats['fill_latency']}")
+    print(f"{'Pipeline drain latency [cyc]':<30} {stats['drain_latency']}")
+    print(f"{'Steady state [msg/cyc]':<30} {stats['messages_per_cycle']:.3e}")
+    if stats['messages_per_cycle'] > 0:
+        print(f"{'Steady state [cyc/msg]':<30} {1/stats['messages_per_cycle']:.1f}")
+    runCycles = stats['stage_run_cycles']
+    print(f"{'RUN_BM mean/max stage [cyc]':<30} {sum(runCycles)/len(runCycles):.1f} / {max(runCycles):.1f}")
+    print(f"{'Runtime @ {:.0f} MHz'.format(fClk/1e6):<30} {round(stats['total_cycles']/fClk*1e3, 3)} ms")
+
+def checkResults(cases, results, e, n, keys=None):
+    if keys is None:
+        keys = {0: (e, n)}
+    mismatches = [case[1] for case in cases if results.get(case[1]) != pow(case[0], *keys[case[2] if len(case) > 2 else 0])]
+    if not mismatches:
+        print("\nAll results are correct!")
+    else:
+        print(f"\nThere were {len(mismatches)} mismatches in the results, first message IDs: {mismatches[:10]}")
+    return mismatches
+
+def main():
+    if len(sys.argv) > 1:
+        ## Random 256 bit messages with the key from the RSA integration kit
+        e, n = C_KEY_E, C_KEY_N
+        cases = [[random.randint(0, n-1), i] for i in range(int(sys.argv[1]))]
+    else:
+        e, n = E, N
+        casesQueue = getCases("testCases.csv")
+        cases = list(casesQueue.queue)
+
+    multiplier = sys.argv[2] if len(sys.argv) > 2 else "blakeley2"
+    ## Optional trace file, ".vcd" for VCD, otherwise Chrome trace JSON, "none" for no trace
+    traceFile = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != "none" else None
+    ## Exponent mode from ExponentRecoding.MODES, "rtl" for rsa_stage_module.vhd
+    exponentMode = sys.argv[4] if len(sys.argv) > 4 else "rtl"
+    start = time.time()
+    model = RsaCoreCycleModel(e, n, multiplier=multiplier, exponentMode=exponentMode)
+    stats = model.run(cases)
+    results = model.results
+    print(f"Simulated {len(cases)} messages in {time.time()-start:.2f} s")
+    reportCycles(stats)
+    model.trace.report()
+    if traceFile is not None:
+        print(f"Writing pipeline trace to {traceFile}")
+        model.trace.export(traceFile)
+    checkResults(cases, results, e, n)
+
+if __name__ == "__main__":
+    main()
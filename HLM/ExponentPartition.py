@@ -0,0 +1,123 @@
+import random
+import sys
+import time
+
+import CycleSim
+import ExponentRecoding
+import MultiplierEngines
+from MultiplierEngines import START_SMCP_END
+from CycleSim import C_KEY_N, C_KEY_E, C_KEY_D
+
+'''
+Work aware partitioning of e over the pipeline stages. splitE() and rsa_core.vhd give every stage
+es_size = KEY_LENGTH/NUM_PIPELINE_STAGES bits, which balances the stages only when every bit costs the
+same. That holds for "rtl", where both blakeley modules run on every bit, but not for the data
+dependent modes of ExponentRecoding.py: with "binary" nothing is done above the top one of e, so with
+e = 0x10001 stage 1 runs 16 squarings and stages 2..16 idle. The slowest stage sets the throughput.
+
+    bitCosts()       - RUN_BM cycles of every bit of e in the given mode
+    balancedWidths() - the contiguous slice widths (least significant slice first, one per stage) with
+                       the smallest bottleneck stage, every stage gets at least one bit
+    partitionReport()- equal against balanced widths for a key: predicted bottleneck, and the steady
+                       state of CycleSim with both, checked against pow()
+
+The window modes recode e over the full e_block_size and are not partitioned. In the RTL the widths
+would be one es_size generic per rsa_stage_module instead of the single one of rsa_core.vhd.
+'''
+
+MODES = ["rtl", "binary", "serial"]
+
+
+def bitCosts(e, keyLength=256, mode="binary", multiplier="blakeley2"):
+    '''Cycles spent in RUN_BM on bit i of e, for i in 0..keyLength-1, as in ExponentRecoding.binary_stage'''
+    if mode not in MODES:
+        print(f"Error: exponent mode {mode} can not be partitioned, use one of {MODES}")
+        raise ValueError
+    engine = MultiplierEngines.getEngine(multiplier)
+    opCycles = ExponentRecoding.opCyclesFunction(engine, keyLength)(1 << (keyLength-1))
+    if mode == "rtl":
+        return [opCycles for _ in range(keyLength)]
+    eBits = e.bit_length()
+    lowest = (e & -e).bit_length()-1
+    costs = []
+    for i in range(keyLength):
+        ## C = 1 up to the lowest one of e, where C = P is taken without a multiplication
+        ops = [(e >> i) & 1 and i != lowest, i < eBits-1]
+        costs.append(opCycles*(max(ops) if mode == "binary" else sum(ops)))
+    return costs
+
+def sliceCosts(costs, widths):
+    costList = []
+    offset = 0
+    for width in widths:
+        costList.append(sum(costs[offset:offset+width]))
+        offset += width
+    return costList
+
+def greedyWidths(costs, bound):
+    '''Fewest contiguous slices with at most bound cycles each, or None when a single bit costs more'''
+    widths = [0]
+    total = 0
+    for cost in costs:
+        if cost > bound:
+            return None
+        if widths[-1] > 0 and total + cost > bound:
+            widths.append(0)
+            total = 0
+        widths[-1] += 1
+        total += cost
+    return widths
+
+def balancedWidths(costs, numStages):
+    '''Slice widths of numStages stages that minimise the cycles of the slowest stage'''
+    if len(costs) < numStages:
+        print(f"Error: {len(costs)} bits can not be split over {numStages} stages")
+        raise ValueError
+    low, high = max(costs), sum(costs)
+    while low < high:
+        bound = (low+high)//2
+        if len(greedyWidths(costs, bound)) <= numStages:
+            high = bound
+        else:
+            low = bound+1
+    widths = greedyWidths(costs, low)
+    ## Fewer slices than stages: split the widest slice, which never raises the bottleneck
+    while len(widths) < numStages:
+        widest = max(range(len(widths)), key=lambda i: widths[i])
+        widths[widest:widest+1] = [widths[widest]//2, widths[widest]-widths[widest]//2]
+    return widths
+
+def partitionReport(e, n, keyLength=256, numStages=16, multiplier="blakeley2", messages=40, seed=0):
+    rng = random.Random(seed)
+    cases = [[rng.randint(0, n-1), i] for i in range(messages)]
+    equal = [-(-keyLength // numStages) for _ in range(numStages)]
+    print(f"\n--- e = {hex(e)[:18]}{'...' if e.bit_length() > 64 else ''} ({e.bit_length()} bits, {bin(e).count('1')} ones), "
+          f"{numStages} stages, {multiplier} ---\n")
+    print(f"{'Mode':<8} {'widths':<9} {'predicted':<10} {'simulated':<10} {'speedup':<8} {'check'}")
+    balancedList = {}
+    for mode in MODES:
+        costs = bitCosts(e, keyLength, mode, multiplier)
+        balanced = balancedWidths(costs, numStages)
+        balancedList[mode] = balanced
+        baseline = None
+        for name, widths in (("equal", equal), ("balanced", balanced)):
+            predicted = max(sliceCosts(costs, widths)) + START_SMCP_END
+            model = CycleSim.RsaCoreCycleModel(e, n, keyLength, numStages, multiplier=multiplier, exponentMode=mode, sliceWidths=widths)
+            stats = model.run(cases)
+            cycles = 1/stats["messages_per_cycle"]
+            baseline = cycles if baseline is None else baseline
+            errors = sum(1 for M, messageID in cases if model.results[messageID] != pow(M, e, n))
+            print(f"{mode:<8} {name:<9} {predicted:<10} {cycles:<10.1f} {baseline/cycles:<8.2f} {'PASSED' if errors == 0 else f'FAILED ({errors})'}")
+    print("\nBalanced es_size per stage, stage 1 first:")
+    for mode, widths in balancedList.items():
+        print(f"{mode:<8} {widths}")
+
+if __name__ == "__main__":
+    ## ExponentPartition.py [numStages] [multiplier] [messages]
+    start = time.time()
+    for key in (C_KEY_E, C_KEY_D):
+        partitionReport(key, C_KEY_N,
+                        numStages=int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+                        multiplier=sys.argv[2] if len(sys.argv) > 2 else "blakeley2",
+                        messages=int(sys.argv[3]) if len(sys.argv) > 3 else 40)
+    print(f"\nSimulated in {time.time()-start:.2f} s")
@@ -0,0 +1,172 @@
+import random
+import sys
+
+import MultiplierEngines
+from MultiplierEngines import CYC_BM_HANDSHAKE, START_SMCP_END
+
+'''
+Data dependent cycle counts for rsa_stage_module and exponent recoding modes. A stage function takes
+the multiplication and the cycles of one multiplication as callables, so it runs with any engine in
+MultiplierEngines, and returns the new values together with the cycles the stage spent in RUN_BM.
+
+    "rtl"      - rsa_stage_module.vhd: the C and P blakeley modules run every bit of the slice, the
+                 C result is only clocked in on one bits. es_size*(w + handshake), as in WCET.py
+    "binary"   - the same C and P modules in parallel, but a module is only started when its result
+                 is used: no C multiplication on zero bits or while C = 1, no squaring of P once
+                 the most significant one of e has been passed. Stages above it only pass values on
+    "serial"   - right to left binary on one multiplier, squarings and multiplications add up
+    "window<k>"- left to right sliding window on one multiplier. axi_in precomputes the odd powers
+                 M, M^3, .. M^(2^k-1) per message and the table travels down the pipeline instead of
+                 P. Stage 1 handles the most significant slice of e
+'''
+
+MODES = ["rtl", "binary", "serial", "window2", "window3", "window4", "window5"]
+
+
+def windowSize(mode):
+    return int(mode[6:]) if mode.startswith("window") else 0
+
+def slidingWindowDigits(e, k, width):
+    '''Left to right sliding window recoding, returns width digits (least significant first), every
+    digit is 0 or odd and below 2^k, such that e = sum(digits[i]*2^i)'''
+    digits = [0 for _ in range(width)]
+    i = e.bit_length()-1
+    while i >= 0:
+        if not (e >> i) & 1:
+            i -= 1
+            continue
+        j = max(i-k+1, 0)
+        while not (e >> j) & 1:
+            j += 1
+        digits[j] = (e >> j) & ((1 << (i-j+1))-1)
+        i = j-1
+    return digits
+
+def windowSlices(e, k, esSize, numStages):
+    '''Digits of every stage, most significant first. Stage 1 gets the most significant es_size digits'''
+    digits = slidingWindowDigits(e, k, esSize*numStages)[::-1]
+    return [digits[stage*esSize:(stage+1)*esSize] for stage in range(numStages)]
+
+def oddPowerTable(M, k, maxDigit, multiply, opCycles):
+    '''Returns ({d: M^d} for odd d up to maxDigit, cycles) computed with one squaring and (maxDigit-1)/2 multiplications'''
+    table = {1: M}
+    cycles = 0
+    if maxDigit > 1:
+        cycles += opCycles(M)
+        M2 = multiply(M, M)
+        for d in range(3, maxDigit+1, 2):
+            cycles += opCycles(table[d-2])
+            table[d] = multiply(table[d-2], M2)
+    return table, cycles
+
+def binary_stage(eSlice, C, P, offset, sliceWidth, eBits, one, multiply, opCycles, parallel):
+    '''Right to left binary over the bits of the slice below the top bit of e, returns (C, P, cycles)'''
+    cycles = 0
+    for i in range(max(0, min(sliceWidth, eBits-offset))):
+        bitCycles = [0]
+        newC = C
+        if (eSlice >> i) & 1:
+            if C == one:
+                newC = P
+            else:
+                bitCycles.append(opCycles(C))
+                newC = multiply(C, P)
+        ## P is only needed further if e has bits above this one
+        if offset+i < eBits-1:
+            bitCycles.append(opCycles(P))
+            P = multiply(P, P)
+        C = newC
+        cycles += max(bitCycles) if parallel else sum(bitCycles)
+    return C, P, cycles
+
+def window_stage(digits, C, table, one, multiply, opCycles):
+    '''Left to right over the digits of the slice (most significant first), returns (C, cycles)'''
+    cycles = 0
+    for d in digits:
+        if C != one:
+            cycles += opCycles(C)
+            C = multiply(C, C)
+        if d:
+            if C == one:
+                C = table[d]
+            else:
+                cycles += opCycles(C)
+                C = multiply(C, table[d])
+    return C, cycles
+
+def opCyclesFunction(multiplier, w, operandBits=False):
+    '''Cycles of one multiplication including the abval/rval handshake. operandBits charges the bits
+    of the first operand instead of w, for a blakeley module that stops after the top one of a'''
+    if operandBits:
+        k = getattr(multiplier, "k", 1)
+        return lambda a: -(-max(a.bit_length(), 1) // k) + CYC_BM_HANDSHAKE
+    cycles = multiplier.cycles(w) + CYC_BM_HANDSHAKE
+    return lambda a: cycles
+
+def exponentiate(M, e, n, w, numStages, mode="binary", multiplier="blakeley2", operandBits=False):
+    '''Runs M through every stage in the given mode, returns (C, [RUN_BM cycles of stage 1..S], table cycles)'''
+    engine = MultiplierEngines.getEngine(multiplier)
+    multiply = lambda a, b: engine.multiply_fast(a, b, n, w)
+    opCycles = opCyclesFunction(engine, w, operandBits)
+    esSize = -(-w // numStages)
+    one = engine.to_domain(1, n, w)
+    M = engine.to_domain(M, n, w)
+    stageCycles = []
+    tableCycles = 0
+    if windowSize(mode):
+        k = windowSize(mode)
+        slices = windowSlices(e, k, esSize, numStages)
+        table, tableCycles = oddPowerTable(M, k, max(max(digits) for digits in slices), multiply, opCycles)
+        C = one
+        for digits in slices:
+            C, cycles = window_stage(digits, C, table, one, multiply, opCycles)
+            stageCycles.append(cycles)
+    else:
+        C, P = one, M
+        eBits = e.bit_length()
+        for stage in range(numStages):
+            eSlice = (e >> (stage*esSize)) & ((1 << esSize)-1)
+            if mode == "rtl":
+                cycles = esSize*opCycles(1 << (w-1))
+                for i in range(esSize):
+                    if (eSlice >> i) & 1:
+                        C = multiply(C, P)
+                    P = multiply(P, P)
+            else:
+                C, P, cycles = binary_stage(eSlice, C, P, stage*esSize, esSize, eBits, one, multiply, opCycles, mode == "binary")
+            stageCycles.append(cycles)
+    return engine.from_domain(C, n, w), stageCycles, tableCycles
+
+def keyReport(e, n, w=256, numStages=16, multiplier="blakeley2", messages=20, operandBits=False, seed=0):
+    '''Average data dependent cycles per stage of every mode for the key, against the WCET bound'''
+    rng = random.Random(seed)
+    cases = [rng.randint(0, n-1) for _ in range(messages)]
+    engine = MultiplierEngines.getEngine(multiplier)
+    esSize = -(-w // numStages)
+    wcet = esSize*(engine.cycles(w) + CYC_BM_HANDSHAKE) + START_SMCP_END
+    print(f"\n--- e = {hex(e)[:18]}{'...' if e.bit_length() > 64 else ''} ({e.bit_length()} bits, {bin(e).count('1')} ones), "
+          f"{numStages} stages, {multiplier}{', operand bits' if operandBits else ''} ---\n")
+    print(f"{'Mode':<10} {'bottleneck':<11} {'mean stage':<11} {'latency':<10} {'table':<7} {'speedup':<9} {'check'}")
+    for mode in MODES:
+        totals = [0 for _ in range(numStages)]
+        tableTotal = 0
+        errors = 0
+        for M in cases:
+            C, stageCycles, tableCycles = exponentiate(M, e, n, w, numStages, mode, multiplier, operandBits)
+            errors += C != pow(M, e, n)
+            totals = [total + cycles + START_SMCP_END for total, cycles in zip(totals, stageCycles)]
+            tableTotal += tableCycles
+        average = [total/messages for total in totals]
+        ## The slowest stage sets the throughput of the pipeline, the table is built in axi_in
+        bottleneck = max(average + [tableTotal/messages])
+        print(f"{mode:<10} {bottleneck:<11.0f} {sum(average)/numStages:<11.0f} {sum(average)+tableTotal/messages:<10.0f} "
+              f"{tableTotal/messages:<7.0f} {wcet/bottleneck:<9.2f} {'PASSED' if errors == 0 else f'FAILED ({errors})'}")
+    print(f"\nWCET stage bound: {wcet} cycles")
+
+if __name__ == "__main__":
+    from CycleSim import C_KEY_N as n, C_KEY_E as e, C_KEY_D as d
+    ## ExponentRecoding.py [multiplier] [operand], operand charges the bits of the first operand per multiplication
+    multiplier = sys.argv[1] if len(sys.argv) > 1 else "blakeley2"
+    operandBits = len(sys.argv) > 2 and sys.argv[2] == "operand"
+    for key in (e, d):
+        keyReport(key, n, multiplier=multiplier, operandBits=operandBits)
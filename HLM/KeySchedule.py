@@ -0,0 +1,128 @@
+import random
+import sys
+import threading
+
+import ExponentRecoding
+
+'''
+Key schedules for the multi-key pipeline. A message carries a key ID next to (C, P, ID) and every
+stage looks up its slice of e and the modulus in a KeyScheduleCache instead of being bound to one
+eSlice. A schedule is computed once per key, the first time a message with that key ID shows up.
+
+In hardware this is a key table next to rsa_regio: a stage that gets a message with another key
+than the one it ran last reads its slice and n from the table, which costs KEY_SWITCH_CYCLES.
+Without key IDs (rsa_core.vhd today) the key registers are global, and a key switch has to wait
+until the pipeline is empty before the host writes the new key, which costs KEY_LOAD_CYCLES.
+'''
+
+KEY_SWITCH_CYCLES = 2   ## Read the slice and n from the key table, update nx1/nx2
+KEY_LOAD_CYCLES = 32    ## Host writes 2x8 key registers over AXI-lite, ~2 cycles per write
+
+
+class KeySchedule:
+    '''Everything a stage needs for one key, in the number domain of the multiplier'''
+    def __init__(self, e, n, keyLength, numStages, esSize, multiplier=None, windowSize=0, sliceWidths=None):
+        self.e = e
+        self.n = n
+        ## Slice i is bits i*es_size .. (i+1)*es_size-1 of e, the same slices as splitE(), unless the
+        ## stages have their own widths (see ExponentPartition.py)
+        self.sliceWidths = [esSize for _ in range(numStages)] if sliceWidths is None else list(sliceWidths)
+        self.offsets = [sum(self.sliceWidths[:i]) for i in range(numStages)]
+        self.eSlices = [(e >> offset) & ((1 << width)-1) for offset, width in zip(self.offsets, self.sliceWidths)]
+        self.eBits = e.bit_length()
+        self.one = 1 if multiplier is None else multiplier.to_domain(1, n, keyLength)
+        if windowSize:
+            self.windowSlices = ExponentRecoding.windowSlices(e, windowSize, esSize, numStages)
+            self.maxDigit = max(max(digits) for digits in self.windowSlices)
+
+
+class KeyScheduleCache:
+    def __init__(self, keys, keyLength, numStages, esSize=None, multiplier=None, windowSize=0, sliceWidths=None):
+        if esSize is None:
+            esSize = -(-keyLength // numStages)
+        if sliceWidths is not None and (len(sliceWidths) != numStages or sum(sliceWidths) < keyLength or min(sliceWidths) < 1):
+            print(f"Error: the slice widths {list(sliceWidths)} do not cover KEY_LENGTH = {keyLength} with {numStages} stages")
+            raise ValueError
+        if sliceWidths is not None and windowSize:
+            print(f"Error: the window modes only support equal slice widths")
+            raise ValueError
+        self.keys = dict(keys)
+        self.keyLength = keyLength
+        self.numStages = numStages
+        self.esSize = esSize
+        self.multiplier = multiplier
+        self.windowSize = windowSize
+        self.sliceWidths = sliceWidths
+        self.schedules = {}
+        self.hits = 0
+        self.misses = 0
+        ## Stage threads of the threaded model look up keys concurrently
+        self.lock = threading.Lock()
+
+    def register(self, keyID, e, n):
+        with self.lock:
+            self.keys[keyID] = (e, n)
+            self.schedules.pop(keyID, None)
+
+    def get(self, keyID):
+        with self.lock:
+            schedule = self.schedules.get(keyID)
+            if schedule is not None:
+                self.hits += 1
+                return schedule
+            if keyID not in self.keys:
+                print(f"Error: unknown key ID {keyID}, known key IDs are {list(self.keys)}")
+                raise ValueError
+            self.misses += 1
+            e, n = self.keys[keyID]
+            schedule = KeySchedule(e, n, self.keyLength, self.numStages, self.esSize, self.multiplier, self.windowSize, self.sliceWidths)
+            self.schedules[keyID] = schedule
+            return schedule
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"keys": len(self.keys), "lookups": lookups, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits/lookups if lookups else 0.0}
+
+
+def keyTraffic(keys, numMessages, runLength, rng):
+    '''Random messages [M, ID, keyID] where the key changes every runLength messages, cycling through the keys'''
+    keyIDs = list(keys)
+    cases = []
+    for messageID in range(numMessages):
+        keyID = keyIDs[(messageID // runLength) % len(keyIDs)]
+        cases.append([rng.randint(0, keys[keyID][1]-1), messageID, keyID])
+    return cases
+
+def compareKeySwitching(numMessages=256, runLengths=(1, 4, 16, 64, 256), numStages=16, multiplier="blakeley2", seed=0):
+    '''Throughput of the cycle model for encrypt/decrypt traffic on two moduli, for different run lengths
+    of same-key messages, with a global key register (drain) and with key IDs in the pipeline (tagged)'''
+    import CycleSim
+
+    rng = random.Random(seed)
+    e, d, n = CycleSim.C_KEY_E, CycleSim.C_KEY_D, CycleSim.C_KEY_N
+    n2 = rng.randint(2**255, 2**256-1) | 1
+    keys = {0: (e, n), 1: (d, n), 2: (e, n2), 3: (rng.randint(2**254, n2-1), n2)}
+
+    print(f"\n--- Key switching, {numMessages} messages over {len(keys)} keys, {numStages} stages, {multiplier} ---\n")
+    print(f"{'Run length':<12} {'Key mode':<10} {'cyc/msg':<10} {'vs 1 key':<10} {'switches':<10} {'cache hits':<11} {'check'}")
+    single = None
+    for runLength in runLengths:
+        for keyMode in ("drain", "tagged"):
+            cases = keyTraffic(keys, numMessages, runLength, rng)
+            model = CycleSim.RsaCoreCycleModel(e, n, 256, numStages, multiplier=multiplier, keys=keys, keyMode=keyMode)
+            stats = model.run(cases)
+            cycPerMessage = stats["total_cycles"]/stats["messages"]
+            if single is None:
+                ## Reference: the same number of messages with one key
+                reference = CycleSim.RsaCoreCycleModel(e, n, 256, numStages, multiplier=multiplier)
+                singleStats = reference.run([[case[0] % n, case[1]] for case in cases])
+                single = singleStats["total_cycles"]/singleStats["messages"]
+            mismatches = [case[1] for case in cases if model.results.get(case[1]) != pow(case[0], *keys[case[2]])]
+            cache = model.keySchedules.stats()
+            print(f"{runLength:<12} {keyMode:<10} {cycPerMessage:<10.1f} {cycPerMessage/single:<10.3f} {stats['key_switches']:<10} "
+                  f"{cache['hit_rate']:<11.3f} {'PASSED' if not mismatches else f'FAILED ({len(mismatches)})'}")
+    print(f"\nOne key: {single:.1f} cyc/msg (total cycles / messages, fill and drain included)")
+
+if __name__ == "__main__":
+    compareKeySwitching(int(sys.argv[1]) if len(sys.argv) > 1 else 256)
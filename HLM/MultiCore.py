@@ -0,0 +1,149 @@
+import random
+import sys
+import time
+
+import CycleSim
+from CycleSim import Simulator, F_CLK, C_KEY_N, C_KEY_E, C_KEY_D
+from BlakeleyParalell import KEY_LENGTH
+
+'''
+Cycle model of N replicated rsa_core pipelines behind one rsa_msgin and one rsa_msgout, to compare
+more cores against deeper pipelines for the same number of stages.
+
+    msgin      - one 256 bit block every MSGIN_CYCLES cycles (8 words of the 32 bit AXI-stream). As in
+                 rsa_msgin.vhd the buffer holds one block and is refilled after it has been handed over
+    dispatcher - hands the block to a core: "round-robin", or "least-loaded" (fewest messages in flight,
+                 lowest index on a tie). It waits for the msgin_valid/msgin_ready handshake of that core
+    cores      - RsaCoreCycleModel instances sharing one Simulator, so all cores are clocked together
+    reorder    - results leave the cores out of order when the stage cycles depend on the data. The
+                 reorder buffer releases them in input order, one block every MSGOUT_CYCLES cycles
+
+The reorder buffer does not apply backpressure to the cores, its maximum occupancy is the size it needs.
+'''
+
+MSGIN_CYCLES = 8
+MSGOUT_CYCLES = 8
+POLICIES = ["round-robin", "least-loaded"]
+
+
+def percentile(values, p):
+    '''Nearest rank percentile of a list of numbers'''
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered)-1, -(-p*len(ordered)//100)-1))]
+
+
+class MultiCoreModel:
+    def __init__(self, e, n, numCores=2, numStages=16, policy="round-robin", keyLength=KEY_LENGTH,
+                 msginCycles=MSGIN_CYCLES, msgoutCycles=MSGOUT_CYCLES, **coreOptions):
+        if policy not in POLICIES:
+            print(f"Error: unknown dispatch policy {policy}, known policies are {POLICIES}")
+            raise ValueError
+        self.numCores = numCores
+        self.numStages = numStages
+        self.policy = policy
+        self.msginCycles = msginCycles
+        self.msgoutCycles = msgoutCycles
+        self.sim = Simulator()
+        self.cores = [CycleSim.RsaCoreCycleModel(e, n, keyLength, numStages, sim=self.sim, name=f"rsa_core{i}", **coreOptions)
+                      for i in range(numCores)]
+        self.dispatched = [0 for _ in range(numCores)]
+        self.arrivalCycle = {}
+        self.coreOf = {}
+
+    def inFlight(self, core):
+        return self.dispatched[core] - self.cores[core].outCount.value
+
+    def dispatcher(self, cases):
+        sim = self.sim
+        for seq, case in enumerate(cases):
+            ## The block is shifted into rsa_msgin word by word
+            yield self.msginCycles
+            self.arrivalCycle[case[1]] = sim.cycle
+            if self.policy == "round-robin":
+                core = seq % self.numCores
+            else:
+                core = min(range(self.numCores), key=self.inFlight)
+            self.coreOf[case[1]] = core
+            self.dispatched[core] += 1
+            target = self.cores[core]
+            sim.drive(target.msginValid, 1)
+            sim.drive(target.msginData, case)
+            yield [(target.il[0], 1), (target.ip[0], 1)]
+            sim.drive(target.msginValid, 0)
+
+    def run(self, cases):
+        self.sim.process("dispatcher", self.dispatcher(cases))
+        for core in self.cores:
+            core.start()
+        self.sim.run()
+        return self.reassemble(cases)
+
+    def reassemble(self, cases):
+        '''Releases the results in input order through msgout, returns the stats of the run'''
+        exits = [self.cores[self.coreOf[case[1]]].exitCycle[case[1]] for case in cases]
+        releases = []
+        for exitCycle in exits:
+            releases.append(max(exitCycle, releases[-1] + self.msgoutCycles) if releases else exitCycle)
+        self.results = {case[1]: self.cores[self.coreOf[case[1]]].results[case[1]] for case in cases}
+        self.releaseCycle = {case[1]: release for case, release in zip(cases, releases)}
+
+        ## Reorder buffer occupancy from the entry (core exit) and leave (release) events
+        events = sorted([(cycle, 1) for cycle in exits] + [(cycle, -1) for cycle in releases], key=lambda event: (event[0], event[1]))
+        occupancy = 0
+        maxOccupancy = 0
+        area = 0
+        last = events[0][0]
+        for cycle, change in events:
+            area += occupancy*(cycle - last)
+            last = cycle
+            occupancy += change
+            maxOccupancy = max(maxOccupancy, occupancy)
+        span = releases[-1] - exits[0]
+
+        latencies = [release - self.arrivalCycle[case[1]] for case, release in zip(cases, releases)]
+        steadyState = (len(cases)-1)/(releases[-1]-releases[0]) if releases[-1] > releases[0] else 0.0
+        return {
+            "messages": len(cases),
+            "total_cycles": releases[-1],
+            "messages_per_cycle": steadyState,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": max(latencies),
+            "rob_max": maxOccupancy,
+            "rob_avg": area/span if span else 0.0,
+            "out_of_order": sum(1 for a, b in zip(exits, exits[1:]) if b < a),
+            "core_messages": [self.dispatched[core] for core in range(self.numCores)],
+        }
+
+
+def compareConfigurations(configurations, numMessages=200, multiplier="blakeley2", exponentMode="rtl", operandBits=False,
+                          e=C_KEY_E, n=C_KEY_N, fClk=F_CLK, seed=0):
+    '''configurations is a list of (cores, stages), every one is run with both dispatch policies. Results only
+    leave the cores out of order when the stage cycles depend on the message, e.g. binary with operandBits'''
+    rng = random.Random(seed)
+    cases = [[rng.randint(0, n-1), i] for i in range(numMessages)]
+
+    print(f"\n--- Replicated rsa_core, {numMessages} messages, e = {hex(e)[:10]}.., {multiplier}, {exponentMode} stages"
+          f"{', operand bits' if operandBits else ''} @ {fClk/1e6:.0f} MHz ---\n")
+    print(f"{'cores':<6} {'stages':<7} {'total':<6} {'policy':<13} {'msg/s':<10} {'p50 [cyc]':<10} {'p90 [cyc]':<10} {'p99 [cyc]':<10} "
+          f"{'ROB max':<8} {'ROB avg':<8} {'reordered':<10} {'check'}")
+    for numCores, numStages in configurations:
+        for policy in POLICIES:
+            model = MultiCoreModel(e, n, numCores, numStages, policy, multiplier=multiplier, exponentMode=exponentMode, operandBits=operandBits)
+            stats = model.run(cases)
+            errors = sum(1 for M, messageID in cases if model.results[messageID] != pow(M, e, n))
+            print(f"{numCores:<6} {numStages:<7} {numCores*numStages:<6} {policy:<13} {stats['messages_per_cycle']*fClk:<10.0f} "
+                  f"{stats['latency_p50']:<10} {stats['latency_p90']:<10} {stats['latency_p99']:<10} {stats['rob_max']:<8} "
+                  f"{stats['rob_avg']:<8.2f} {stats['out_of_order']:<10} {'PASSED' if errors == 0 else f'FAILED ({errors})'}")
+
+if __name__ == "__main__":
+    ## MultiCore.py [numMessages] [multiplier] [exponentMode] [e|d] [operand]
+    start = time.time()
+    compareConfigurations([(1, 16), (1, 32), (2, 16), (1, 64), (2, 32), (4, 16), (8, 8)],
+                          int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+                          sys.argv[2] if len(sys.argv) > 2 else "blakeley2",
+                          sys.argv[3] if len(sys.argv) > 3 else "rtl",
+                          len(sys.argv) > 5 and sys.argv[5] == "operand",
+                          C_KEY_D if len(sys.argv) > 4 and sys.argv[4] == "d" else C_KEY_E)
+    print(f"\nSimulated in {time.time()-start:.2f} s")
@@ -0,0 +1,191 @@
+import random
+import sys
+
+'''
+Modular multiplier engines for rsa_stage_module. Every engine has the same interface:
+    multiply(a, b, n, w)       - the algorithm as the datapath would run it, digit by digit
+    multiply_fast(a, b, n, w)  - the same result computed with Python big ints, for long model runs
+    cycles(w)                  - clock cycles for one multiplication of w bit operands
+    to_domain / from_domain    - conversion in and out of the engine's number domain
+    conversion_cycles(w)       - clock cycles for one conversion
+C and P are kept in the engine's domain through the whole pipeline, such that only axi_in and axi_out
+convert. For Blakeley the domain is the normal residues, for Montgomery it is x*2^w mod n.
+'''
+
+F_CLK = 200 * 1e6
+CYC_BM_HANDSHAKE = 4    ## abval/rval handshake cycles per multiplication, see CycleSim.py
+START_SMCP_END = 4      ## SAVE_IN, ACK_SAVE_IN and HOLD_OUT cycles per stage, see WCET.py
+COMPARE_LEVELS_PER_CYCLE = 2  ## Comparator levels of the quotient selection per cycle, the R >= N and R >= 2N of the RTL
+
+
+class BlakeleyEngine:
+    '''Radix-2^k Blakeley: k bits of a per digit, R = 2^k*R + digit*B followed by the subtraction of q*N,
+    where q (0 .. 2^(k+1)-2) is picked by comparing R against the precomputed multiples of N. The
+    comparisons run in parallel, and picking q from them is a tree of k+1 comparator levels, of which
+    COMPARE_LEVELS_PER_CYCLE fit in a cycle'''
+    def __init__(self, k=1):
+        self.k = k
+        self.name = f"blakeley{2**k}"
+
+    def multiply(self, a, b, n, w, steps=None):
+        ## With a, b < n, R < n before every digit, so 2^k*R + digit*B < (2^(k+1)-1)*N and one of the
+        ## multiples 0, N, .., (2^(k+1)-2)*N brings R back below N. steps gets R after every digit
+        k = self.k
+        mask = (1 << k) - 1
+        multiples = [q*n for q in range((1 << (k+1)) - 1)]
+        R = 0
+        for i in range(-(-max(w, a.bit_length()) // k)-1, -1, -1):
+            digit = (a >> (i*k)) & mask
+            R = (R << k) + digit*b
+            if R >= len(multiples)*n:
+                print(f"Error: R = {R} is above the bound (2^(k+1)-1)*N before the quotient selection, a or b is not below n")
+                raise ValueError
+            q = len(multiples)-1
+            while multiples[q] > R:
+                q -= 1
+            R = R - multiples[q]
+            if R >= n:
+                print(f"Error: R = {R} is not below N after the quotient selection")
+                raise ValueError
+            if steps is not None:
+                steps.append(R)
+        return R
+
+    def multiply_fast(self, a, b, n, w):
+        return (a*b) % n
+
+    def cycles(self, w):
+        ## One cycle per digit of a for k = 1, as MAXCYCLES_ONE_A_BIT in WCET.py. A wider digit also waits
+        ## for the deeper quotient selection
+        return -(-w // self.k)*-(-(self.k+1) // COMPARE_LEVELS_PER_CYCLE)
+
+    def to_domain(self, x, n, w):
+        return x
+
+    def from_domain(self, x, n, w):
+        return x
+
+    def conversion_cycles(self, w):
+        return 0
+
+
+class MontgomeryEngine:
+    '''Bit serial radix-2 Montgomery: returns a*b*2^-w mod n for odd n, one cycle per bit of a and one for
+    the final subtraction. The domain conversion is a Montgomery multiplication with 2^(2w) mod n (computed
+    once per key, like nx1/nx2 in rsa_core.vhd) into the domain and with 1 out of it'''
+    def __init__(self):
+        self.name = "montgomery2"
+        self.keyConstants = {}
+
+    def constants(self, n, w):
+        if (n, w) not in self.keyConstants:
+            if n % 2 == 0:
+                print(f"Error: Montgomery multiplication needs an odd modulus, n is {n}")
+                raise ValueError
+            R = 1 << w
+            self.keyConstants[(n, w)] = ((R*R) % n, pow(R, -1, n))
+        return self.keyConstants[(n, w)]
+
+    def multiply(self, a, b, n, w):
+        u = 0
+        for i in range(w):
+            u = u + ((a >> i) & 1)*b
+            if u & 1:
+                u = u + n
+            u = u >> 1
+        if u >= n:
+            u = u - n
+        return u
+
+    def multiply_fast(self, a, b, n, w):
+        R2, Rinv = self.constants(n, w)
+        return (a*b*Rinv) % n
+
+    def cycles(self, w):
+        return w + 1
+
+    def to_domain(self, x, n, w):
+        R2, Rinv = self.constants(n, w)
+        return self.multiply_fast(x, R2, n, w)
+
+    def from_domain(self, x, n, w):
+        return self.multiply_fast(x, 1, n, w)
+
+    def conversion_cycles(self, w):
+        return self.cycles(w)
+
+
+ENGINES = {engine.name: engine for engine in [BlakeleyEngine(1), BlakeleyEngine(2), BlakeleyEngine(4), BlakeleyEngine(8), MontgomeryEngine()]}
+
+def getEngine(name):
+    if name not in ENGINES:
+        ## Any radix-2^k Blakeley can be asked for by name, e.g. blakeley16
+        if name.startswith("blakeley") and name[8:].isdigit() and int(name[8:]) > 1 and int(name[8:]) & (int(name[8:])-1) == 0:
+            ENGINES[name] = BlakeleyEngine(int(name[8:]).bit_length()-1)
+        else:
+            print(f"Error: unknown multiplier engine {name}, known engines are {list(ENGINES)}")
+            raise ValueError
+    return ENGINES[name]
+
+def exponentiate(engine, M, e, n, w, fast=False):
+    '''Right to left binary exponentiation as in rsa_stage_module, returns (C, cycles) with C = M^e mod n'''
+    multiply = engine.multiply_fast if fast else engine.multiply
+    C = engine.to_domain(1, n, w)
+    P = engine.to_domain(M, n, w)
+    for i in range(w):
+        if (e >> i) & 1:
+            C = multiply(C, P, n, w)
+        P = multiply(P, P, n, w)
+    cycles = 2*engine.conversion_cycles(w) + w*(engine.cycles(w) + CYC_BM_HANDSHAKE) + START_SMCP_END
+    return engine.from_domain(C, n, w), cycles
+
+def crossCheck(engine, w, trials=20, seed=0):
+    '''Compares engine.multiply and exponentiate against pow for random odd w bit moduli, returns the number of errors'''
+    rng = random.Random(seed)
+    errors = 0
+    for _ in range(trials):
+        n = rng.randint(2**(w-1), 2**w-1) | 1
+        a = engine.to_domain(rng.randint(0, n-1), n, w)
+        b = engine.to_domain(rng.randint(0, n-1), n, w)
+        if engine.multiply(a, b, n, w) != engine.multiply_fast(a, b, n, w):
+            errors += 1
+        M = rng.randint(0, n-1)
+        e = rng.randint(1, n-1)
+        if exponentiate(engine, M, e, n, w, fast=True)[0] != pow(M, e, n):
+            errors += 1
+    return errors
+
+def stepCheck(w, trials=20, seed=0):
+    '''Compares R after every bit of blakeley2 with blakeley_module of BlakeleyParalell.py, returns the number of errors.
+    R after the bits above i is blakeley_module(a >> i, b, n), as both run the bits of a from the top'''
+    from BlakeleyParalell import blakeley_module
+    engine = getEngine("blakeley2")
+    rng = random.Random(seed)
+    errors = 0
+    for _ in range(trials):
+        n = rng.randint(2**(w-1), 2**w-1) | 1
+        a = rng.randint(0, n-1)
+        b = rng.randint(0, n-1)
+        steps = []
+        engine.multiply(a, b, n, w, steps)
+        if steps != [blakeley_module(a >> i, b, n) for i in range(len(steps)-1, -1, -1)]:
+            errors += 1
+    return errors
+
+def compareEngines(w=256, stages=16, fClk=F_CLK, trials=5):
+    print(f"\n--- Multiplier engines, w = {w}, {stages} stages @ {fClk/1e6:.0f} MHz ---\n")
+    print(f"{'Engine':<14} {'cyc/mult':<10} {'cyc/stage':<11} {'msg/s':<12} {'speedup':<9} {'cross-check'}")
+    baseline = None
+    for name, engine in ENGINES.items():
+        stageCycles = (w // stages)*(engine.cycles(w) + CYC_BM_HANDSHAKE) + START_SMCP_END
+        throughput = fClk/stageCycles
+        if baseline is None:
+            baseline = throughput
+        errors = crossCheck(engine, w, trials)
+        if name == "blakeley2":
+            errors += stepCheck(w, trials)
+        check = "PASSED" if errors == 0 else f"FAILED ({errors})"
+        print(f"{name:<14} {engine.cycles(w):<10} {stageCycles:<11} {throughput:<12.1f} {throughput/baseline:<9.2f} {check}")
+
+if __name__ == "__main__":
+    compareEngines(int(sys.argv[1]) if len(sys.argv) > 1 else 256)
@@ -0,0 +1,254 @@
+import csv
+import queue
+import random
+import resource
+import sys
+import threading
+import time
+
+import BlakeleyBatch
+import KeySchedule
+import MultiplierEngines
+from BlakeleyParalell import rsa_stage_exponentiate, getBeatSize, KEYS, KEY_LENGTH, NUM_PIPELINE_STAGES, BATCH_SIZE, STAGE_ENGINE, MULTIPLIER_ENGINE
+
+'''
+Streaming version of the threaded pipeline. rsa_core() reads testCases.csv into an unbounded queue,
+keeps every message in the global messages dict and its threads never return. RsaPipeline takes any
+iterable and yields the results in order as they leave axi_out:
+
+    pipeline = RsaPipeline()
+    for C in pipeline.run(messages):    ## messages are M, or (M, keyID) with more than one key
+        ...
+
+The threads are the same as in rsa_core(): axi_in, one rsa_stage_module per stage and axi_out. Each link
+is a queue.Queue of at most depth beats, so a full pipeline blocks axi_in, and axi_in only takes the next
+message from the iterable when there is room. With one beat in every thread and depth beats in every
+link, at most (numStages+2)*(depth+1) beats are held, whatever the length of the stream. The end of the
+stream is a None beat that every thread passes on before it returns. Closing the generator early, or an
+error in a thread, stops all threads.
+'''
+
+END = None
+
+
+class PipelineError(Exception):
+    pass
+
+
+class RsaPipeline:
+    def __init__(self, keys=KEYS, keyLength=KEY_LENGTH, numStages=NUM_PIPELINE_STAGES, depth=1,
+                 batchSize=BATCH_SIZE, engine=STAGE_ENGINE, multiplier=MULTIPLIER_ENGINE, sliceWidths=None):
+        if engine == "batch" and multiplier not in (None, "blakeley2"):
+            print(f"Error: the batch stage engine only implements the radix-2 Blakeley multiplier")
+            raise ValueError
+        if any(keyLength < max(e.bit_length(), n.bit_length()) for e, n in keys.values()):
+            print(f"Error: a key in keys is longer than keyLength")
+            raise ValueError
+        self.keyLength = keyLength
+        self.numStages = numStages
+        self.sliceWidth = -(-keyLength // numStages)
+        self.depth = depth
+        self.batchSize = getBeatSize(batchSize, engine)
+        self.engine = engine
+        self.multiplier = None if multiplier is None else MultiplierEngines.getEngine(multiplier)
+        self.keySchedules = KeySchedule.KeyScheduleCache(keys, keyLength, numStages, self.sliceWidth, self.multiplier,
+                                                      sliceWidths=sliceWidths)
+        self.stopped = threading.Event()
+        self.threads = []
+        self.error = None
+        self.stats = {}
+
+    def put(self, link, beat):
+        ## Blocks while the link is full, unless the pipeline is stopped
+        while not self.stopped.is_set():
+            try:
+                link.put(beat, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, link):
+        while not self.stopped.is_set():
+            try:
+                return True, link.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return False, END
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def axi_in(self, messages, link):
+        try:
+            beat = []
+            for message in messages:
+                M, keyID = message if isinstance(message, tuple) else (message, 0)
+                ## A beat only holds messages with the same key
+                if beat and (len(beat) == self.batchSize or keyID != beat[0][1]):
+                    if not self.put(link, self.load(beat)):
+                        return
+                    beat = []
+                beat.append((M, keyID))
+            if beat and not self.put(link, self.load(beat)):
+                return
+            self.put(link, END)
+        except Exception as error:
+            self.fail(error)
+
+    def load(self, beat):
+        keyID = beat[0][1]
+        schedule = self.keySchedules.get(keyID)
+        self.stats["messages"] += len(beat)
+        self.stats["beats"] += 1
+        if self.multiplier is None:
+            return [1 for _ in beat], [M for M, _ in beat], keyID
+        return ([schedule.one for _ in beat], [self.multiplier.to_domain(M, schedule.n, self.keyLength) for M, _ in beat], keyID)
+
+    def rsa_stage_module(self, stage, inLink, outLink):
+        try:
+            while True:
+                ok, beat = self.get(inLink)
+                if not ok:
+                    return
+                if beat is END:
+                    self.put(outLink, END)
+                    return
+                C, P, keyID = beat
+                schedule = self.keySchedules.get(keyID)
+                eSlice = schedule.eSlices[stage]
+                sliceWidth = schedule.sliceWidths[stage]
+                if self.engine == "batch":
+                    C, P = BlakeleyBatch.rsa_stage_module_batch(eSlice, C, P, schedule.n, sliceWidth)
+                else:
+                    for lane in range(len(C)):
+                        C[lane], P[lane] = rsa_stage_exponentiate(eSlice, C[lane], P[lane], schedule.n, sliceWidth, self.multiplier,
+                                                                       self.keyLength)
+                if not self.put(outLink, (C, P, keyID)):
+                    return
+        except Exception as error:
+            self.fail(error)
+
+    def axi_out(self, inLink, results):
+        try:
+            while True:
+                ok, beat = self.get(inLink)
+                if not ok:
+                    return
+                if beat is END:
+                    self.put(results, END)
+                    return
+                C, _, keyID = beat
+                if self.multiplier is not None:
+                    n = self.keySchedules.get(keyID).n
+                    C = [self.multiplier.from_domain(c, n, self.keyLength) for c in C]
+                if not self.put(results, C):
+                    return
+        except Exception as error:
+            self.fail(error)
+
+    def run(self, messages):
+        '''Generator of C = M^e mod n for every message of the iterable, in order'''
+        if self.threads:
+            print(f"Error: the pipeline is already running a stream")
+            raise ValueError
+        self.stopped.clear()
+        self.error = None
+        self.stats = {"messages": 0, "beats": 0}
+        ## links[0] connects axi_in to stage 1, links[numStages] connects the last stage to axi_out
+        links = [queue.Queue(maxsize=self.depth) for _ in range(self.numStages+1)]
+        results = queue.Queue(maxsize=self.depth)
+        self.threads = [threading.Thread(target=self.axi_in, args=(iter(messages), links[0]), daemon=True)]
+        for stage in range(self.numStages):
+            self.threads.append(threading.Thread(target=self.rsa_stage_module, args=(stage, links[stage], links[stage+1]), daemon=True))
+        self.threads.append(threading.Thread(target=self.axi_out, args=(links[self.numStages], results), daemon=True))
+        for thread in self.threads:
+            thread.start()
+        try:
+            while True:
+                ok, beat = self.get(results)
+                if not ok or beat is END:
+                    break
+                yield from beat
+        finally:
+            self.close()
+        if self.error is not None:
+            raise PipelineError(f"pipeline thread failed: {self.error!r}") from self.error
+
+    def map(self, messages):
+        return list(self.run(messages))
+
+    def close(self):
+        '''Stops and joins the threads of the running stream, the pipeline can run a new stream afterwards'''
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def readCases(filename):
+    '''Lazily reads a testCases.csv, yields M, or (M, keyID) when the file has a KEY column'''
+    with open(filename, mode='r') as file:
+        for case in csv.DictReader(file):
+            if case.get('KEY'):
+                yield int(case['M']), int(case['KEY'])
+            else:
+                yield int(case['M'])
+
+def randomMessages(numMessages, keys, seed=0):
+    rng = random.Random(seed)
+    keyIDs = list(keys)
+    for i in range(numMessages):
+        keyID = keyIDs[i % len(keyIDs)]
+        yield rng.randint(0, keys[keyID][1]-1), keyID
+
+def selfCheck(keyLength=64, numStages=4, numMessages=20, seed=0):
+    '''Runs two random odd keyLength bit keys through the pipeline with every multiplier engine, returns the number of errors'''
+    rng = random.Random(seed)
+    keys = {}
+    for keyID in range(2):
+        n = rng.randint(2**(keyLength-1), 2**keyLength-1) | 1
+        keys[keyID] = (rng.randint(1, n-1), n)
+    errors = 0
+    for multiplier in [None] + list(MultiplierEngines.ENGINES):
+        pipeline = RsaPipeline(keys, keyLength, numStages, batchSize=2, multiplier=multiplier)
+        messages = list(randomMessages(numMessages, keys, seed))
+        for (M, keyID), C in zip(messages, pipeline.run(messages)):
+            errors += C != pow(M, *keys[keyID])
+    print(f"Self-check with {keyLength} bit keys over {numStages} stages: {'PASSED' if errors == 0 else f'FAILED ({errors})'}")
+    return errors
+
+def main():
+    ## PipelineStream.py [numMessages | cases.csv]
+    source = sys.argv[1] if len(sys.argv) > 1 else "10000"
+    selfCheck()
+    pipeline = RsaPipeline()
+    if source.isdigit():
+        messages = lambda: randomMessages(int(source), KEYS)
+    else:
+        messages = lambda: readCases(source)
+    start = time.time()
+    count = 0
+    mismatches = 0
+    ## The expected results are computed from a second pass over the source, no message is kept
+    for message, C in zip(messages(), pipeline.run(messages())):
+        M, keyID = message if isinstance(message, tuple) else (message, 0)
+        mismatches += C != pow(M, *KEYS[keyID])
+        count += 1
+        if count % 100000 == 0:
+            print(f"{count} messages, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.1f} MB")
+    elapsed = time.time()-start
+    print(f"Streamed {count} messages in {pipeline.stats['beats']} beats through {pipeline.numStages} stages in {elapsed:.2f} s "
+          f"({count/elapsed:.0f} msg/s), peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.1f} MB")
+    print("All results are correct!" if mismatches == 0 else f"There were {mismatches} mismatches in the results.")
+
+if __name__ == "__main__":
+    main()
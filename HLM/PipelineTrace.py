@@ -0,0 +1,149 @@
+import json
+import time
+
+import numpy as np
+
+'''
+Preallocated trace buffer for the pipeline models. Every stage has its own row of ring buffers and is
+the only writer of that row, so stages can record without taking a lock. Per message a stage records:
+    ENTER - values popped from the previous stage
+    DONE  - values computed, waiting for the output link (stall starts)
+    EXIT  - values handed to the next stage (stall ends)
+In CycleSim EXIT is the ip of the next stage at the end of HOLD_OUT, so the stall is the time the next
+stage takes to pop the values. A link of the threaded model holds one beat, and a stage waits for the next
+stage to pop the previous beat before it puts its values, so there EXIT is the put and the stall is the
+time the output link is still occupied by the previous beat.
+Timestamps are seconds from time.perf_counter() in the threaded model and cycles in CycleSim. timescale
+is the VCD $timescale and the number of its ticks per time unit. When a row is full the oldest events
+are overwritten.
+'''
+
+ENTER = 0
+DONE = 1
+EXIT = 2
+
+STATE_IDLE = 0
+STATE_BUSY = 1
+STATE_STALL = 2
+
+
+class TraceBuffer:
+    def __init__(self, numStages, capacity=1 << 16, timeUnit="s", timescale=("1us", 1e6)):
+        self.numStages = numStages
+        self.capacity = capacity
+        self.timeUnit = timeUnit
+        self.timescale = timescale
+        self.kind = np.zeros((numStages, capacity), dtype=np.int8)
+        self.message = np.zeros((numStages, capacity), dtype=np.int64)
+        self.time = np.zeros((numStages, capacity), dtype=np.float64)
+        self.count = [0 for _ in range(numStages)]
+
+    def record(self, stage, kind, messageID, t=None):
+        if t is None:
+            t = time.perf_counter()
+        i = self.count[stage] % self.capacity
+        self.kind[stage, i] = kind
+        self.message[stage, i] = messageID
+        self.time[stage, i] = t
+        self.count[stage] += 1
+
+    def events(self, stage):
+        '''Returns (kind, message, time) of the buffered events of a stage in the order they were recorded'''
+        count = self.count[stage]
+        if count <= self.capacity:
+            order = np.arange(count)
+        else:
+            order = np.roll(np.arange(self.capacity), -(count % self.capacity))
+        return self.kind[stage, order], self.message[stage, order], self.time[stage, order]
+
+    def intervals(self, stage):
+        '''Returns (message, enter, done, exit) arrays with one entry per complete message of a stage'''
+        kind, message, t = self.events(stage)
+        ## A wrapped ring can start in the middle of a message, skip to the first ENTER
+        start = int(np.argmax(kind == ENTER)) if np.any(kind == ENTER) else len(kind)
+        kind, message, t = kind[start:], message[start:], t[start:]
+        complete = len(kind) // 3
+        kind, message, t = kind[:3*complete], message[:3*complete], t[:3*complete]
+        return message[kind == ENTER], t[kind == ENTER], t[kind == DONE], t[kind == EXIT]
+
+    def metrics(self):
+        perStage = [self.intervals(stage) for stage in range(self.numStages)]
+        starts = [enter[0] for _, enter, _, _ in perStage if len(enter) > 0]
+        ends = [exit_[-1] for _, _, _, exit_ in perStage if len(exit_) > 0]
+        if not starts:
+            return {}
+        span = max(ends) - min(starts)
+        busy = np.array([np.sum(done - enter) for _, enter, done, _ in perStage])
+        stall = np.array([np.sum(exit_ - done) for _, _, done, exit_ in perStage])
+        return {
+            "span": span,
+            "messages": [len(message) for message, _, _, _ in perStage],
+            "busy": busy.tolist(),
+            "stall": stall.tolist(),
+            "occupancy": (busy/span).tolist() if span > 0 else [0.0]*self.numStages,
+            "stall_fraction": (stall/span).tolist() if span > 0 else [0.0]*self.numStages,
+            "imbalance": float(busy.max()/busy.mean()) if busy.mean() > 0 else 1.0,
+        }
+
+    def report(self):
+        metrics = self.metrics()
+        if not metrics:
+            print("\nNo complete messages in the trace")
+            return
+        print(f"\n--- Pipeline trace, span {metrics['span']:.6g} {self.timeUnit} ---\n")
+        print(f"{'Stage':<8} {'Messages':<10} {'Occupancy':<11} {'Stall':<10}")
+        for stage in range(self.numStages):
+            print(f"{stage+1:<8} {metrics['messages'][stage]:<10} {metrics['occupancy'][stage]:<11.3f} {metrics['stall_fraction'][stage]:<10.3f}")
+        print(f"\nImbalance (max/mean busy time): {metrics['imbalance']:.3f}")
+
+    def exportChromeTrace(self, filename):
+        '''Chrome trace event JSON, can be opened in chrome://tracing or ui.perfetto.dev'''
+        scale = 1e6 if self.timeUnit == "s" else 1.0
+        traceEvents = []
+        for stage in range(self.numStages):
+            traceEvents.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": stage+1, "args": {"name": f"rsa_stage_module {stage+1}"}})
+            for messageID, enter, done, exit_ in zip(*self.intervals(stage)):
+                traceEvents.append({"name": f"msg {messageID}", "cat": "busy", "ph": "X", "pid": 0, "tid": stage+1,
+                                    "ts": enter*scale, "dur": (done-enter)*scale})
+                if exit_ > done:
+                    traceEvents.append({"name": f"stall {messageID}", "cat": "stall", "ph": "X", "pid": 0, "tid": stage+1,
+                                        "ts": done*scale, "dur": (exit_-done)*scale})
+        with open(filename, mode="w") as file:
+            json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ns"}, file)
+
+    def exportVcd(self, filename):
+        '''VCD with a 2 bit state (0 idle, 1 busy, 2 stall) and the message ID per stage'''
+        timescale, scale = self.timescale
+        changes = []
+        for stage in range(self.numStages):
+            for messageID, enter, done, exit_ in zip(*self.intervals(stage)):
+                changes.append((enter, stage, STATE_BUSY, messageID))
+                changes.append((done, stage, STATE_STALL, messageID))
+                changes.append((exit_, stage, STATE_IDLE, messageID))
+        if not changes:
+            return
+        changes.sort(key=lambda change: (change[0], change[2] != STATE_IDLE))
+        origin = changes[0][0]
+
+        with open(filename, mode="w") as file:
+            file.write(f"$timescale {timescale} $end\n$scope module rsa_core $end\n")
+            for stage in range(self.numStages):
+                file.write(f"$var wire 2 s{stage} stage{stage+1}_state $end\n")
+                file.write(f"$var wire 32 m{stage} stage{stage+1}_message $end\n")
+            file.write("$upscope $end\n$enddefinitions $end\n$dumpvars\n")
+            for stage in range(self.numStages):
+                file.write(f"b0 s{stage}\nb0 m{stage}\n")
+            file.write("$end\n")
+            lastTime = None
+            for t, stage, state, messageID in changes:
+                stamp = int(round((t - origin)*scale))
+                if stamp != lastTime:
+                    file.write(f"#{stamp}\n")
+                    lastTime = stamp
+                file.write(f"b{state:b} s{stage}\nb{int(messageID):b} m{stage}\n")
+
+    def export(self, filename):
+        if filename.endswith(".vcd"):
+            self.exportVcd(filename)
+        else:
+            self.exportChromeTrace(filename)
@@ -0,0 +1,152 @@
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+
+import BlakeleyBatch
+from BlakeleyParalell import getBeatSize, splitE, getCases, reportResults, rsa_stage_exponentiate, messages, KEY_LENGTH, NUM_PIPELINE_STAGES, E, N
+
+'''
+Process based execution backends for the pipelined model. Both give the same results as the threaded
+rsa_core(), but run the big-int work on all host cores instead of behind the GIL.
+
+    "shard" - independent message shards are sent through all stages by a concurrent.futures process pool
+    "stage" - one process per rsa_stage_module, the stages are connected by pipes like the ilo/ipo links
+
+Between processes (C, P, ID) records are sent as packed bytes, (keyLength+7)//8 bytes for C and P and
+ID_BYTES for the message ID, instead of the three queue.Queue per stage of the threaded model.
+Both backends run a single key, cases with the key column of a multi-key testCases.csv are rejected.
+'''
+
+ID_BYTES = 8
+
+
+def packRecords(records, valueBytes):
+    return b''.join(C.to_bytes(valueBytes, 'little') + P.to_bytes(valueBytes, 'little') + messageID.to_bytes(ID_BYTES, 'little')
+                    for C, P, messageID in records)
+
+def unpackRecords(blob, valueBytes):
+    records = []
+    recordBytes = 2*valueBytes + ID_BYTES
+    for i in range(0, len(blob), recordBytes):
+        C = int.from_bytes(blob[i:i+valueBytes], 'little')
+        P = int.from_bytes(blob[i+valueBytes:i+2*valueBytes], 'little')
+        messageID = int.from_bytes(blob[i+2*valueBytes:i+recordBytes], 'little')
+        records.append((C, P, messageID))
+    return records
+
+def run_stages(records, eSlices, n, sliceWidth, engine):
+    if engine == "batch":
+        C = [record[0] for record in records]
+        P = [record[1] for record in records]
+        for eSlice in eSlices:
+            C, P = BlakeleyBatch.rsa_stage_module_batch(eSlice, C, P, n, sliceWidth)
+        return [(C[i], P[i], records[i][2]) for i in range(len(records))]
+    for eSlice in eSlices:
+        records = [(*rsa_stage_exponentiate(eSlice, C, P, n, sliceWidth), messageID) for C, P, messageID in records]
+    return records
+
+def shard_worker(blob, eSlices, n, sliceWidth, engine, valueBytes):
+    return packRecords(run_stages(unpackRecords(blob, valueBytes), eSlices, n, sliceWidth, engine), valueBytes)
+
+def stage_worker(eSlice, n, sliceWidth, engine, valueBytes, inConn, outConn):
+    ## An empty beat is the end of stream marker and is passed on to the next stage
+    while True:
+        blob = inConn.recv_bytes()
+        if not blob:
+            outConn.send_bytes(b'')
+            break
+        outConn.send_bytes(packRecords(run_stages(unpackRecords(blob, valueBytes), [eSlice], n, sliceWidth, engine), valueBytes))
+    inConn.close()
+    outConn.close()
+
+def rsa_core_shards(records, eSlices, n, sliceWidth, workers, shardSize, engine, valueBytes):
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(shard_worker, packRecords(records[i:i+shardSize], valueBytes), eSlices, n, sliceWidth, engine, valueBytes)
+                   for i in range(0, len(records), shardSize)]
+        for future in concurrent.futures.as_completed(futures):
+            for C, P, messageID in unpackRecords(future.result(), valueBytes):
+                results[messageID] = C
+    return results
+
+def rsa_core_stage_processes(records, eSlices, n, sliceWidth, beatSize, engine, valueBytes):
+    ## links[i] connects stage i to stage i+1, link 0 is axi_in and the last link is axi_out
+    links = [multiprocessing.Pipe(duplex=False) for _ in range(len(eSlices)+1)]
+    stages = []
+    for i, eSlice in enumerate(eSlices):
+        stage = multiprocessing.Process(target=stage_worker, args=(eSlice, n, sliceWidth, engine, valueBytes, links[i][0], links[i+1][1]))
+        stage.start()
+        stages.append(stage)
+
+    axiOut = links[-1][0]
+    axiIn = links[0][1]
+    results = {}
+    ## Keep a bounded number of beats in flight such that the pipes never fill up and block axi_in
+    inFlight = 0
+    beats = [records[i:i+beatSize] for i in range(0, len(records), beatSize)]
+    for beat in beats:
+        if inFlight > len(eSlices):
+            for C, P, messageID in unpackRecords(axiOut.recv_bytes(), valueBytes):
+                results[messageID] = C
+            inFlight -= 1
+        axiIn.send_bytes(packRecords(beat, valueBytes))
+        inFlight += 1
+    axiIn.send_bytes(b'')
+    while True:
+        blob = axiOut.recv_bytes()
+        if not blob:
+            break
+        for C, P, messageID in unpackRecords(blob, valueBytes):
+            results[messageID] = C
+
+    for stage in stages:
+        stage.join()
+    return results
+
+def rsa_core_processes(cases, e=E, n=N, keyLength=KEY_LENGTH, numStages=NUM_PIPELINE_STAGES, mode="shard",
+                       workers=None, shardSize=None, beatSize=None, engine="scalar"):
+    '''Runs cases ([M, ID] pairs) through the pipeline on a process backend, returns {ID: C}'''
+    if keyLength % numStages != 0:
+        print(f"Error: KEY_LENGTH / NUM_PIPELINE_STAGES is not an integer")
+        raise ValueError
+    if keyLength < max(e.bit_length(), n.bit_length()):
+        print(f"Error: the key is longer than keyLength = {keyLength}")
+        raise ValueError
+    records = []
+    for case in cases:
+        if len(case) != 2:
+            print(f"Error: case {case[1]} has a key column, the process backends run the single key e, n")
+            raise ValueError
+        records.append((1, case[0], case[1]))
+    valueBytes = (keyLength + 7) // 8
+    eSlices = splitE(e, keyLength, numStages)
+    sliceWidth = keyLength // numStages
+    if workers is None:
+        workers = os.cpu_count()
+    if shardSize is None:
+        ## A few shards per worker to even out the load
+        shardSize = max(1, -(-len(cases) // (4*workers)))
+
+    if mode == "shard":
+        return rsa_core_shards(records, eSlices, n, sliceWidth, workers, shardSize, engine, valueBytes)
+    elif mode == "stage":
+        return rsa_core_stage_processes(records, eSlices, n, sliceWidth, getBeatSize(beatSize, engine), engine, valueBytes)
+    print(f"Error: unknown process backend mode {mode}")
+    raise ValueError
+
+def main():
+    mode = sys.argv[1] if len(sys.argv) > 1 else "shard"
+    cases = list(getCases("testCases.csv").queue)
+
+    start = time.time()
+    results = rsa_core_processes(cases, mode=mode)
+    print(f"Ran {len(cases)} messages on the {mode} backend with {os.cpu_count()} cores in {time.time()-start:.2f} s")
+
+    for messageID, C in results.items():
+        messages[messageID].append(C)    ## For final reults
+    reportResults()
+
+if __name__ == "__main__":
+    main()
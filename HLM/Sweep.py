@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+import CycleSim
+from Benchmark import corpusCases, CORPORA
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Utilities', 'tb_utilities'))
+from tb_verify import verify_results
+from rsa_reference import ResultCache, C_RESULT_CACHE_DEFAULT_DIR
+
+'''
+Regression sweep of the cycle model over the testbench corpora and a set of configurations, for nightly
+runs. Every run of CycleSim.rsa_core_cycle and every golden output goes through a ResultCache of
+rsa_reference.py, keyed by the input blocks, the key, the configuration and the sources of the model. A
+sweep over unchanged corpora and sources only reads the cache, a changed corpus file, key, configuration
+or model source is simulated again. The hit rate and the time saved are printed at the end. The cache is
+in RSA_RESULT_CACHE, or in ~/.cache/rsa_results when it is not set, RSA_RESULT_CACHE="" turns it off.
+
+    Sweep.py [limit|all]    - limit is the number of blocks per testcase, default all
+'''
+
+## (stages, multiplier, exponent mode)
+CONFIGURATIONS = [(16, "blakeley2", "rtl"), (16, "blakeley2", "binary"), (32, "blakeley2", "rtl"),
+                  (16, "blakeley4", "rtl"), (16, "montgomery2", "rtl")]
+
+## The shared result_cache is off unless RSA_RESULT_CACHE is set, the sweep uses the cache by default
+sweepCache = ResultCache(os.path.expanduser(os.environ.get("RSA_RESULT_CACHE", C_RESULT_CACHE_DEFAULT_DIR)))
+
+
+def sweep(configurations=CONFIGURATIONS, corpora=CORPORA, limit=None, cache=sweepCache):
+    print(f"\n--- Sweep, {len(configurations)} configurations over {', '.join(corpora)} ---\n")
+    print(f"{'Corpus':<12} {'testcase':<9} {'stages':<7} {'multiplier':<12} {'mode':<7} {'messages':<9} {'cyc/msg':<9} {'run':<7} {'check'}")
+    errors = 0
+    for corpus in corpora:
+        for testcase, (exponent, n, cases, _) in enumerate(corpusCases(corpus, limit)):
+            for numStages, multiplier, exponentMode in configurations:
+                hits = cache.hits if cache is not None else 0
+                results, stats = CycleSim.rsa_core_cycle(cases, e=exponent, n=n, numStages=numStages, multiplier=multiplier,
+                                                         exponentMode=exponentMode, cache=cache)
+                cached = cache is not None and cache.hits > hits
+                summary = verify_results({messageID: (M, results.get(messageID)) for M, messageID in cases}, {0: (exponent, n)}, cache=cache)
+                errors += summary["errors"]
+                cycles = 1/stats["messages_per_cycle"] if stats.get("messages_per_cycle") else stats.get("total_cycles", 0)
+                check = "PASSED" if summary["errors"] == 0 else f"FAILED ({summary['errors']})"
+                print(f"{corpus:<12} {testcase:<9} {numStages:<7} {multiplier:<12} {exponentMode:<7} {len(cases):<9} {cycles:<9.1f} "
+                      f"{'cached' if cached else 'sim':<7} {check}")
+    return errors
+
+if __name__ == "__main__":
+    start = time.time()
+    limit = None if len(sys.argv) < 2 or sys.argv[1] == "all" else int(sys.argv[1])
+    errors = sweep(limit=limit)
+    print(f"\nSwept in {time.time()-start:.2f} s")
+    sweepCache.report()
+    print("\nAll results are correct!" if errors == 0 else f"\nThere were {errors} errors in the results.")
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,111 @@
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import sys
+
+from WCET import CYC_RSA_STAGE_SLICE, ES_SIZE
+
+#Design space exploration of the pipelined rsa_core on top of the WCET formulas
+#Every configuration is (key_length, num_pipeline_stages, es_size, f_clk, messages)
+
+KEY_LENGTHS = [256]
+NUM_PIPELINE_STAGES = list(range(1, 33))
+F_CLKS = [100 * 1e6, 150 * 1e6, 200 * 1e6]
+MESSAGES = [1, 5000]
+
+FIELDS = ["key_length", "num_pipeline_stages", "es_size", "e_block_size", "padding_bits", "divisible",
+          "f_clk", "messages", "cyc_stage", "cyc_latency", "cyc_total", "latency_s", "total_s",
+          "throughput_msg_s", "pareto"]
+
+#Results of already evaluated configurations
+results = {}
+
+def evaluate(config):
+    key_length, stages, es_size, f_clk, messages = config
+    e_block_size = es_size*stages
+    #Every stage handles es_size bits of e, a message leaves the pipeline every cyc_stage cycles when the pipeline is full
+    cyc_stage = CYC_RSA_STAGE_SLICE(key_length, es_size)
+    cyc_latency = stages*cyc_stage
+    cyc_total = cyc_latency + (messages-1)*cyc_stage
+    return {
+        "key_length": key_length,
+        "num_pipeline_stages": stages,
+        "es_size": es_size,
+        "e_block_size": e_block_size,
+        "padding_bits": e_block_size - key_length,
+        "divisible": key_length % stages == 0,
+        "f_clk": f_clk,
+        "messages": messages,
+        "cyc_stage": cyc_stage,
+        "cyc_latency": cyc_latency,
+        "cyc_total": cyc_total,
+        "latency_s": cyc_latency/f_clk,
+        "total_s": cyc_total/f_clk,
+        "throughput_msg_s": messages*f_clk/cyc_total,
+    }
+
+def configurations(key_lengths=KEY_LENGTHS, stages=NUM_PIPELINE_STAGES, f_clks=F_CLKS, messages=MESSAGES, es_sizes=None):
+    #es_sizes=None gives the smallest es_size for each stage count, otherwise every es_size covering the key is used
+    for key_length, num_stages, f_clk, num_messages in itertools.product(key_lengths, stages, f_clks, messages):
+        if es_sizes is None:
+            yield (key_length, num_stages, ES_SIZE(key_length, num_stages), f_clk, num_messages)
+        else:
+            for es_size in es_sizes:
+                if es_size*num_stages >= key_length:
+                    yield (key_length, num_stages, es_size, f_clk, num_messages)
+
+def sweep(configs, workers=None):
+    configs = list(configs)
+    todo = [config for config in dict.fromkeys(configs) if config not in results]
+    if len(todo) > 0:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            for config, result in zip(todo, pool.map(evaluate, todo, chunksize=max(1, len(todo)//(4*(workers or os.cpu_count()))))):
+                results[config] = result
+    return [results[config] for config in dict.fromkeys(configs)]
+
+def paretoFront(rows):
+    #Pareto optimal rows minimize latency and stage count and maximize throughput
+    #Only configurations with the same key length and message count are compared
+    def dominates(a, b):
+        no_worse = a["latency_s"] <= b["latency_s"] and a["throughput_msg_s"] >= b["throughput_msg_s"] and a["num_pipeline_stages"] <= b["num_pipeline_stages"]
+        better = a["latency_s"] < b["latency_s"] or a["throughput_msg_s"] > b["throughput_msg_s"] or a["num_pipeline_stages"] < b["num_pipeline_stages"]
+        return no_worse and better
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["key_length"], row["messages"]), []).append(row)
+    table = []
+    for group in groups.values():
+        for row in group:
+            table.append(dict(row, pareto=not any(dominates(other, row) for other in group)))
+    return table
+
+def writeCsv(table, filename):
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(table)
+
+def writeJson(table, filename):
+    with open(filename, mode="w") as file:
+        json.dump(table, file, indent=1)
+
+def printTable(table, only_pareto=True):
+    print(f"{'w':<5} {'stages':<7} {'es_size':<8} {'pad':<4} {'f_clk':<8} {'messages':<9} {'latency':<12} {'throughput':<15} {'note'}")
+    for row in table:
+        if only_pareto and not row["pareto"]:
+            continue
+        note = "" if row["divisible"] else "KEY_LENGTH not divisible by stages"
+        print(f"{row['key_length']:<5} {row['num_pipeline_stages']:<7} {row['es_size']:<8} {row['padding_bits']:<4} "
+              f"{row['f_clk']/1e6:<8.0f} {row['messages']:<9} {row['latency_s']*1e6:<9.2f} us {row['throughput_msg_s']:<9.1f} msg/s {note}")
+
+if __name__ == "__main__":
+    table = paretoFront(sweep(configurations()))
+    printTable(table)
+    if len(sys.argv) > 1:
+        if sys.argv[1].endswith(".json"):
+            writeJson(table, sys.argv[1])
+        else:
+            writeCsv(table, sys.argv[1])
@@ -0,0 +1,140 @@
+import statistics
+import sys
+
+from WCET import CYC_RSA_STAGE_SLICE, ES_SIZE
+
+#End to end throughput model of the rsa_soc path: DMA -> rsa_msgin -> rsa_core -> rsa_msgout -> DMA
+#WCET.py counts the cycles of rsa_core with the pipeline always full. Here a DMA transfer of num_blocks costs
+#   overhead - host time per transfer: DMA setup, polling for completion and the Python around it
+#   fill     - the first block streams into msgin, passes all stages and streams out of msgout
+#   stream   - one block per interval after that, the slowest of a stage, msgin, msgout and the DMA
+#and the keys are written through rsa_regio once per run. Transfers are not overlapped, as in hw_encrypt
+#of the notebook and RsaDriver.crypt: the pipeline drains before the next transfer is started.
+#The hardware figures are from rsa_soc.hwh, the host figures from calibrate(NOTEBOOK_XOR_RUNS).
+
+F_CLK_SOC = 100 * 1e6               #FCLK_CLK0 of rsa_soc.hwh
+BLOCK_SIZE = 256
+AXIS_DATA_WIDTH = 32                #C_S_AXIS_TDATA_WIDTH of rsa_msgin/rsa_msgout, c_m_axi_mm2s_data_width of the DMA
+DMA_MAX_TRANSFER_BYTES = (1 << 26) - 1    #Simple mode DMA, c_sg_length_width = 26
+REG_WRITES_PER_KEY_LOAD = 2*BLOCK_SIZE // 32    #key_n and key_e_d, 8 registers each
+
+T_TRANSFER = 0.691e-3               #Host overhead per transfer, calibrated
+DMA_WORDS_PER_CYCLE = 0.74          #Sustained DMA words per cycle, calibrated (the AXI-stream limit is 1)
+T_REG_WRITE = 1e-6                  #One MMIO write from Python, assumed, not in the timing cells of the notebook
+
+#HW RUNTIME of the XOR testcases in the notebook, (blocks, seconds). Buffer sizes 504, 7056 and 144 words.
+#hw_encrypt starts the timer after the keys are written, so these are transfers only.
+NOTEBOOK_XOR_RUNS = [(63, 0.000701), (882, 0.000708), (18, 0.000700),
+                     (63, 0.000684), (882, 0.000865), (18, 0.000696)]
+
+def CYC_AXIS_BLOCK(block_size=BLOCK_SIZE, width=AXIS_DATA_WIDTH):
+    #msgin takes one word per cycle while its buffer is not full, msgout gives one word per cycle
+    return block_size // width
+
+def CYC_DMA_BLOCK(block_size=BLOCK_SIZE, width=AXIS_DATA_WIDTH, words_per_cycle=DMA_WORDS_PER_CYCLE):
+    return (block_size // width) / words_per_cycle
+
+def config(key_length=256, stages=16, es_size=None, f_clk=F_CLK_SOC, t_transfer=T_TRANSFER,
+           dma_words_per_cycle=DMA_WORDS_PER_CYCLE, t_reg_write=T_REG_WRITE, chunk_blocks=None, xor=False):
+    #chunk_blocks=None sends all messages in one transfer as the notebook, xor=True models the XOR core of the kit
+    return {
+        "key_length": key_length,
+        "stages": 1 if xor else stages,
+        "es_size": ES_SIZE(key_length, stages) if es_size is None else es_size,
+        "f_clk": f_clk,
+        "t_transfer": t_transfer,
+        "dma_words_per_cycle": dma_words_per_cycle,
+        "t_reg_write": t_reg_write,
+        "chunk_blocks": chunk_blocks,
+        "xor": xor,
+    }
+
+def intervals(cfg):
+    #Cycles per block of every part of the path when it is streaming
+    cyc_dma = CYC_DMA_BLOCK(words_per_cycle=cfg["dma_words_per_cycle"])
+    return {
+        "rsa_core": 1 if cfg["xor"] else CYC_RSA_STAGE_SLICE(cfg["key_length"], cfg["es_size"]),
+        "rsa_msgin": CYC_AXIS_BLOCK(),
+        "rsa_msgout": CYC_AXIS_BLOCK(),
+        "dma": cyc_dma,
+    }
+
+def transfers(messages, cfg):
+    max_blocks = DMA_MAX_TRANSFER_BYTES // (BLOCK_SIZE // 8)
+    chunk = min(cfg["chunk_blocks"] or max_blocks, max_blocks)
+    return [min(chunk, messages - start) for start in range(0, messages, chunk)]
+
+def evaluate(messages, cfg):
+    parts = intervals(cfg)
+    interval = max(parts.values())
+    limit = max(parts, key=parts.get)
+    #The first block of a transfer waits for the DMA and msgin, passes every stage, and leaves through msgout and the DMA
+    cyc_in = max(parts["rsa_msgin"], parts["dma"])
+    cyc_out = max(parts["rsa_msgout"], parts["dma"])
+    cyc_fill = cyc_in + cfg["stages"]*parts["rsa_core"] + cyc_out
+    sizes = transfers(messages, cfg)
+
+    t_overhead = len(sizes)*cfg["t_transfer"] + REG_WRITES_PER_KEY_LOAD*cfg["t_reg_write"]
+    t_fill = len(sizes)*(cyc_fill - interval)/cfg["f_clk"]
+    t_stream = messages*interval/cfg["f_clk"]
+    total_s = t_overhead + t_fill + t_stream
+    shares = {"overhead": t_overhead, "latency": t_fill, "compute" if limit == "rsa_core" else "I/O": t_stream}
+    return {
+        "messages": messages,
+        "transfers": len(sizes),
+        "cyc_interval": interval,
+        "interval_limit": limit,
+        "cyc_fill": cyc_fill,
+        "overhead_s": t_overhead,
+        "fill_s": t_fill,
+        "stream_s": t_stream,
+        "total_s": total_s,
+        "throughput_msg_s": messages/total_s if total_s else 0.0,
+        "core_only_s": messages*parts["rsa_core"]/cfg["f_clk"],
+        "bound": max(shares, key=shares.get),
+    }
+
+def calibrate(runs=NOTEBOOK_XOR_RUNS, cfg=None):
+    #Fits seconds = a + b*blocks to measured transfers. For the XOR core the slope is the I/O interval, which
+    #gives the sustained DMA rate, and a minus the fill of one transfer is the host overhead per transfer
+    cfg = config(xor=True) if cfg is None else cfg
+    fit = statistics.linear_regression([blocks for blocks, _ in runs], [seconds for _, seconds in runs])
+    cyc_block = fit.slope*cfg["f_clk"]
+    words_per_cycle = min(1.0, CYC_AXIS_BLOCK()/cyc_block) if cyc_block > 0 else 1.0
+    parts = intervals(dict(cfg, dma_words_per_cycle=words_per_cycle))
+    cyc_fill = max(parts["rsa_msgin"], parts["dma"]) + cfg["stages"]*parts["rsa_core"] + max(parts["rsa_msgout"], parts["dma"])
+    t_transfer = fit.intercept - (cyc_fill - max(parts.values()))/cfg["f_clk"]
+    residuals = [seconds - (fit.intercept + fit.slope*blocks) for blocks, seconds in runs]
+    return {"t_transfer": t_transfer, "dma_words_per_cycle": words_per_cycle, "cyc_block": cyc_block,
+            "rms_residual_s": (sum(r*r for r in residuals)/len(residuals))**0.5}
+
+def printCalibration(runs=NOTEBOOK_XOR_RUNS):
+    fit = calibrate(runs)
+    print(f"Calibration from {len(runs)} transfers: {fit['t_transfer']*1e3:.3f} ms per transfer, "
+          f"{fit['cyc_block']:.1f} cycles per block, DMA {fit['dma_words_per_cycle']:.2f} words/cycle, "
+          f"rms residual {fit['rms_residual_s']*1e6:.1f} us\n")
+    print(f"{'blocks':<8} {'measured':<12} {'model':<12}")
+    cfg = config(t_transfer=fit["t_transfer"], dma_words_per_cycle=fit["dma_words_per_cycle"], t_reg_write=0, xor=True)
+    for blocks, seconds in runs:
+        print(f"{blocks:<8} {seconds*1e3:<9.3f} ms {evaluate(blocks, cfg)['total_s']*1e3:<9.3f} ms")
+
+def printTable(rows, cfg):
+    parts = intervals(cfg)
+    print(f"\n--- rsa_soc, {cfg['stages']} stages, es_size {cfg['es_size']}, {cfg['f_clk']/1e6:.0f} MHz, "
+          f"{cfg['chunk_blocks'] or 'one'} {'block transfers' if cfg['chunk_blocks'] else 'transfer'} ---")
+    print("Cycles per block: " + ", ".join(f"{name} {cycles:.1f}" for name, cycles in parts.items()) + "\n")
+    print(f"{'messages':<10} {'transfers':<10} {'total':<12} {'core only':<12} {'overhead':<9} {'fill':<7} {'stream':<7} {'throughput':<16} {'bound'}")
+    for row in rows:
+        total = row["total_s"]
+        print(f"{row['messages']:<10} {row['transfers']:<10} {total*1e3:<9.3f} ms {row['core_only_s']*1e3:<9.3f} ms "
+              f"{row['overhead_s']/total:<9.0%} {row['fill_s']/total:<7.0%} {row['stream_s']/total:<7.0%} "
+              f"{row['throughput_msg_s']:<10.0f} msg/s {row['bound']}")
+
+if __name__ == "__main__":
+    #SoC.py [stages] [f_clk in MHz] [chunk_blocks]
+    STAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    F_CLK = float(sys.argv[2])*1e6 if len(sys.argv) > 2 else F_CLK_SOC
+    CHUNK_BLOCKS = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    printCalibration()
+    cfg = config(stages=STAGES, f_clk=F_CLK, chunk_blocks=CHUNK_BLOCKS)
+    printTable([evaluate(messages, cfg) for messages in [1, 18, 63, 882, 5000, 100000, 1000000]], cfg)
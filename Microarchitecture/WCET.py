@@ -15,7 +15,18 @@ def CYC_RSA_STAGE_MODULE(w):
 def CYC_RSA_CORE_PIPELINED(w,stages):
     return CYC_RSA_STAGE_MODULE(w)/stages
 
+def CYC_RSA_STAGE_SLICE(w,es_size):
+    START = 2
+    SMCP = 1
+    END = 1
+    return es_size*CYC_BLAKELEY_MODULE(w)+(START+SMCP+END)
+
+def ES_SIZE(w,stages):
+    #Smallest es_size covering the key, e_block_size = es_size*stages is zero padded as in rsa_core.vhd
+    return math.ceil(w/stages)
+
 def findTestEstimate():
     return f"{round(5000*(CYC_RSA_CORE_PIPELINED(256,4)/F_CLK)*1e3,2)} ms"
 
-print(findTestEstimate())
\ No newline at end of file
+if __name__ == "__main__":
+    print(findTestEstimate())
\ No newline at end of file
@@ -0,0 +1,173 @@
+# ------------------------------------------------------------------------------
+# Double buffered host driver for the RSA accelerator.
+#
+# The notebook prepares one buffer, starts the DMA and polls until it is done,
+# so the host and the accelerator never work at the same time. This driver
+# splits the messages in chunks and keeps two in/out buffer pairs. While the
+# accelerator processes chunk k the host copies chunk k+1 into the free in
+# buffer and copies the results of chunk k-1 out of the free out buffer.
+#
+# On the board:
+#   from pynq import Overlay, allocate
+#   overlay = Overlay('/home/xilinx/pynq/overlays/rsa_soc/rsa_soc.bit')
+#   driver = RsaDriver(overlay.rsa.rsa_dma, overlay.rsa.rsa_acc.mmio, allocate)
+# Off the board the DMA, MMIO and allocate come from rsa_mock.py.
+# ------------------------------------------------------------------------------
+import time
+
+import numpy as np
+
+from rsa_io import msg2word, word2msg, map_words, write_words, C_BLOCKSIZE_IN_32_BIT_WORDS
+
+C_REG_KEY_N    = 0x00
+C_REG_KEY_E_D  = 0x20
+C_CHUNK_BLOCKS = 4096
+
+class RsaDriver:
+  def __init__(self, dma, mmio, allocate, chunk_blocks=C_CHUNK_BLOCKS):
+    self.dma = dma
+    self.mmio = mmio
+    self.allocate = allocate
+    self.chunk_words = chunk_blocks*C_BLOCKSIZE_IN_32_BIT_WORDS
+    self.in_buffers = []
+    self.out_buffers = []
+    self.stats = {}
+
+  # ----------------------------------------------------------------------------
+  # Both keys are consecutive registers, they are written with one 64 byte
+  # MMIO write instead of sixteen 4 byte writes. MMIO.write of the PYNQ images
+  # with Xlnk, as the notebook uses, only takes an int and raises on bytes,
+  # there the keys are written word by word
+  # ----------------------------------------------------------------------------
+  def write_keys(self, key_n, key_e_or_d):
+    words = msg2word([key_n, key_e_or_d])
+    try:
+      self.mmio.write(C_REG_KEY_N, words.tobytes())
+    except (ValueError, TypeError):
+      for i, word in enumerate(words):
+        self.mmio.write(C_REG_KEY_N + 4*i, int(word))
+
+  def read_keys(self):
+    first = C_REG_KEY_N//4
+    words = np.array(self.mmio.array[first:first+2*C_BLOCKSIZE_IN_32_BIT_WORDS], dtype=np.uint32)
+    n, e_or_d = word2msg(words)
+    return n, e_or_d
+
+  # ----------------------------------------------------------------------------
+  # The buffers are allocated once and reused for every chunk and every file
+  # ----------------------------------------------------------------------------
+  def buffers(self):
+    if not self.in_buffers:
+      for _ in range(2):
+        self.in_buffers.append(self.allocate(shape=(self.chunk_words,), dtype=np.uint32))
+        self.out_buffers.append(self.allocate(shape=(self.chunk_words,), dtype=np.uint32))
+    return self.in_buffers, self.out_buffers
+
+  def close(self):
+    for buffer in self.in_buffers + self.out_buffers:
+      buffer.close()
+    self.in_buffers = []
+    self.out_buffers = []
+
+  # ----------------------------------------------------------------------------
+  # Runs num_blocks through the accelerator with the keys already written.
+  # fill(buffer, start, stop) writes blocks start..stop-1 into an in buffer and
+  # drain(buffer, start, stop) takes them out of an out buffer. They are the host
+  # work that overlaps with the accelerator. synchronous=True runs the chunks
+  # one by one as the notebook does, the baseline for the double buffered run.
+  # ----------------------------------------------------------------------------
+  def crypt(self, num_blocks, fill, drain, synchronous=False):
+    in_buffers, out_buffers = self.buffers()
+    chunk_blocks = self.chunk_words//C_BLOCKSIZE_IN_32_BIT_WORDS
+    chunks = [(start, min(start+chunk_blocks, num_blocks)) for start in range(0, num_blocks, chunk_blocks)]
+    host_time = 0.0
+    wait_time = 0.0
+    start_time = time.perf_counter()
+
+    def words(buffers, k):
+      # Transfers shorter than the buffer use only the filled part
+      start, stop = chunks[k]
+      return buffers[k%2][:(stop-start)*C_BLOCKSIZE_IN_32_BIT_WORDS]
+
+    def launch(k):
+      self.dma.sendchannel.transfer(words(in_buffers, k))
+      self.dma.recvchannel.transfer(words(out_buffers, k))
+
+    for k in range(len(chunks)):
+      if synchronous or k == 0:
+        t = time.perf_counter()
+        fill(words(in_buffers, k), *chunks[k])
+        host_time += time.perf_counter()-t
+        launch(k)
+      # Overlapped with the accelerator: the buffers of chunk k-1 are free
+      t = time.perf_counter()
+      if not synchronous and k+1 < len(chunks):
+        fill(words(in_buffers, k+1), *chunks[k+1])
+      if not synchronous and k > 0:
+        drain(words(out_buffers, k-1), *chunks[k-1])
+      host_time += time.perf_counter()-t
+      t = time.perf_counter()
+      self.dma.recvchannel.wait()
+      wait_time += time.perf_counter()-t
+      if synchronous or k+1 == len(chunks):
+        t = time.perf_counter()
+        drain(words(out_buffers, k), *chunks[k])
+        host_time += time.perf_counter()-t
+      else:
+        launch(k+1)
+
+    self.stats = {"blocks": num_blocks, "chunks": len(chunks),
+                  "total_time": time.perf_counter()-start_time, "host_time": host_time, "wait_time": wait_time}
+
+  # ----------------------------------------------------------------------------
+  # Word arrays in and out, e.g. from rsa_io.read_words or map_words
+  # ----------------------------------------------------------------------------
+  def crypt_words(self, word_array, out=None, synchronous=False):
+    assert len(word_array)%C_BLOCKSIZE_IN_32_BIT_WORDS == 0, "The file size must be aligned to the block size of 256 bit"
+    if out is None:
+      out = np.empty(len(word_array), dtype=np.uint32)
+    W = C_BLOCKSIZE_IN_32_BIT_WORDS
+
+    def fill(buffer, start, stop):
+      np.copyto(buffer, word_array[start*W:stop*W])
+
+    def drain(buffer, start, stop):
+      np.copyto(out[start*W:stop*W], buffer)
+
+    self.crypt(len(word_array)//W, fill, drain, synchronous)
+    return out
+
+  # ----------------------------------------------------------------------------
+  # Message ints in and out as hw_encrypt in the notebook. The conversions are
+  # done per chunk, such that they overlap with the accelerator.
+  # ----------------------------------------------------------------------------
+  def crypt_msgs(self, M_array, synchronous=False):
+    C_array = [None]*len(M_array)
+
+    def fill(buffer, start, stop):
+      np.copyto(buffer, msg2word(M_array[start:stop]))
+
+    def drain(buffer, start, stop):
+      C_array[start:stop] = word2msg(buffer)
+
+    self.crypt(len(M_array), fill, drain, synchronous)
+    return C_array
+
+  def hw_encrypt(self, key_e, key_n, M_array, synchronous=False):
+    self.write_keys(key_n, key_e)
+    start_time = time.time()
+    C_array = self.crypt_msgs(M_array, synchronous)
+    return C_array, time.time()-start_time
+
+  def hw_decrypt(self, key_d, key_n, C_array, synchronous=False):
+    return self.hw_encrypt(key_d, key_n, C_array, synchronous)
+
+  # ----------------------------------------------------------------------------
+  # File to file. The input is memory mapped, such that reading the file is
+  # part of the host work that overlaps with the accelerator.
+  # ----------------------------------------------------------------------------
+  def crypt_file(self, key_e_or_d, key_n, inp_file, otp_file, synchronous=False):
+    self.write_keys(key_n, key_e_or_d)
+    out = self.crypt_words(map_words(str(inp_file)), synchronous=synchronous)
+    write_words(otp_file, out)
+    return out
@@ -0,0 +1,190 @@
+# ------------------------------------------------------------------------------
+# Host side message I/O for the RSA Integration Kit.
+#
+# The message files are raw 256-bit blocks stored as little endian 32-bit words,
+# the same layout as the DMA buffers. The functions below move whole files
+# between disk and contiguous uint32 buffers without building Python ints. Ints
+# are only needed for the software reference (sw_encrypt), msg2word/word2msg
+# convert between the two with one bytes object instead of per word shifts.
+#
+# Drop-in use in the notebook:
+#   from rsa_io import *
+#   words = read_words(inp_file)              # instead of np.fromfile + word2msg
+#   read_into(inp_file, in_buffer)            # or straight into the cma_array
+#   words_equal(out_buffer, sw_words)         # compare HW and SW without ints
+# ------------------------------------------------------------------------------
+import mmap
+import os
+import sys
+import time
+
+import numpy as np
+
+from rsa_reference import reference, result_cache, golden_digest
+
+C_BLOCKSIZE_IN_BITS         = 256
+C_BLOCKSIZE_IN_32_BIT_WORDS = 8
+C_BLOCKSIZE_IN_BYTES        = 32
+
+# ------------------------------------------------------------------------------
+# Number of whole blocks in a file. Trailing bytes that do not fill a block are
+# ignored, as np.fromfile + word2msg does for pt1_in.txt (28226 bytes).
+# ------------------------------------------------------------------------------
+def file_blocks(file_name):
+  return os.path.getsize(file_name) // C_BLOCKSIZE_IN_BYTES
+
+# ------------------------------------------------------------------------------
+# Read a message file into a new contiguous uint32 array
+# ------------------------------------------------------------------------------
+def read_words(file_name):
+  words = np.empty(file_blocks(file_name)*C_BLOCKSIZE_IN_32_BIT_WORDS, dtype=np.uint32)
+  read_into(file_name, words)
+  return words
+
+# ------------------------------------------------------------------------------
+# Read a message file into an existing buffer, e.g. the DMA in_buffer, without
+# an intermediate copy. Returns the number of words read.
+# ------------------------------------------------------------------------------
+def read_into(file_name, buffer):
+  num_bytes = file_blocks(file_name)*C_BLOCKSIZE_IN_BYTES
+  assert buffer.nbytes >= num_bytes, "The buffer is smaller than the file"
+  view = memoryview(buffer).cast('B')[:num_bytes]
+  with open(file_name, 'rb', buffering=0) as file:
+    read = 0
+    while read < num_bytes:
+      count = file.readinto(view[read:])
+      if not count:
+        break
+      read += count
+  return read // 4
+
+# ------------------------------------------------------------------------------
+# Memory map a message file as a read-only uint32 array. Nothing is read before
+# the words are used, which suits files larger than the host memory.
+# ------------------------------------------------------------------------------
+def map_words(file_name):
+  num_words = file_blocks(file_name)*C_BLOCKSIZE_IN_32_BIT_WORDS
+  if num_words == 0:
+    return np.zeros(0, dtype=np.uint32)
+  with open(file_name, 'rb') as file:
+    mapped = mmap.mmap(file.fileno(), num_words*4, access=mmap.ACCESS_READ)
+  # The array keeps the map open for as long as it is referenced
+  return np.frombuffer(mapped, dtype='<u4', count=num_words)
+
+# ------------------------------------------------------------------------------
+# Write a word array to a message file
+# ------------------------------------------------------------------------------
+def write_words(file_name, word_array):
+  np.ascontiguousarray(word_array, dtype='<u4').tofile(str(file_name))
+
+# ------------------------------------------------------------------------------
+# Compare two word arrays, e.g. the HW and SW outputs
+# ------------------------------------------------------------------------------
+def words_equal(word_array_a, word_array_b):
+  return np.array_equal(word_array_a, word_array_b)
+
+# ------------------------------------------------------------------------------
+# Function for converting an array of messages to a numpy array of 32-bit words
+# ------------------------------------------------------------------------------
+def msg2word(msg_array):
+  msg_in_bytes = b''.join(msg.to_bytes(C_BLOCKSIZE_IN_BYTES, byteorder='little') for msg in msg_array)
+  return np.frombuffer(msg_in_bytes, dtype='<u4').copy()
+
+# ------------------------------------------------------------------------------
+# Function for converting an numpy array of 32-bit words into messages
+# ------------------------------------------------------------------------------
+def word2msg(word_array):
+  assert len(word_array)%C_BLOCKSIZE_IN_32_BIT_WORDS == 0, "The file size must be aligned to the block size"
+  raw = np.ascontiguousarray(word_array, dtype='<u4').tobytes()
+  return [int.from_bytes(raw[i:i+C_BLOCKSIZE_IN_BYTES], byteorder='little')
+          for i in range(0, len(raw), C_BLOCKSIZE_IN_BYTES)]
+
+# ------------------------------------------------------------------------------
+# Software reference on word arrays: C = M**key_e mod key_n. The integer path is
+# only taken here, the HW path never leaves the word arrays. Repeated blocks
+# are taken from the shared reference cache, and a file that was encrypted
+# with the same key before from the result cache, see rsa_reference.py.
+# ------------------------------------------------------------------------------
+def sw_encrypt_words(key_e, key_n, word_array, cache=result_cache):
+  start_time = time.time()
+  compute = lambda: {"words": msg2word(reference.encrypt_array(key_e, key_n, word2msg(word_array)))}
+  C_word_array = compute()["words"] if cache is None else cache.cached(golden_digest(key_e, key_n, word_array), compute)["words"]
+  return C_word_array, time.time()-start_time
+
+# ------------------------------------------------------------------------------
+# The conversion functions of the notebook, kept for the benchmark
+# ------------------------------------------------------------------------------
+def msg2word_reference(msg_array):
+  word_array_array = []
+  for msg in msg_array:
+    msg_in_bytes = msg.to_bytes(C_BLOCKSIZE_IN_BYTES,byteorder='little')
+    word_array_array.append(np.frombuffer(msg_in_bytes, dtype=np.uint32))
+  return np.concatenate(word_array_array)
+
+def word2msg_reference(word_array):
+  msg_array = []
+  message_count = int(len(word_array)/C_BLOCKSIZE_IN_32_BIT_WORDS)
+  for i in range(message_count):
+    M = 0
+    for j in range(C_BLOCKSIZE_IN_32_BIT_WORDS):
+      M += (int(word_array[i*C_BLOCKSIZE_IN_32_BIT_WORDS+j]) << (j*32))
+    msg_array.append(M)
+  return msg_array
+
+# ------------------------------------------------------------------------------
+# Function for testing msg2word word2msg conversion
+# ------------------------------------------------------------------------------
+def test_msg2msg():
+  ma_in = [0x0000000011111111222222223333333344444444555555556666666677777777,
+           0x8888888899999999aaaaaaaabbbbbbbbccccccccddddddddeeeeeeeeffffffff]
+  wa = msg2word(ma_in)
+  if(word2msg(wa) == ma_in and words_equal(wa, msg2word_reference(ma_in))):
+    print("test_msg2msg: PASSED")
+  else:
+    print("test_msg2msg: FAILED")
+
+# ------------------------------------------------------------------------------
+# Benchmark of the host conversion cost per MB, before (notebook) and after
+# ------------------------------------------------------------------------------
+def benchmark_conversion(size_in_mb=4, file_name="rsa_io_benchmark.bin"):
+  num_blocks = int(size_in_mb*(1 << 20)) // C_BLOCKSIZE_IN_BYTES
+  mb = num_blocks*C_BLOCKSIZE_IN_BYTES/(1 << 20)
+  np.random.default_rng(0).integers(0, 1 << 32, num_blocks*C_BLOCKSIZE_IN_32_BIT_WORDS, dtype=np.uint32).tofile(file_name)
+
+  def timed(function):
+    start_time = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter()-start_time)/mb
+
+  try:
+    msgs_before, t_read_before = timed(lambda: word2msg_reference(np.fromfile(file_name, dtype=np.uint32)))
+    words_before, t_m2w_before = timed(lambda: msg2word_reference(msgs_before))
+    _, t_write_before = timed(lambda: words_before.tofile(file_name + ".out"))
+    words_after, t_read_after = timed(lambda: read_words(file_name))
+    _, t_map_after = timed(lambda: map_words(file_name).sum())
+    msgs_after, t_w2m_after = timed(lambda: word2msg(words_after))
+    _, t_m2w_after = timed(lambda: msg2word(msgs_after))
+    _, t_write_after = timed(lambda: write_words(file_name + ".out", words_after))
+    assert msgs_before == msgs_after and words_equal(words_before, words_after)
+  finally:
+    for name in (file_name, file_name + ".out"):
+      if os.path.exists(name):
+        os.remove(name)
+
+  print("\n--- Host conversion cost, %.1f MB (%d blocks) ---\n" % (mb, num_blocks))
+  print("%-44s %12s" % ("Step", "ms/MB"))
+  print("%-44s %12.2f" % ("before: np.fromfile + word2msg", t_read_before*1e3))
+  print("%-44s %12.2f" % ("before: msg2word", t_m2w_before*1e3))
+  print("%-44s %12.2f" % ("before: tofile", t_write_before*1e3))
+  print("%-44s %12.2f" % ("after:  read_words (to DMA layout)", t_read_after*1e3))
+  print("%-44s %12.2f" % ("after:  map_words + touch all words", t_map_after*1e3))
+  print("%-44s %12.2f" % ("after:  word2msg (SW reference only)", t_w2m_after*1e3))
+  print("%-44s %12.2f" % ("after:  msg2word (SW reference only)", t_m2w_after*1e3))
+  print("%-44s %12.2f" % ("after:  write_words", t_write_after*1e3))
+  before = t_read_before + t_m2w_before + t_write_before
+  print("\nHW path, file to DMA buffer and back: %.2f -> %.2f ms/MB (%.0fx)" %
+        (before*1e3, (t_read_after+t_write_after)*1e3, before/(t_read_after+t_write_after)))
+
+if __name__ == "__main__":
+  test_msg2msg()
+  benchmark_conversion(float(sys.argv[1]) if len(sys.argv) > 1 else 4)
@@ -0,0 +1,186 @@
+# ------------------------------------------------------------------------------
+# In-process stand-in for the rsa_soc overlay, for developing the host code on
+# a machine without a PYNQ board.
+#
+#   MockMMIO - the register block, 32-bit registers with read/write/array.
+#              bytes_writes=False rejects bytes like MMIO.write of old PYNQ
+#   MockDMA  - sendchannel/recvchannel with transfer/wait/idle. The results of
+#              a transfer are computed when it starts, then a thread waits
+#              for the number of clock cycles the pipelined rsa_core needs for
+#              it, from the stage formulas in Microarchitecture/WCET.py, or
+#              the AXI stream time for XOR, and writes them to the recv
+#              buffer. Nothing competes with the host
+#              for the GIL during the modeled transfer, the compute time is
+#              kept in compute_time and left out of the reported times
+#   allocate - numpy buffers with close(), like pynq.allocate
+# ------------------------------------------------------------------------------
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Microarchitecture'))
+from WCET import CYC_RSA_STAGE_SLICE, ES_SIZE, F_CLK
+
+from rsa_io import msg2word, word2msg, C_BLOCKSIZE_IN_BITS, C_BLOCKSIZE_IN_32_BIT_WORDS
+from rsa_driver import RsaDriver, C_REG_KEY_N, C_REG_KEY_E_D
+from rsa_reference import C_KEY_N, C_KEY_E
+
+C_ENCR_ALGORITHM_XOR = 0
+C_ENCR_ALGORITHM_RSA = 1
+
+# The AXI streams of rsa_accelerator are 32 bits wide, a block is one word per clock
+C_CYCLES_PER_BLOCK_STREAM = C_BLOCKSIZE_IN_32_BIT_WORDS
+
+class MockBuffer(np.ndarray):
+  def close(self):
+    pass
+
+def allocate(shape, dtype=np.uint32):
+  return np.zeros(shape, dtype=dtype).view(MockBuffer)
+
+class MockMMIO:
+  def __init__(self, length=0x100, bytes_writes=True):
+    self.array = np.zeros(length//4, dtype=np.uint32)
+    self.bytes_writes = bytes_writes
+    self.write_calls = 0
+    self.read_calls = 0
+
+  def read(self, offset, length=4):
+    self.read_calls += 1
+    return int(self.array[offset//4])
+
+  def write(self, offset, data):
+    if isinstance(data, (bytes, bytearray)) and not self.bytes_writes:
+      raise ValueError("Data type must be int")
+    self.write_calls += 1
+    if isinstance(data, (bytes, bytearray)):
+      words = np.frombuffer(data, dtype='<u4')
+      self.array[offset//4:offset//4+len(words)] = words
+    else:
+      self.array[offset//4] = data
+
+  def key(self, offset):
+    return word2msg(self.array[offset//4:offset//4+C_BLOCKSIZE_IN_32_BIT_WORDS])[0]
+
+# ------------------------------------------------------------------------------
+# Cycles for a transfer of num_blocks through the pipeline: the first block
+# passes every stage, after that one block leaves per stage time. XOR does not
+# use the exponentiation pipeline, its blocks stream in and out at the AXI
+# stream width, in and out overlap
+# ------------------------------------------------------------------------------
+def transfer_cycles(num_blocks, stages=16, key_length=C_BLOCKSIZE_IN_BITS, setup_cycles=0, algorithm=C_ENCR_ALGORITHM_RSA):
+  if num_blocks == 0:
+    return setup_cycles
+  if algorithm == C_ENCR_ALGORITHM_XOR:
+    return setup_cycles + (num_blocks+1)*C_CYCLES_PER_BLOCK_STREAM
+  cyc_stage = CYC_RSA_STAGE_SLICE(key_length, ES_SIZE(key_length, stages))
+  return setup_cycles + stages*cyc_stage + (num_blocks-1)*cyc_stage
+
+class MockChannel:
+  def __init__(self, dma):
+    self.dma = dma
+    self.buffer = None
+
+  def transfer(self, buffer):
+    assert self.idle, "DMA channel is not idle"
+    self.buffer = buffer
+    self.dma.start()
+
+  def wait(self):
+    self.dma.wait()
+
+  @property
+  def idle(self):
+    return self.dma.idle
+
+class MockDMA:
+  def __init__(self, mmio, stages=16, f_clk=F_CLK, time_scale=1.0, setup_cycles=0, algorithm=C_ENCR_ALGORITHM_RSA):
+    self.mmio = mmio
+    self.stages = stages
+    self.f_clk = f_clk
+    self.time_scale = time_scale          # Wall clock seconds per modeled second
+    self.setup_cycles = setup_cycles      # Fixed cost per transfer, e.g. descriptor setup and polling
+    self.algorithm = algorithm
+    self.sendchannel = MockChannel(self)
+    self.recvchannel = MockChannel(self)
+    self.thread = None
+    self.cycles = 0                       # Modeled cycles of all transfers
+    self.compute_time = 0.0               # Wall clock seconds spent computing the results, not modeled
+
+  @property
+  def idle(self):
+    return self.thread is None
+
+  def start(self):
+    # The accelerator starts when both channels have a buffer, as the send and recv transfers of the notebook
+    if self.sendchannel.buffer is None or self.recvchannel.buffer is None:
+      return
+    inp, otp = self.sendchannel.buffer, self.recvchannel.buffer
+    self.sendchannel.buffer = None
+    self.recvchannel.buffer = None
+    assert len(inp) == len(otp), "The send and receive transfers must have the same length"
+    cycles = transfer_cycles(len(inp)//C_BLOCKSIZE_IN_32_BIT_WORDS, self.stages, setup_cycles=self.setup_cycles,
+                             algorithm=self.algorithm)
+    self.cycles += cycles
+    t = time.perf_counter()
+    result = self.compute(inp)
+    self.compute_time += time.perf_counter()-t
+    # The modeled transfer starts once the results are known
+    deadline = time.perf_counter() + cycles/self.f_clk*self.time_scale
+    self.thread = threading.Thread(target=self.run, args=(result, otp, deadline))
+    self.thread.start()
+
+  def compute(self, inp):
+    key_n = self.mmio.key(C_REG_KEY_N)
+    key_e_d = self.mmio.key(C_REG_KEY_E_D)
+    if self.algorithm == C_ENCR_ALGORITHM_RSA:
+      return msg2word([pow(M, key_e_d, key_n) for M in word2msg(inp)])
+    return np.bitwise_xor(inp.reshape(-1, C_BLOCKSIZE_IN_32_BIT_WORDS), msg2word([key_n])).reshape(-1)
+
+  def run(self, result, otp, deadline):
+    remaining = deadline - time.perf_counter()
+    if remaining > 0:
+      time.sleep(remaining)
+    np.copyto(otp, result)
+
+  def wait(self):
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+# ------------------------------------------------------------------------------
+# Synchronous vs double buffered on the mock, checked against the software model
+# ------------------------------------------------------------------------------
+def compare_drivers(num_blocks=20000, chunk_blocks=2048, stages=16, time_scale=1.0, algorithm=C_ENCR_ALGORITHM_RSA):
+  key_n, key_e = C_KEY_N, C_KEY_E
+  rng = np.random.default_rng(0)
+  M_array = [int.from_bytes(rng.bytes(32), 'little') % key_n for _ in range(num_blocks)]
+  if algorithm == C_ENCR_ALGORITHM_RSA:
+    expected = [pow(M, key_e, key_n) for M in M_array]
+  else:
+    expected = [M ^ key_n for M in M_array]
+
+  print("\n--- RsaDriver on MockDMA, %d blocks in chunks of %d, %d stages, %s ---\n" %
+        (num_blocks, chunk_blocks, stages, "RSA" if algorithm == C_ENCR_ALGORITHM_RSA else "XOR"))
+  print("%-16s %8s %10s %10s %10s %10s %10s %8s" % ("Driver", "MMIO wr", "model ms", "total ms", "host ms", "wait ms", "blocks/s", "check"))
+  for name, synchronous in (("synchronous", True), ("double buffered", False)):
+    mmio = MockMMIO()
+    dma = MockDMA(mmio, stages, time_scale=time_scale, algorithm=algorithm)
+    driver = RsaDriver(dma, mmio, allocate, chunk_blocks)
+    C_array, _ = driver.hw_encrypt(key_e, key_n, M_array, synchronous=synchronous)
+    driver.close()
+    stats = driver.stats
+    # The results computed by the mock are not part of the modeled run
+    total_time = stats["total_time"] - dma.compute_time
+    print("%-16s %8d %10.1f %10.1f %10.1f %10.1f %10.0f %8s" % (name, mmio.write_calls, dma.cycles/F_CLK*time_scale*1e3,
+          total_time*1e3, stats["host_time"]*1e3, stats["wait_time"]*1e3, num_blocks/total_time,
+          "PASSED" if C_array == expected else "FAILED"))
+
+if __name__ == "__main__":
+  # rsa_mock.py [num_blocks] [chunk_blocks] [rsa|xor]
+  compare_drivers(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+                  int(sys.argv[2]) if len(sys.argv) > 2 else 2048,
+                  algorithm=C_ENCR_ALGORITHM_XOR if len(sys.argv) > 3 and sys.argv[3] == "xor" else C_ENCR_ALGORITHM_RSA)
@@ -0,0 +1,285 @@
+# ------------------------------------------------------------------------------
+# Memoizing software reference for C = M**e mod n.
+#
+# The message files are text, so the same 256-bit block shows up many times
+# (banner lines, indentation, repeated words): 1480 of the 1926 input blocks
+# in crypto/rsa/inp_messages are unique, 1494 when counted file by file as
+# benchmark_reference does. The reference keeps the last results in a bounded
+# LRU keyed by (M, e, n), such that a repeated block costs a dictionary lookup
+# instead of a modular exponentiation.
+#
+# One engine, reference, is shared by the host code (rsa_io), the HLM models
+# (BlakeleyParalell.reportResults) and the testbench generators in
+# Utilities/tb_utilities. This file is on the SD card, the others import it
+# from here.
+#
+# Results that outlive a run, golden outputs of whole files and model cycle
+# counts, go to the on-disk ResultCache below.
+#
+# Drop-in use in the notebook, RSA only:
+#   from rsa_reference import sw_encrypt, sw_decrypt
+# ------------------------------------------------------------------------------
+import functools
+import hashlib
+import os
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+C_REFERENCE_CACHE_SIZE = 1 << 16    # Results kept, 256-bit M and C take ~150 bytes per entry
+C_RESULT_CACHE_DIR = os.path.expanduser(os.environ.get("RSA_RESULT_CACHE", ""))    # Off unless set
+C_RESULT_CACHE_DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rsa_results")    # For caches asked for explicitly
+C_RESULT_CACHE_BYTES = 256 << 20    # Size of the on-disk cache, the least recently used entries are evicted
+
+# The key of the notebook and the crypto folder, the other tools import it from here
+C_KEY_N = 0x99925173ad65686715385ea800cd28120288fc70a9bc98dd4c90d676f8ff768d
+C_KEY_E = 0x0000000000000000000000000000000000000000000000000000000000010001
+C_KEY_D = 0x0cea1651ef44be1f1f1476b7539bed10d73e3aac782bd9999a1e5a790932bfe9
+
+# ------------------------------------------------------------------------------
+# The LRU of a process pool worker is a copy, its hits and misses are not seen
+# by the parent. A chunk function takes counts() when it starts and returns
+# lookups_since() of it with its result, the parent adds it with merge()
+# ------------------------------------------------------------------------------
+class ReferenceEngine:
+  def __init__(self, maxsize=C_REFERENCE_CACHE_SIZE):
+    self.maxsize = maxsize
+    self.pow = functools.lru_cache(maxsize=maxsize)(pow)
+    self.worker_hits = 0
+    self.worker_misses = 0
+
+  def encrypt(self, key_e, key_n, M):
+    return self.pow(M, key_e, key_n)
+
+  def encrypt_array(self, key_e, key_n, M_array):
+    cached_pow = self.pow
+    return [cached_pow(M, key_e, key_n) for M in M_array]
+
+  def counts(self):
+    info = self.pow.cache_info()
+    return os.getpid(), info.hits, info.misses
+
+  def lookups_since(self, start):
+    pid, hits, misses = self.counts()
+    return pid, hits - start[1], misses - start[2]
+
+  def merge(self, lookups):
+    # The lookups of a chunk that ran in this process are in its LRU already
+    pid, hits, misses = lookups
+    if pid != os.getpid():
+      self.worker_hits += hits
+      self.worker_misses += misses
+
+  def stats(self):
+    # entries is the LRU of this process, hits and misses include the merged workers
+    info = self.pow.cache_info()
+    hits = info.hits + self.worker_hits
+    misses = info.misses + self.worker_misses
+    lookups = hits + misses
+    return {"entries": info.currsize, "maxsize": info.maxsize, "lookups": lookups, "hits": hits,
+            "misses": misses, "hit_rate": hits/lookups if lookups else 0.0}
+
+  def report(self, name="Reference"):
+    stats = self.stats()
+    print("%s: %d lookups, %d hits, %d misses, hit rate %.1f%%, %d of %d entries" %
+          (name, stats["lookups"], stats["hits"], stats["misses"], 100*stats["hit_rate"], stats["entries"], stats["maxsize"]))
+
+  def clear(self):
+    self.pow.cache_clear()
+    self.worker_hits = 0
+    self.worker_misses = 0
+
+reference = ReferenceEngine()
+
+# ------------------------------------------------------------------------------
+# Persistent, content-addressed result cache
+#
+# An entry is a set of numpy arrays in one .npz file, named by the sha256 of
+# everything the result depends on: the input blocks, the key and for the
+# models and generators their configuration and the digest of their source
+# files. A changed corpus, key, configuration or source gives a new name, so
+# entries are never stale and never rewritten. Entries are
+# written to a temporary file and renamed, so several processes can share a
+# folder. A hit touches the file, and the oldest files are removed when the
+# folder grows above max_bytes.
+#
+# The shared result_cache is off unless RSA_RESULT_CACHE names a folder, such
+# that importing this file (on the board, or in a script that only reports
+# results) never writes to the disk. Long runs that want the cache, as
+# HLM/Sweep.py, make their own in C_RESULT_CACHE_DEFAULT_DIR.
+# ------------------------------------------------------------------------------
+def cache_digest(*parts):
+  digest = hashlib.sha256()
+  for part in parts:
+    if isinstance(part, np.ndarray):
+      data = np.ascontiguousarray(part).tobytes()
+    elif isinstance(part, bytes):
+      data = part
+    else:
+      data = repr(part).encode()
+    digest.update(len(data).to_bytes(8, byteorder='little'))
+    digest.update(data)
+  return digest.hexdigest()
+
+def golden_digest(key_e, key_n, word_array):
+  # C = M**key_e mod key_n of a word array does not depend on the model, only on the words and the key
+  return cache_digest("golden", key_n, key_e, np.ascontiguousarray(word_array, dtype='<u4').tobytes())
+
+class ResultCache:
+  def __init__(self, folder=C_RESULT_CACHE_DIR, max_bytes=C_RESULT_CACHE_BYTES):
+    self.folder = folder or None
+    self.max_bytes = max_bytes
+    self.total_bytes = None
+    self.hits = 0
+    self.misses = 0
+    self.saved_s = 0.0
+    self.evicted = 0
+
+  def path(self, digest):
+    return os.path.join(self.folder, digest + ".npz")
+
+  def load(self, digest):
+    # Returns (arrays, seconds the result took to compute), or None. Does not count, see get
+    if self.folder is None:
+      return None
+    try:
+      with np.load(self.path(digest)) as entry:
+        arrays = {name: entry[name] for name in entry.files}
+      os.utime(self.path(digest))
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+      return None
+    return arrays, float(arrays.pop("_seconds", 0.0))
+
+  def record(self, hit, seconds=0.0):
+    if hit:
+      self.hits += 1
+      self.saved_s += seconds
+    else:
+      self.misses += 1
+
+  def get(self, digest):
+    start_time = time.perf_counter()
+    entry = self.load(digest)
+    if entry is None:
+      self.record(False)
+      return None
+    self.record(True, max(0.0, entry[1] - (time.perf_counter()-start_time)))
+    return entry[0]
+
+  def put(self, digest, arrays, seconds=0.0):
+    if self.folder is None:
+      return
+    os.makedirs(self.folder, exist_ok=True)
+    temp_name = "%s.%d.tmp" % (self.path(digest), os.getpid())
+    with open(temp_name, 'wb') as file:
+      np.savez_compressed(file, _seconds=np.float64(seconds), **arrays)
+    os.replace(temp_name, self.path(digest))
+    if self.total_bytes is None:
+      self.total_bytes = self.size()
+    else:
+      self.total_bytes += os.path.getsize(self.path(digest))
+    if self.total_bytes > self.max_bytes:
+      self.evict()
+
+  def cached(self, digest, compute):
+    # Returns the arrays of the entry, compute() -> {name: array} fills it on a miss
+    arrays = self.get(digest)
+    if arrays is None:
+      start_time = time.perf_counter()
+      arrays = compute()
+      self.put(digest, arrays, time.perf_counter()-start_time)
+    return arrays
+
+  def entries(self):
+    if self.folder is None or not os.path.isdir(self.folder):
+      return []
+    return [entry for entry in os.scandir(self.folder) if entry.name.endswith(".npz")]
+
+  def size(self):
+    return sum(entry.stat().st_size for entry in self.entries())
+
+  def evict(self):
+    files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self.entries())
+    self.total_bytes = sum(size for _, size, _ in files)
+    for _, size, path in files:
+      if self.total_bytes <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        continue
+      self.total_bytes -= size
+      self.evicted += 1
+
+  def clear(self):
+    for entry in self.entries():
+      os.remove(entry.path)
+    self.total_bytes = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {"folder": self.folder, "entries": len(self.entries()), "bytes": self.size(), "hits": self.hits,
+            "misses": self.misses, "hit_rate": self.hits/lookups if lookups else 0.0, "saved_s": self.saved_s,
+            "evicted": self.evicted}
+
+  def report(self, name="Result cache"):
+    if self.folder is None:
+      print("%s: off, set RSA_RESULT_CACHE to a folder to turn it on" % name)
+      return
+    stats = self.stats()
+    print("%s: %d hits, %d misses, hit rate %.1f%%, %.2f s saved, %d entries, %.1f MB in %s" %
+          (name, stats["hits"], stats["misses"], 100*stats["hit_rate"], stats["saved_s"], stats["entries"],
+           stats["bytes"]/(1 << 20), stats["folder"]))
+
+result_cache = ResultCache()
+
+def active_cache(cache):
+  # None for no cache and for a ResultCache that is off, callers then take their uncached path
+  return cache if cache is not None and cache.folder is not None else None
+
+# ------------------------------------------------------------------------------
+# The sw_encrypt/sw_decrypt functions of the notebook on the shared engine
+# ------------------------------------------------------------------------------
+def sw_encrypt(key_e, key_n, M_array, engine=reference):
+  start_time = time.time()
+  C_array = engine.encrypt_array(key_e, key_n, M_array)
+  return C_array, time.time()-start_time
+
+def sw_decrypt(key_d, key_n, C_array, engine=reference):
+  return sw_encrypt(key_d, key_n, C_array, engine)
+
+# ------------------------------------------------------------------------------
+# Uncached vs cached reference over the message files of a crypto folder
+# ------------------------------------------------------------------------------
+def benchmark_reference(folder="crypto/rsa/inp_messages", maxsize=C_REFERENCE_CACHE_SIZE):
+  from rsa_io import read_words, word2msg
+  key_n, key_e, key_d = C_KEY_N, C_KEY_E, C_KEY_D
+  engine = ReferenceEngine(maxsize)
+  files = sorted(os.listdir(folder))
+
+  print("\n--- Software reference, %s, LRU of %d results ---\n" % (folder, maxsize))
+  print("%-14s %8s %8s %12s %12s %8s %8s" % ("File", "blocks", "unique", "pow ms", "cached ms", "speedup", "check"))
+  total_pow = 0.0
+  total_cached = 0.0
+  for file_name in files:
+    M_array = word2msg(read_words(os.path.join(folder, file_name)))
+    # pt files are encrypted with e, ct files decrypted with d, as in the notebook
+    key_e_d = key_e if file_name.startswith("pt") else key_d
+    start_time = time.perf_counter()
+    expected = [pow(M, key_e_d, key_n) for M in M_array]
+    t_pow = time.perf_counter()-start_time
+    C_array, t_cached = sw_encrypt(key_e_d, key_n, M_array, engine)
+    total_pow += t_pow
+    total_cached += t_cached
+    print("%-14s %8d %8d %12.2f %12.2f %8.2f %8s" % (file_name, len(M_array), len(set(M_array)), t_pow*1e3, t_cached*1e3,
+          t_pow/t_cached if t_cached else 0.0, "PASSED" if C_array == expected else "FAILED"))
+  stats = engine.stats()
+  print("\nTotal %.2f -> %.2f ms (%.2fx), %d hits, %d misses, hit rate %.1f%%" %
+        (total_pow*1e3, total_cached*1e3, total_pow/total_cached, stats["hits"], stats["misses"], 100*stats["hit_rate"]))
+
+if __name__ == "__main__":
+  # rsa_reference.py [folder] [maxsize]
+  benchmark_reference(sys.argv[1] if len(sys.argv) > 1 else "crypto/rsa/inp_messages",
+                      int(sys.argv[2]) if len(sys.argv) > 2 else C_REFERENCE_CACHE_SIZE)
@@ -1,5 +1,11 @@
 import random
 import csv
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tb_stream import shard_rng, format_row, end_row, run_shards, write_chunks
+from rsa_reference import result_cache
 
 #Simple test case generator for the Blakeley module
 
@@ -41,9 +47,35 @@ def generate_csv(file_name, num_cases, max_value):
         # Write the end-of-file indicator
         writer.writerow(['0' * 256, '0' * 256, '0' * 256, '0' * 256, 'EOL'])
 
+def generate_shard(shard, start, count, seed, max_value, fmt):
+    # Generate count cases of A, B, N and expected_R, seeded from (seed, shard)
+    rng = shard_rng(seed, shard)
+    rows = []
+    while len(rows) < count:
+        A = rng.randint(1, max_value)
+        B = rng.randint(1, max_value)
+        if max(A, B) >= max_value:
+            continue
+        N = rng.randint(max(A, B) + 1, max_value)
+        rows.append(format_row([A, B, N, (A * B) % N], fmt))
+    return ''.join(rows)
+
+def generate_csv_stream(file_name, num_cases, max_value, seed=0, shard_size=10000, workers=None, fmt="csv", cache=result_cache):
+    # Streaming version of generate_csv for large vector counts, the cases are computed in a process pool
+    # and written shard by shard, so memory use does not depend on num_cases
+    with open(file_name, mode='w', newline='', buffering=1 << 20) as file:
+        shards_written = write_chunks(file, run_shards(generate_shard, num_cases, shard_size, workers, seed, max_value, fmt, cache=cache))
+        file.write(end_row(4, fmt))
+    print(f"Generated {num_cases} cases in {shards_written} shards to {file_name} (seed {seed})")
+
 if __name__ == "__main__":
     NUM_CASES = 100  # Set the desired number of test cases
     MAX_VAL = (2 ** 256) - 1  # Set maximum value for A, B, N
     csv_file_name = "blakeleymoduletestcases.csv"
 
-    generate_csv(csv_file_name, NUM_CASES, MAX_VAL)
\ No newline at end of file
+    if len(sys.argv) > 1:
+        # Large runs: bm_testcase_gen.py <num_cases> [seed]
+        generate_csv_stream(csv_file_name, int(sys.argv[1]), MAX_VAL, seed=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+        result_cache.report()
+    else:
+        generate_csv(csv_file_name, NUM_CASES, MAX_VAL)
\ No newline at end of file
@@ -0,0 +1,154 @@
+import mmap
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tb_stream import shard_rng, to_hex_string, run_shards
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'files_for_the_pynq_sd_card'))
+from rsa_reference import reference, result_cache, C_KEY_N, C_KEY_E, C_KEY_D
+
+#Generator and reader for corpora in the rsa_tests format used by rsa_accelerator_tb.vhd:
+#   <folder>/inp_messages/<prefix>.inp_messages.hex_pt0_in.txt  - header, then one 64 hex digit block per line
+#   <folder>/otp_messages/<prefix>.otp_messages.hex_ct0_out.txt - the golden blocks, no header
+#The header is "# KEY N", "# KEY E", "# KEY D" and "# COMMAND" followed by their values and an empty line.
+#Like the provided short_tests/long_tests, testcase i < len(sizes) encrypts (COMMAND 1, pt{i}_in -> ct{i}_out)
+#and testcase i+len(sizes) decrypts the ciphertexts of testcase i back (COMMAND 0, ct{i+len(sizes)}_in -> pt{i+len(sizes)}_out).
+#No file ends with a newline.
+
+KEY_N = C_KEY_N
+KEY_E = C_KEY_E
+KEY_D = C_KEY_D
+
+BLOCK_SIZE = 256
+BLOCK_HEX_DIGITS = BLOCK_SIZE // 4
+BLOCK_WORDS = BLOCK_SIZE // 32
+COMMAND_DECRYPT = 0
+COMMAND_ENCRYPT = 1
+
+#Hex digit value of every byte, 0xff for bytes that are not hex digits
+HEX_LUT = np.full(256, 0xff, dtype=np.uint8)
+for digit in range(16):
+    HEX_LUT[ord(format(digit, 'x'))] = digit
+    HEX_LUT[ord(format(digit, 'X'))] = digit
+
+def header(n, e, d, command):
+    return (f"# KEY N\n{to_hex_string(n, BLOCK_SIZE)}\n# KEY E\n{to_hex_string(e, BLOCK_SIZE)}\n"
+            f"# KEY D\n{to_hex_string(d, BLOCK_SIZE)}\n# COMMAND\n{command}\n\n")
+
+def testcase_files(folder, prefix, testcase, num_sizes):
+    """Returns the (input, output) file names of a testcase, named as in the provided rsa_tests."""
+    inp, otp = ("pt", "ct") if testcase < num_sizes else ("ct", "pt")
+    inp_file = os.path.join(folder, "inp_messages", f"{prefix}.inp_messages.hex_{inp}{testcase}_in.txt")
+    otp_file = os.path.join(folder, "otp_messages", f"{prefix}.otp_messages.hex_{otp}{testcase}_out.txt")
+    return inp_file, otp_file
+
+def generate_blocks_shard(shard, start, count, seed, e, n):
+    """Generate count random plaintext blocks M < n and their golden C = M^e mod n, seeded from (seed, shard)."""
+    rng = shard_rng(seed, shard)
+    plain = []
+    cipher = []
+    for _ in range(count):
+        M = rng.randint(0, n-1)
+        plain.append(to_hex_string(M, BLOCK_SIZE))
+        cipher.append(to_hex_string(reference.encrypt(e, n, M), BLOCK_SIZE))
+    return '\n'.join(plain), '\n'.join(cipher)
+
+def generate_testcase_pair(folder, prefix, testcase, num_sizes, num_blocks, n=KEY_N, e=KEY_E, d=KEY_D, seed=0, shard_size=10000, workers=None, cache=result_cache):
+    """Writes the encryption testcase and its decryption testcase (testcase+num_sizes) in one streaming pass.
+    The plaintexts are the golden outputs of the decryption, so only C = M^e mod n has to be computed."""
+    pt_in, ct_out = testcase_files(folder, prefix, testcase, num_sizes)
+    ct_in, pt_out = testcase_files(folder, prefix, testcase+num_sizes, num_sizes)
+    files = [open(name, mode='w', newline='', buffering=1 << 20) for name in (pt_in, ct_out, ct_in, pt_out)]
+    try:
+        files[0].write(header(n, e, d, COMMAND_ENCRYPT))
+        files[2].write(header(n, e, d, COMMAND_DECRYPT))
+        separator = ''
+        for plain, cipher in run_shards(generate_blocks_shard, num_blocks, shard_size, workers, f"{seed}:{testcase}", e, n, cache=cache):
+            for file, chunk in zip(files, (plain, cipher, cipher, plain)):
+                file.write(separator + chunk)
+            separator = '\n'
+    finally:
+        for file in files:
+            file.close()
+    print(f"Generated testcases {testcase} and {testcase+num_sizes} with {num_blocks} blocks (seed {seed})")
+
+def generate_corpus(folder, prefix, sizes, n=KEY_N, e=KEY_E, d=KEY_D, seed=0, shard_size=10000, workers=None, cache=result_cache):
+    """Generates a corpus with one encryption and one decryption testcase per entry of sizes (number of blocks)."""
+    os.makedirs(os.path.join(folder, "inp_messages"), exist_ok=True)
+    os.makedirs(os.path.join(folder, "otp_messages"), exist_ok=True)
+    for testcase, num_blocks in enumerate(sizes):
+        generate_testcase_pair(folder, prefix, testcase, len(sizes), num_blocks, n, e, d, seed, shard_size, workers, cache)
+
+def read_header(file_name):
+    """Returns the key and command of an input file as a dict with n, e, d and command."""
+    with open(file_name, mode='r') as file:
+        lines = [file.readline().strip() for _ in range(8)]
+    if lines[0::2] != ["# KEY N", "# KEY E", "# KEY D", "# COMMAND"]:
+        raise ValueError(f"{file_name} does not start with the rsa_tests header")
+    return {"n": int(lines[1], 16), "e": int(lines[3], 16), "d": int(lines[5], 16), "command": int(lines[7])}
+
+def hex_lines_to_words(data, offset=0):
+    """Converts fixed width lines of 64 hex digits in the uint8 array data, starting at offset, to a
+    (blocks, 8) uint32 array. Word 0 is the least significant, like msg2word in the PYNQ notebook."""
+    line = BLOCK_HEX_DIGITS + 1
+    size = len(data) - offset
+    if size <= 0:
+        return np.zeros((0, BLOCK_WORDS), dtype=np.uint32)
+    if size % line not in (0, BLOCK_HEX_DIGITS):
+        raise ValueError(f"The message section is {size} bytes, which is not a whole number of {BLOCK_HEX_DIGITS} hex digit lines")
+    blocks = (size + 1) // line
+    #Strided view of the digits of every line, the newline column is skipped without copying
+    digits = np.lib.stride_tricks.as_strided(data[offset:], shape=(blocks, BLOCK_HEX_DIGITS), strides=(line, 1))
+    if blocks > 1 and np.any(data[offset+BLOCK_HEX_DIGITS:offset+(blocks-1)*line:line] != ord('\n')):
+        raise ValueError("The message lines are not separated by single newlines")
+    nibbles = HEX_LUT[digits]
+    if np.any(nibbles == 0xff):
+        raise ValueError("The message section contains characters that are not hex digits")
+    big_endian = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    return np.ascontiguousarray(big_endian[:, ::-1]).view('<u4')
+
+def read_words(file_name):
+    """Memory maps an input or output file and returns its blocks as a (blocks, 8) uint32 array."""
+    with open(file_name, mode='rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return np.zeros((0, BLOCK_WORDS), dtype=np.uint32)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = np.frombuffer(mapped, dtype=np.uint8)
+            offset = 0
+            if mapped[:1] == b'#':
+                #Input files, the messages start after the empty line following the header
+                offset = mapped.find(b'\n\n') + 2
+                if offset == 1:
+                    raise ValueError(f"{file_name} has no empty line after the header")
+            words = hex_lines_to_words(data, offset)
+            del data
+    return words
+
+def words_to_ints(words):
+    """Converts a (blocks, 8) uint32 array to a list of Python ints for the HLM models."""
+    raw = np.ascontiguousarray(words, dtype='<u4').tobytes()
+    block_bytes = BLOCK_WORDS * 4
+    return [int.from_bytes(raw[i:i+block_bytes], 'little') for i in range(0, len(raw), block_bytes)]
+
+def read_testcase(inp_file, otp_file):
+    """Returns the header of the input file and the input and golden output blocks as uint32 arrays."""
+    return read_header(inp_file), read_words(inp_file), read_words(otp_file)
+
+def check_corpus(folder, prefix, num_sizes, workers=None):
+    """Checks every output block of a corpus against pow() with the key of its input file, returns the number of errors."""
+    from tb_verify import verify_rsa_tests
+    return verify_rsa_tests(folder, prefix, num_sizes, workers)
+
+if __name__ == "__main__":
+    #rsa_tests_gen.py [num_blocks] [seed] [folder], writes pt0/ct3 with num_blocks, pt1/ct4 with 10x and pt2/ct5 with 1 block
+    NUM_BLOCKS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    SEED = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    FOLDER = sys.argv[3] if len(sys.argv) > 3 else "stress_tests"
+    SIZES = [NUM_BLOCKS, 10*NUM_BLOCKS, 1]
+    generate_corpus(FOLDER, "stress_test", SIZES, seed=SEED)
+    errors = check_corpus(FOLDER, "stress_test", len(SIZES))
+    print("All golden outputs are correct!" if errors == 0 else f"There were {errors} mismatches in the corpus")
+    reference.report()
+    result_cache.report()
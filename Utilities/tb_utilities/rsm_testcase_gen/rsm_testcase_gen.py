@@ -1,5 +1,12 @@
 import random
 import csv
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tb_stream import shard_rng, format_row, end_row, run_shards, write_chunks
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'files_for_the_pynq_sd_card'))
+from rsa_reference import reference, result_cache
 
 def generate_random_number(min_value,max_value):
     """Generate a random number between 1 and max_value."""
@@ -33,8 +40,8 @@ def generate_case(max_value,n):
         M = generate_random_number(n - 1)  # M must be less than n
         e = generate_random_number(n - 1)  # e must also be less than n
         
-        # Compute C = M^e mod n using Python's built-in modular exponentiation
-        C = pow(M, e, n)
+        # Compute C = M^e mod n with the shared software reference
+        C = reference.encrypt(e, n, M)
         
         # Convert to binary strings of length 256
         binary_M = to_binary_string(M)
@@ -64,6 +71,36 @@ def generate_binary_string(max_value,min_value):
     value = random.randint(min_value, max_value)
     return bin(value)[2:].zfill(256)
 
+def pair_ranges(i, max_value_upper, max_value_lower):
+    """Ranges of M, e and n for case i of generate_csv_pairs, returns min_M, max_M, min_e, max_e, max_n."""
+    min_M = 2**253
+    min_e = 2**253
+    if i <=12:
+        max_M = max_value_upper - 1
+        min_M = max_value_lower + 1
+        max_e = max_value_upper - 1
+        min_e = max_value_lower + 1
+        max_n = max_value_upper
+    elif i>=12 and i<24:
+        max_M = max_value_lower
+        max_e = max_value_lower
+        max_n = max_value_upper
+    elif i>=24 and i<36:
+        max_M = max_value_upper - 1
+        min_M = max_value_lower + 1
+        max_e = max_value_lower
+        max_n = max_value_upper
+    elif i>=36 and i<48:
+        max_M = max_value_lower
+        max_e = max_value_upper - 1
+        min_e = max_value_lower + 1
+        max_n = max_value_upper
+    else:
+        max_M = max_value_lower - 1
+        max_e = max_value_lower - 1
+        max_n = max_value_lower
+    return min_M, max_M, min_e, max_e, max_n
+
 def generate_csv_pairs(file_name, num_cases, max_value_upper, max_value_lower):
     """Generate a CSV file with num_cases of random M, e, n, C cases."""
     with open(file_name, mode='w', newline='') as file:
@@ -71,39 +108,14 @@ def generate_csv_pairs(file_name, num_cases, max_value_upper, max_value_lower):
         
         for i in range(1,num_cases):
             while True:
-                min_M = 2**253
-                min_e = 2**253
-                if i <=12:
-                    max_M = max_value_upper - 1
-                    min_M = max_value_lower + 1
-                    max_e = max_value_upper - 1
-                    min_e = max_value_lower + 1
-                    max_n = max_value_upper
-                elif i>=12 and i<24:
-                    max_M = max_value_lower
-                    max_e = max_value_lower
-                    max_n = max_value_upper
-                elif i>=24 and i<36:
-                    max_M = max_value_upper - 1
-                    min_M = max_value_lower + 1
-                    max_e = max_value_lower
-                    max_n = max_value_upper
-                elif i>=36 and i<48:
-                    max_M = max_value_lower
-                    max_e = max_value_upper - 1
-                    min_e = max_value_lower + 1
-                    max_n = max_value_upper
-                else:
-                    max_M = max_value_lower - 1
-                    max_e = max_value_lower - 1
-                    max_n = max_value_lower
+                min_M, max_M, min_e, max_e, max_n = pair_ranges(i, max_value_upper, max_value_lower)
 
                 binary_M = generate_binary_string(max_M,min_M)
                 binary_e = generate_binary_string(max_e,min_e)
                 binary_n = generate_binary_string(max_n,2**253)
                 if(int(binary_M, 2) < int(binary_n, 2) and int(binary_e, 2) < int(binary_n, 2)):
                     break
-            binary_C = to_binary_string(pow(int(binary_M, 2), int(binary_e, 2), int(binary_n, 2)))
+            binary_C = to_binary_string(reference.encrypt(int(binary_e, 2), int(binary_n, 2), int(binary_M, 2)))
             print(f"Lengths: {len(binary_M)}, {len(binary_e)}, {len(binary_n)}, {len(binary_C)}")
             writer.writerow([binary_M, binary_e, binary_n, binary_C, 'EOL'])
             print(f"Generated case {i} - M: {hex(int(binary_M, 2))}, e: {hex(int(binary_e, 2))}, n: {hex(int(binary_n, 2))}, C: {hex(int(binary_C, 2))}")
@@ -126,18 +138,72 @@ def generate_csv(m_file, k_file, num_cases,min_value, max_value):
         for i in range(0,2):
             for _ in range(num_cases):
                 binary_M = generate_message(min_value,int(binary_n, 2)-1)
-                binary_C = to_binary_string(pow(int(binary_M, 2), int(binary_e, 2), int(binary_n, 2)))
+                binary_C = to_binary_string(reference.encrypt(int(binary_e, 2), int(binary_n, 2), int(binary_M, 2)))
                 writerM.writerow([binary_M, binary_C, 'EOL'])
                 print(f"Generated message - M: {hex(int(binary_M,2))}, (length: {len(binary_M)}), C: {hex(int(binary_C,2))}, (length: {len(binary_C)})")
             
             # Write the end of file indicator
             writerM.writerow(['0' * 256, '0' * 256, '0' * 256, '0' * 256, 'EOL'])  # Ensure the end row has the same binary length
 
+def generate_pairs_shard(shard, start, count, seed, max_value_upper, max_value_lower, fmt):
+    """Generate M, e, n, C rows for cases start+1 .. start+count of generate_csv_pairs, seeded from (seed, shard)."""
+    rng = shard_rng(seed, shard)
+    rows = []
+    for i in range(start+1, start+count+1):
+        min_M, max_M, min_e, max_e, max_n = pair_ranges(i, max_value_upper, max_value_lower)
+        while True:
+            M = rng.randint(min_M, max_M)
+            e = rng.randint(min_e, max_e)
+            n = rng.randint(2**253, max_n)
+            if M < n and e < n:
+                break
+        rows.append(format_row([M, e, n, reference.encrypt(e, n, M)], fmt))
+    return ''.join(rows)
+
+def generate_csv_pairs_stream(file_name, num_cases, max_value_upper, max_value_lower, seed=0, shard_size=10000, workers=None, fmt="csv", cache=result_cache):
+    """Streaming version of generate_csv_pairs, golden C values are computed in a process pool and written shard by shard."""
+    with open(file_name, mode='w', newline='', buffering=1 << 20) as file:
+        write_chunks(file, run_shards(generate_pairs_shard, num_cases-1, shard_size, workers, seed, max_value_upper, max_value_lower, fmt, cache=cache))
+        file.write(end_row(4, fmt))
+    print(f"Generated {num_cases-1} cases to {file_name} (seed {seed})")
+
+def generate_message_shard(shard, start, count, seed, min_value, e, n, fmt):
+    """Generate count M, C rows for the key e, n, seeded from (seed, shard)."""
+    rng = shard_rng(seed, shard)
+    rows = []
+    for _ in range(count):
+        M = rng.randint(min_value, n-1)
+        rows.append(format_row([M, reference.encrypt(e, n, M)], fmt))
+    return ''.join(rows)
+
+def generate_csv_stream(m_file, k_file, num_cases, min_value, max_value, seed=0, blocks=2, shard_size=10000, workers=None, fmt="csv", cache=result_cache):
+    """Streaming version of generate_csv, memory use and throughput do not depend on num_cases."""
+    rng = shard_rng(seed, "key")
+    n = rng.randint(min_value, max_value)
+    e = rng.randint(min_value, n-1)
+    with open(k_file, mode='w', newline='') as key_file:
+        key_file.write(format_row([e, n], fmt))
+    print(f"\nGenerated key - e: {hex(e)}, n: {hex(n)} (seed {seed})\n")
+
+    with open(m_file, mode='w', newline='', buffering=1 << 20) as message_file:
+        for block in range(blocks):
+            write_chunks(message_file, run_shards(generate_message_shard, num_cases, shard_size, workers, f"{seed}:{block}", min_value, e, n, fmt, cache=cache))
+
+            # Write the end of file indicator
+            message_file.write(end_row(4, fmt))
+    print(f"Generated {blocks}x{num_cases} messages to {m_file}")
+
 if __name__ == "__main__":
     NUM_CASES = 19  # Set your desired number of cases
     MAX_VAL_UPPER = int((2**256)-1)  # Set maximum value for n
     MIN_VAL = int(2**255)
     msg_file_name = "messages.csv"
     key_file_name = "key.csv"
-    generate_csv(msg_file_name, key_file_name, NUM_CASES, MIN_VAL, MAX_VAL_UPPER)
+    if len(sys.argv) > 1:
+        # Large runs: rsm_testcase_gen.py <num_cases> [seed]
+        generate_csv_stream(msg_file_name, key_file_name, int(sys.argv[1]), MIN_VAL, MAX_VAL_UPPER, seed=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+        reference.report()
+        result_cache.report()
+    else:
+        generate_csv(msg_file_name, key_file_name, NUM_CASES, MIN_VAL, MAX_VAL_UPPER)
     #generate_csv_pairs(file_name, NUM_CASES, MAX_VAL_UPPER, MAX_VAL_LOWER)
\ No newline at end of file
@@ -0,0 +1,130 @@
+import concurrent.futures
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+#Shared helpers for streaming test vector generation
+#The cases are split in shards of shard_size cases. Every shard gets its own random generator seeded from
+#(seed, shard), such that the output only depends on seed and shard_size and not on the number of workers.
+#Shards are computed in a process pool and written in order, with at most 2*workers shards in flight.
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_for_the_pynq_sd_card'))
+from rsa_reference import cache_digest, reference, active_cache
+
+EOL_ROW_TERMINATOR = '\r\n' #Same line terminator as csv.writer
+
+def shard_rng(seed, shard):
+    return random.Random(f"{seed}:{shard}")
+
+def to_binary_string(value, length=256):
+    return format(value, '0{}b'.format(length))
+
+def to_hex_string(value, length=256):
+    return format(value, '0{}x'.format(length // 4))
+
+def format_row(values, fmt, length=256):
+    #csv: binary strings followed by EOL as in the original generators, hex: hex strings
+    if fmt == "csv":
+        return ','.join([to_binary_string(value, length) for value in values] + ['EOL']) + EOL_ROW_TERMINATOR
+    elif fmt == "hex":
+        return ' '.join(to_hex_string(value, length) for value in values) + '\n'
+    raise ValueError(f"Unknown output format {fmt}")
+
+def end_row(fields, fmt, length=256):
+    #The all zero end of file indicator of the csv format
+    if fmt == "csv":
+        return format_row([0]*fields, fmt, length)
+    return ""
+
+def shards(num_cases, shard_size, first_case=0):
+    shard = 0
+    for start in range(first_case, first_case + num_cases, shard_size):
+        yield shard, start, min(shard_size, first_case + num_cases - start)
+        shard += 1
+
+def run_shards(worker, num_cases, shard_size, workers, *args, first_case=0, cache=None):
+    #Yields the output of worker(shard, start, count, *args) for every shard in order. With a ResultCache of
+    #rsa_reference.py, a shard is looked up by the hash of the sources of worker and its arguments, so only the
+    #shards that are not in the cache are computed. The reference lookups of the workers are added to reference
+    shard_args = ((shard, start, count) for shard, start, count in shards(num_cases, shard_size, first_case))
+    cache = active_cache(cache)
+    if cache is None:
+        for output, lookups in run_chunks(counted_shard, shard_args, workers, worker, *args):
+            reference.merge(lookups)
+            yield output
+        return
+    version = source_version(worker)
+    keyed_args = ((cache_digest("shard", worker.__module__, worker.__name__, version, shard, start, count, *args),
+                   shard, start, count) for shard, start, count in shard_args)
+    for digest, output, seconds, hit, lookups in run_chunks(cached_shard, keyed_args, workers, cache, worker, *args):
+        reference.merge(lookups)
+        cache.record(hit, seconds)
+        if not hit:
+            cache.put(digest, encode_output(output), seconds)
+        yield output
+
+def source_version(worker):
+    #Digest of the files the rows of a shard depend on: the module of worker with its helpers (pair_ranges, ...),
+    #the formatting of this file (format_row, to_hex_string, ...) and the reference of rsa_reference.py
+    sources = []
+    for module in sorted({worker.__module__, __name__, cache_digest.__module__}):
+        with open(sys.modules[module].__file__, mode='rb') as file:
+            sources.append(file.read())
+    return cache_digest(*sources)
+
+def counted_shard(shard, start, count, worker, *args):
+    #Runs in the worker process, returns the output and the reference lookups of the shard
+    start_counts = reference.counts()
+    output = worker(shard, start, count, *args)
+    return output, reference.lookups_since(start_counts)
+
+def cached_shard(digest, shard, start, count, cache, worker, *args):
+    #Runs in the worker process, the parent counts the lookups and stores the computed shards
+    entry = cache.load(digest)
+    if entry is not None:
+        return digest, decode_output(entry[0]), entry[1], True, (os.getpid(), 0, 0)
+    start_time = time.perf_counter()
+    output, lookups = counted_shard(shard, start, count, worker, *args)
+    return digest, output, time.perf_counter()-start_time, False, lookups
+
+def encode_output(output):
+    #The rows of a shard, a string or a tuple of strings, as uint8 arrays for the cache
+    parts = output if isinstance(output, tuple) else (output,)
+    arrays = {f"part{i}": np.frombuffer(part.encode(), dtype=np.uint8) for i, part in enumerate(parts)}
+    arrays["is_tuple"] = np.array(isinstance(output, tuple))
+    return arrays
+
+def decode_output(arrays):
+    parts = tuple(arrays[f"part{i}"].tobytes().decode() for i in range(len(arrays)-1))
+    return parts if arrays["is_tuple"] else parts[0]
+
+def run_chunks(worker, chunks, workers, *args):
+    #Yields the output of worker(*chunk, *args) for every tuple of the iterable chunks in order. The chunks
+    #are only taken from the iterable when a worker is free, workers=1 runs them in this process
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1:
+        for chunk in chunks:
+            yield worker(*chunk, *args)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for chunk in chunks:
+            pending.append(pool.submit(worker, *chunk, *args))
+            if len(pending) >= 2*workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def write_chunks(file, chunks, report_every=0):
+    #Writes the chunks with large buffered writes, returns the number of chunks written
+    written = 0
+    for chunk in chunks:
+        file.write(chunk)
+        written += 1
+        if report_every and written % report_every == 0:
+            print(f"Written {written} shards")
+    return written
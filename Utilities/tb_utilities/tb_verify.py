@@ -0,0 +1,269 @@
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+from tb_stream import run_chunks
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rsa_tests_gen'))
+import rsa_tests_gen
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files_for_the_pynq_sd_card'))
+import rsa_io
+from rsa_reference import reference, result_cache, golden_digest, active_cache
+
+#Parallel check of RSA outputs against the golden C = M^e mod n
+#A source yields cases (ID, M, e, n, C), where C is the output under test, or None when the output file has
+#fewer blocks than the input (M is None when it has more). The cases are checked in chunks of chunk_size in a
+#process pool, with at most 2*workers chunks in flight, such that memory use does not depend on the number of
+#cases. The result is a summary with the counts and the first max_diffs mismatches, in the order of the source.
+#Sources:
+#   csv_cases       - rsm_testcase_gen rows, M,e,n,C or M,C with the key of key.csv, csv (binary) or hex format
+#   rsa_tests_cases - an input and output file of the rsa_tests format of rsa_accelerator_tb.vhd
+#   otp_cases       - an input and an otp_hw/otp_sw message file of the PYNQ SD card, raw 32-bit words
+#   results_cases   - the results of the HLM models, {ID: (M, C)}
+#verify_words and verify_results check word arrays and HLM results in chunks of chunk_size blocks as well. With
+#a ResultCache (rsa_reference.py) the golden words of every chunk are kept on disk under the hash of its input
+#blocks and the key, so a chunk that was checked before is compared with one vectorized compare of the words,
+#and only a chunk with a changed input or key is computed again. A cache that is off, as result_cache without
+#RSA_RESULT_CACHE, is the same as cache=None.
+#The chunk functions return the lookups of the reference LRU of their worker, the parent adds them to the
+#shared reference, so reference.stats() counts the lookups of every worker.
+
+CHUNK_SIZE = 2000
+MAX_DIFFS = 10
+
+def verify_chunk(cases, max_diffs):
+    """Checks a list of cases, returns the counts, at most max_diffs (ID, M, expected, C) mismatches and the
+    reference lookups."""
+    start = reference.counts()
+    counts = {"checked": 0, "mismatches": 0, "missing": 0, "extra": 0}
+    diffs = []
+    for case_id, M, e, n, C in cases:
+        if M is None:
+            counts["extra"] += 1
+            continue
+        counts["checked"] += 1
+        expected = reference.encrypt(e, n, M)
+        if C != expected:
+            counts["missing" if C is None else "mismatches"] += 1
+            if len(diffs) < max_diffs:
+                diffs.append((case_id, M, expected, C))
+    return counts, diffs, reference.lookups_since(start)
+
+def chunked(cases, chunk_size):
+    cases = iter(cases)
+    while True:
+        chunk = list(itertools.islice(cases, chunk_size))
+        if not chunk:
+            return
+        yield (chunk,)
+
+def verify(cases, chunk_size=CHUNK_SIZE, workers=None, max_diffs=MAX_DIFFS):
+    """Checks every case of the iterable, returns the summary dict."""
+    chunks = chunked(cases, chunk_size)
+    head = list(itertools.islice(chunks, 2))
+    if len(head) < 2:
+        #A single chunk is not worth a process pool, and the HLM models call this from a thread
+        workers = 1
+    summary = {"checked": 0, "mismatches": 0, "missing": 0, "extra": 0, "diffs": []}
+    for counts, diffs, lookups in run_chunks(verify_chunk, itertools.chain(head, chunks), workers, max_diffs):
+        reference.merge(lookups)
+        for name, count in counts.items():
+            summary[name] += count
+        summary["diffs"].extend(diffs[:max_diffs-len(summary["diffs"])])
+    summary["errors"] = summary["mismatches"] + summary["missing"] + summary["extra"]
+    return summary
+
+def golden_words(inp_words, e, n, cache=result_cache):
+    """Returns the (blocks, 8) golden output words of a (blocks, 8) input word array, from the cache or computed here."""
+    cache = active_cache(cache)
+    inp_words = np.ascontiguousarray(inp_words, dtype='<u4').reshape(-1, rsa_tests_gen.BLOCK_WORDS)
+    compute = lambda: {"words": rsa_io.msg2word(reference.encrypt_array(e, n, rsa_tests_gen.words_to_ints(inp_words)))}
+    arrays = compute() if cache is None else cache.cached(golden_digest(e, n, inp_words), compute)
+    return arrays["words"].reshape(-1, rsa_tests_gen.BLOCK_WORDS)
+
+def verify_words_chunk(start, inp_words, otp_words, e, n, max_diffs, cache):
+    """Checks the output words of blocks start.. against the golden words of the input words, returns the counts, at
+    most max_diffs mismatches, the cache lookup and the reference lookups. Runs in the worker, the parent counts the
+    lookups and stores the computed golden words."""
+    start_counts = reference.counts()
+    inp_words = np.ascontiguousarray(inp_words, dtype='<u4')
+    digest = golden_digest(e, n, inp_words)
+    entry = cache.load(digest) if cache is not None and len(inp_words) else None
+    if entry is not None:
+        golden, seconds, computed = entry[0]["words"].reshape(-1, rsa_tests_gen.BLOCK_WORDS), entry[1], None
+    else:
+        start_time = time.perf_counter()
+        golden = golden_words(inp_words, e, n, None)
+        seconds = time.perf_counter()-start_time
+        computed = golden if len(inp_words) else None
+    common = min(len(golden), len(otp_words))
+    wrong = np.flatnonzero(np.any(golden[:common] != otp_words[:common], axis=1))
+    counts = {"checked": len(golden), "mismatches": len(wrong), "missing": len(golden) - common, "extra": len(otp_words) - common}
+    diffs = []
+    to_int = lambda words, block: rsa_tests_gen.words_to_ints(words[block:block+1])[0]
+    for block in itertools.chain(wrong[:max_diffs], range(common, min(len(golden), common+max_diffs))):
+        if len(diffs) == max_diffs:
+            break
+        C = to_int(otp_words, block) if block < common else None
+        diffs.append((start+int(block), to_int(inp_words, block), to_int(golden, block), C))
+    return counts, diffs, digest, computed, seconds, entry is not None, reference.lookups_since(start_counts)
+
+def verify_words(inp_words, otp_words, e, n, workers=None, chunk_size=CHUNK_SIZE, max_diffs=MAX_DIFFS, cache=result_cache):
+    """Checks a (blocks, 8) output word array against the golden words of the input, returns the summary dict."""
+    cache = active_cache(cache)
+    inp_words = np.asarray(inp_words).reshape(-1, rsa_tests_gen.BLOCK_WORDS)
+    otp_words = np.asarray(otp_words).reshape(-1, rsa_tests_gen.BLOCK_WORDS)
+    blocks = max(len(inp_words), len(otp_words))
+    if blocks <= chunk_size:
+        workers = 1
+    chunks = ((start, inp_words[start:start+chunk_size], otp_words[start:start+chunk_size]) for start in range(0, blocks, chunk_size))
+    summary = {"checked": 0, "mismatches": 0, "missing": 0, "extra": 0, "diffs": []}
+    for counts, diffs, digest, computed, seconds, hit, lookups in run_chunks(verify_words_chunk, chunks, workers, e, n, max_diffs, cache):
+        reference.merge(lookups)
+        if cache is not None and (hit or computed is not None):
+            cache.record(hit, seconds)
+            if computed is not None:
+                cache.put(digest, {"words": computed}, seconds)
+        for name, count in counts.items():
+            summary[name] += count
+        summary["diffs"].extend(diffs[:max_diffs-len(summary["diffs"])])
+    summary["errors"] = summary["mismatches"] + summary["missing"] + summary["extra"]
+    return summary
+
+def verify_results(results, keys, message_keys=None, chunk_size=CHUNK_SIZE, max_diffs=MAX_DIFFS, cache=result_cache):
+    """Checks the HLM results {ID: (M, C)} against the golden outputs of every key, chunk by chunk, returns the summary dict."""
+    cache = active_cache(cache)
+    if cache is None:
+        return verify(results_cases(results, keys, message_keys), chunk_size, max_diffs=max_diffs)
+    summary = {"checked": 0, "mismatches": 0, "missing": 0, "extra": 0, "diffs": []}
+    groups = {}
+    for case_id in results:
+        groups.setdefault(message_keys.get(case_id, 0) if message_keys else 0, []).append(case_id)
+    for key_id, case_ids in groups.items():
+        e, n = keys[key_id]
+        for start in range(0, len(case_ids), chunk_size):
+            chunk = case_ids[start:start+chunk_size]
+            golden = rsa_tests_gen.words_to_ints(golden_words(rsa_io.msg2word([results[case_id][0] for case_id in chunk]), e, n, cache))
+            for case_id, expected in zip(chunk, golden):
+                M, C = results[case_id]
+                summary["checked"] += 1
+                if C != expected:
+                    summary["missing" if C is None else "mismatches"] += 1
+                    if len(summary["diffs"]) < max_diffs:
+                        summary["diffs"].append((case_id, M, expected, C))
+    summary["errors"] = summary["mismatches"] + summary["missing"]
+    return summary
+
+def print_summary(summary, name=""):
+    """Prints the counts and the first mismatches, returns the number of errors."""
+    print(f"{name + ': ' if name else ''}{summary['checked']} checked, {summary['mismatches']} mismatches, "
+          f"{summary['missing']} missing, {summary['extra']} extra outputs")
+    for case_id, M, expected, C in summary["diffs"]:
+        print(f"    {case_id}: M {M:#x}\n        expected {expected:#x}\n        got      {'missing' if C is None else format(C, '#x')}")
+    if summary["errors"] > len(summary["diffs"]):
+        print(f"    ... {summary['errors'] - len(summary['diffs'])} more")
+    return summary["errors"]
+
+def parse_row(line):
+    """Values of a csv (binary, EOL terminated) or hex (space separated) row of tb_stream.format_row."""
+    if ',' in line:
+        return [int(field, 2) for field in line.strip().split(',') if field and field != 'EOL']
+    return [int(field, 16) for field in line.split()]
+
+def read_key(k_file):
+    """Returns (e, n) from a key.csv of rsm_testcase_gen."""
+    with open(k_file, mode='r') as file:
+        e, n = parse_row(file.readline())
+    return e, n
+
+def csv_cases(file_name, key=None):
+    """Cases of a M,e,n,C file, or of a M,C file with key = (e, n). The all zero end rows are skipped."""
+    with open(file_name, mode='r') as file:
+        for line_number, line in enumerate(file, 1):
+            values = parse_row(line)
+            if not any(values):
+                continue
+            if len(values) == 4:
+                M, e, n, C = values
+            elif len(values) == 2 and key is not None:
+                (M, C), (e, n) = values, key
+            else:
+                raise ValueError(f"{file_name}:{line_number} has {len(values)} values, expected M,e,n,C or M,C with a key file")
+            yield line_number, M, e, n, C
+
+def word_cases(inp_words, otp_words, e, n, block_chunk=CHUNK_SIZE):
+    """Cases of two (blocks, 8) uint32 arrays, converted to ints block_chunk blocks at a time."""
+    for start in range(0, max(len(inp_words), len(otp_words)), block_chunk):
+        inp = rsa_tests_gen.words_to_ints(inp_words[start:start+block_chunk])
+        otp = rsa_tests_gen.words_to_ints(otp_words[start:start+block_chunk])
+        for block, (M, C) in enumerate(itertools.zip_longest(inp, otp), start):
+            yield block, M, e, n, C
+
+def rsa_tests_cases(inp_file, otp_file):
+    """Cases of an rsa_tests testcase, the exponent is e or d after the COMMAND of the input header."""
+    key = rsa_tests_gen.read_header(inp_file)
+    exponent = key["e"] if key["command"] == rsa_tests_gen.COMMAND_ENCRYPT else key["d"]
+    return word_cases(rsa_tests_gen.read_words(inp_file), rsa_tests_gen.read_words(otp_file), exponent, key["n"])
+
+def otp_cases(inp_file, otp_file, e, n):
+    """Cases of a raw message file of the SD card and its output, both memory mapped."""
+    blocks = lambda file_name: rsa_io.map_words(file_name).reshape(-1, rsa_io.C_BLOCKSIZE_IN_32_BIT_WORDS)
+    return word_cases(blocks(inp_file), blocks(otp_file), e, n)
+
+def results_cases(results, keys, message_keys=None):
+    """Cases of the HLM results {ID: (M, C)}, the key of a message is keys[message_keys.get(ID, 0)]."""
+    for case_id, (M, C) in results.items():
+        e, n = keys[message_keys.get(case_id, 0) if message_keys else 0]
+        yield case_id, M, e, n, C
+
+def verify_rsa_tests(folder, prefix, num_sizes, workers=None, cache=result_cache):
+    """Checks every testcase of an rsa_tests corpus, returns the number of errors."""
+    cache = active_cache(cache)
+    errors = 0
+    for testcase in range(2*num_sizes):
+        inp_file, otp_file = rsa_tests_gen.testcase_files(folder, prefix, testcase, num_sizes)
+        if cache is None:
+            summary = verify(rsa_tests_cases(inp_file, otp_file), workers=workers)
+        else:
+            key = rsa_tests_gen.read_header(inp_file)
+            exponent = key["e"] if key["command"] == rsa_tests_gen.COMMAND_ENCRYPT else key["d"]
+            summary = verify_words(rsa_tests_gen.read_words(inp_file), rsa_tests_gen.read_words(otp_file), exponent, key["n"], workers, cache=cache)
+        errors += print_summary(summary, os.path.basename(otp_file))
+    return errors
+
+def verify_otp(folder, otp="sw", n=rsa_tests_gen.KEY_N, e=rsa_tests_gen.KEY_E, d=rsa_tests_gen.KEY_D, workers=None, cache=result_cache):
+    """Checks the otp_hw or otp_sw messages of a crypto folder, pt files are encrypted with e and ct files decrypted with d."""
+    cache = active_cache(cache)
+    errors = 0
+    for inp_name in sorted(os.listdir(os.path.join(folder, "inp_messages"))):
+        otp_name = ("ct" if inp_name.startswith("pt") else "pt") + inp_name[2:].replace("_in", "_out")
+        otp_file = os.path.join(folder, f"otp_{otp}_messages", otp_name)
+        exponent = e if inp_name.startswith("pt") else d
+        inp_file = os.path.join(folder, "inp_messages", inp_name)
+        if cache is None:
+            summary = verify(otp_cases(inp_file, otp_file, exponent, n), workers=workers)
+        else:
+            summary = verify_words(rsa_io.map_words(inp_file), rsa_io.map_words(otp_file), exponent, n, workers, cache=cache)
+        errors += print_summary(summary, f"otp_{otp}_messages/{otp_name}")
+    return errors
+
+if __name__ == "__main__":
+    #tb_verify.py csv <file> [key.csv]
+    #tb_verify.py rsa_tests <folder> <prefix> <num_sizes>
+    #tb_verify.py otp <crypto folder> [hw|sw]
+    COMMAND = sys.argv[1] if len(sys.argv) > 1 else "rsa_tests"
+    if COMMAND == "csv":
+        KEY = read_key(sys.argv[3]) if len(sys.argv) > 3 else None
+        ERRORS = print_summary(verify(csv_cases(sys.argv[2], KEY)), sys.argv[2])
+    elif COMMAND == "rsa_tests":
+        ERRORS = verify_rsa_tests(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    elif COMMAND == "otp":
+        ERRORS = verify_otp(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "sw")
+    else:
+        raise ValueError(f"Unknown command {COMMAND}, use csv, rsa_tests or otp")
+    print("All outputs are correct!" if ERRORS == 0 else f"There were {ERRORS} errors")
+    reference.report()
+    result_cache.report()
+    sys.exit(1 if ERRORS else 0)